@@ -0,0 +1,91 @@
+import time
+import random
+import argparse
+
+from pair_selection import UnusedImageSampler
+
+
+def make_catalogue(n, cases=4):
+    return [
+        (f"Case{k % cases}", f"img_{k:06d}.jpg")
+        for k in range(n)
+    ]
+
+
+def image_key(item):
+    return f"{item[0]}/{item[1]}"
+
+
+def list_rebuild_pair(all_img_data, used_images):
+    """
+    原来的 get_new_pair：每次把 used_images 转成 set 并重建候选列表。
+    """
+    used = set(used_images)
+
+    candidates = [
+        item for item in all_img_data
+        if image_key(item) not in used
+    ]
+
+    if len(candidates) >= 2:
+        pair = random.sample(candidates, 2)
+    else:
+        pair = random.sample(all_img_data, 2)
+
+    used_images.extend([image_key(pair[0]), image_key(pair[1])])
+    return pair
+
+
+def sampler_pair(all_img_data, sampler, used_images):
+    picked = sampler.draw_pair()
+
+    if picked is None:
+        picked = random.sample(range(len(all_img_data)), 2)
+
+    pair = [all_img_data[picked[0]], all_img_data[picked[1]]]
+    used_images.update(image_key(item) for item in pair)
+    return pair
+
+
+def bench_list(all_img_data, draws):
+    used_images = []
+    start = time.perf_counter()
+    for _ in range(draws):
+        list_rebuild_pair(all_img_data, used_images)
+    return time.perf_counter() - start
+
+
+def bench_sampler(all_img_data, draws):
+    start = time.perf_counter()
+    sampler = UnusedImageSampler(len(all_img_data))
+    used_images = set()
+    for _ in range(draws):
+        sampler_pair(all_img_data, sampler, used_images)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the per-pair cost of the old list-rebuild sampler and UnusedImageSampler."
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[200, 10_000, 100_000])
+    parser.add_argument("--draws", type=int, default=30, help="Pairs per simulated session.")
+    parser.add_argument("--sessions", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    print(f"{'images':>8} {'old us/pair':>12} {'new us/pair':>12} {'speedup':>8}")
+
+    for n in args.sizes:
+        all_img_data = make_catalogue(n)
+        draws = args.draws * args.sessions
+
+        old = sum(bench_list(all_img_data, args.draws) for _ in range(args.sessions))
+        new = sum(bench_sampler(all_img_data, args.draws) for _ in range(args.sessions))
+
+        print(f"{n:>8} {old / draws * 1e6:>12.1f} {new / draws * 1e6:>12.1f} {old / new:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
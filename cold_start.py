@@ -0,0 +1,87 @@
+import time
+import threading
+
+from survey_metrics import METRICS
+
+# 模块在进程内第一次执行问卷脚本时导入，以此作为启动时刻
+BOOT_TIME = time.monotonic()
+
+
+class ColdStart:
+    """
+    进程启动阶段计时。mark() 记录某个阶段第一次到达时距模块导入的秒数；
+    warm_up() 在后台线程里依次运行预热步骤（授权、读目录等），
+    让第一位受访者不用在点击时等这些一次性开销。结果写入指标并打印到日志。
+    """
+
+    def __init__(self, registry, started=None):
+        self.registry = registry
+        self.started = BOOT_TIME if started is None else started
+        self.phases = {}
+        self.steps = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def mark(self, phase):
+        with self._lock:
+            if phase in self.phases:
+                return
+            seconds = time.monotonic() - self.started
+            self.phases[phase] = seconds
+
+        self.registry.set("cold_start_phase_seconds", seconds, phase=phase)
+        print(f"[cold-start] {phase}: {seconds:.2f}s after boot")
+
+    def warm_up(self, steps):
+        """
+        steps 为 [(名称, 无参函数), ...]。只会启动一次，失败的步骤不影响后面的步骤，
+        之后由正常请求路径再试。
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(list(steps),),
+                name="warm-up",
+                daemon=True
+            )
+
+        self._thread.start()
+
+    def _run(self, steps):
+        for name, fn in steps:
+            start = time.monotonic()
+
+            try:
+                fn()
+            except Exception as e:
+                with self._lock:
+                    self.errors[name] = str(e)
+                self.registry.inc("warmup_errors_total", step=name)
+                print(f"[cold-start] warm-up {name} failed: {e}")
+                continue
+
+            seconds = time.monotonic() - start
+            with self._lock:
+                self.steps[name] = seconds
+            self.registry.set("warmup_step_seconds", seconds, step=name)
+            print(f"[cold-start] warm-up {name}: {seconds:.2f}s")
+
+        self.mark("warm")
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def report(self):
+        with self._lock:
+            return {
+                "phases": dict(self.phases),
+                "warm_up": dict(self.steps),
+                "errors": dict(self.errors)
+            }
+
+
+COLD_START = ColdStart(METRICS)
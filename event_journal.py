@@ -0,0 +1,201 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class EventJournal:
+    """
+    本地 append-only 事件日志（SQLite WAL 模式）。
+    每条事件在写 Google Sheet 之前先落盘，进程重启或标签页关闭后仍可重放。
+    目标表始终拒收的事件标记为隔离（failed_at、error），不再重放，留待人工处理。
+    synchronous=NORMAL：提交只写 WAL，由 checkpoint 批量 fsync；
+    进程崩溃不会丢数据，只有整机掉电可能丢失最近一次 checkpoint 之后的事件。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                event_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                delivered_at REAL,
+                failed_at REAL,
+                error TEXT
+            )
+            """
+        )
+
+        # 旧日志没有隔离相关的列时补上
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(events)")}
+        for col, kind in (("failed_at", "REAL"), ("error", "TEXT")):
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE events ADD COLUMN {col} {kind}")
+
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_events_pending "
+            "ON events (delivered_at)"
+        )
+        self._conn.commit()
+
+    def append(self, events):
+        now = time.time()
+        rows = [
+            (event["event_id"], json.dumps(event, ensure_ascii=False), now)
+            for event in events
+        ]
+
+        with self._lock:
+            # event_id 已存在时忽略，重复提交不会产生重复记录
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO events (event_id, payload, created_at) "
+                "VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def mark_delivered(self, event_ids):
+        now = time.time()
+
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE events SET delivered_at = ? WHERE event_id = ? AND failed_at IS NULL",
+                [(now, event_id) for event_id in event_ids]
+            )
+            self._conn.commit()
+
+    def update(self, events):
+        """
+        改写尚未送达的事件（例如缓冲中的事件重新编号之后）。
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE events SET payload = ? WHERE event_id = ? AND delivered_at IS NULL",
+                [(json.dumps(event, ensure_ascii=False), event["event_id"]) for event in events]
+            )
+            self._conn.commit()
+
+    def quarantine(self, event_id, error):
+        """
+        隔离一条目标表始终拒收的事件：保留在日志里，但不再重放。
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE events SET failed_at = ?, error = ? WHERE event_id = ? AND delivered_at IS NULL",
+                (time.time(), error, event_id)
+            )
+            self._conn.commit()
+
+    def quarantined(self):
+        """
+        返回 [(事件, 错误信息), ...]，按写入顺序。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload, error FROM events WHERE failed_at IS NOT NULL ORDER BY rowid"
+            ).fetchall()
+
+        return [(json.loads(payload), error) for payload, error in rows]
+
+    def states(self, event_ids):
+        """
+        日志中这些事件的状态：{event_id: "delivered" / "failed" / "pending"}，日志里没有的不返回。
+        """
+        with self._lock:
+            rows = [
+                self._conn.execute(
+                    "SELECT event_id, delivered_at, failed_at FROM events WHERE event_id = ?",
+                    (event_id,)
+                ).fetchone()
+                for event_id in event_ids
+            ]
+
+        states = {}
+        for row in rows:
+            if row is None:
+                continue
+            event_id, delivered_at, failed_at = row
+            if delivered_at is not None:
+                states[event_id] = "delivered"
+            elif failed_at is not None:
+                states[event_id] = "failed"
+            else:
+                states[event_id] = "pending"
+
+        return states
+
+    def discard(self, event_ids):
+        """
+        删除尚未送达的事件（例如会话内被撤回、不再需要写入的投票）。
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM events WHERE event_id = ? AND delivered_at IS NULL",
+                [(event_id,) for event_id in event_ids]
+            )
+            self._conn.commit()
+
+    def pending(self, limit=None):
+        sql = "SELECT payload FROM events WHERE delivered_at IS NULL AND failed_at IS NULL ORDER BY rowid"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [json.loads(payload) for (payload,) in rows]
+
+    def pending_count(self):
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM events WHERE delivered_at IS NULL AND failed_at IS NULL"
+            ).fetchone()
+        return count
+
+    def purge_delivered(self, older_than):
+        """
+        删除送达时间早于 older_than 秒之前的记录，控制文件大小。
+        """
+        cutoff = time.time() - older_than
+
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM events WHERE delivered_at IS NOT NULL AND delivered_at < ?",
+                (cutoff,)
+            )
+            self._conn.commit()
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+def replay_pending(journal, events, write_batch, logged_event_ids, batch_size=500):
+    """
+    把日志中尚未确认送达的事件补写到目标表。
+    logged_event_ids() 返回目标表里已有的 event_id 集合：
+    写入成功但未来得及标记送达的事件只标记，不重复写入。
+    返回实际补写的事件数。
+    """
+    if not events:
+        return 0
+
+    existing = logged_event_ids()
+
+    already = [e["event_id"] for e in events if e["event_id"] in existing]
+    if already:
+        journal.mark_delivered(already)
+
+    todo = [e for e in events if e["event_id"] not in existing]
+
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        write_batch(batch)
+        journal.mark_delivered([e["event_id"] for e in batch])
+
+    return len(todo)
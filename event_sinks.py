@@ -0,0 +1,382 @@
+import os
+import csv
+import glob
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+# 事件日志的列，所有后端共用
+EVENT_COLUMNS = [
+    "event_id",
+    "participant_id",
+    "event_seq",
+    "event_type",
+    "timestamp",
+    "lang",
+    "gender",
+    "age_group",
+    "user_type",
+    "question_number",
+    "response_index",
+    "vote_count",
+    "skip_count",
+    "completed",
+    "category",
+    "left_img",
+    "right_img",
+    "winner",
+    "case_l",
+    "case_r",
+    "removed_response_index",
+    "removed_category",
+    "removed_left_img",
+    "removed_right_img",
+    "removed_winner",
+    "removed_case_l",
+    "removed_case_r",
+    "rng_seed"
+]
+
+
+class EventSink:
+    """
+    事件后端的公共接口。
+    所有后端使用同一套列（EVENT_COLUMNS），只负责 append-only 写入、
+    返回已写入的 event_id，以及按写入顺序读回全部事件。
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+
+    def append(self, events):
+        raise NotImplementedError
+
+    def logged_event_ids(self):
+        return {event["event_id"] for event in self.read_events()}
+
+    def read_events(self):
+        raise NotImplementedError
+
+    def read_page(self, start, limit):
+        """
+        按写入顺序读取第 start 行起（0 起，不含表头）的最多 limit 条事件，用于分页导出。
+        """
+        return self.read_events()[start:start + limit]
+
+    def to_rows(self, events):
+        return [
+            [event.get(col, "") for col in self.columns]
+            for event in events
+        ]
+
+
+def column_letter(n):
+    """
+    1 -> A，27 -> AA。
+    """
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+class GoogleSheetsSink(EventSink):
+    """
+    现有行为：append_rows 写入 Google Sheet 的 Events 表。
+    get_worksheet 延迟调用，避免选择其他后端时也去做授权。
+    """
+
+    def __init__(self, columns, get_worksheet):
+        super().__init__(columns)
+        self._get_worksheet = get_worksheet
+
+    def append(self, events):
+        if not events:
+            return
+
+        # 使用 RAW，避免 Google Sheet 自动转换时间或数字格式
+        self._get_worksheet().append_rows(
+            self.to_rows(events),
+            value_input_option="RAW"
+        )
+
+    def logged_event_ids(self):
+        return set(self._get_worksheet().col_values(1)[1:])
+
+    def read_events(self):
+        values = self._get_worksheet().get_all_values()
+        if not values:
+            return []
+
+        header = values[0]
+        return [dict(zip(header, row)) for row in values[1:]]
+
+    def read_page(self, start, limit):
+        # 第 1 行是表头，数据从第 2 行开始；只请求这一页的行范围
+        worksheet = self._get_worksheet()
+        header = worksheet.row_values(1)
+        first = start + 2
+        last = first + limit - 1
+        rows = worksheet.get(f"A{first}:{column_letter(len(header))}{last}")
+        return [
+            dict(zip(header, row + [""] * (len(header) - len(row))))
+            for row in rows
+        ]
+
+
+class SQLiteSink(EventSink):
+    def __init__(self, columns, path):
+        super().__init__(columns)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+        column_sql = ", ".join(
+            f"{col} TEXT PRIMARY KEY" if col == "event_id" else col
+            for col in self.columns
+        )
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS events ({column_sql})")
+
+        # 旧库缺少后来新增的列（例如 rng_seed）时补上，旧行这些列为空
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(events)")}
+        for col in self.columns:
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE events ADD COLUMN {col}")
+        self._conn.commit()
+
+    def append(self, events):
+        if not events:
+            return
+
+        placeholders = ", ".join("?" for _ in self.columns)
+        # 与 Parquet 后端一样全部存为字符串：列没有类型，整数和布尔值原样写入会随取值变化
+        # （超过 64 位有符号整数范围的值会直接报错）
+        rows = [[str(value) for value in row] for row in self.to_rows(events)]
+
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO events ({', '.join(self.columns)}) "
+                    f"VALUES ({placeholders})",
+                    rows
+                )
+            except Exception:
+                # 失败的批次不能留下一半已插入的行，否则会随下一次 commit 写入
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def logged_event_ids(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT event_id FROM events").fetchall()
+        return {event_id for (event_id,) in rows}
+
+    def read_events(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM events ORDER BY rowid"
+            ).fetchall()
+        return [dict(zip(self.columns, row)) for row in rows]
+
+    def read_page(self, start, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM events ORDER BY rowid LIMIT ? OFFSET ?",
+                (limit, start)
+            ).fetchall()
+        return [dict(zip(self.columns, row)) for row in rows]
+
+
+class RotatingFileSink(EventSink):
+    """
+    按文件轮转写入本地 CSV 或 Parquet。
+    CSV 追加到当前文件，超过 max_rows 行后换新文件；
+    Parquet 文件不能追加，每个批次写成一个分片文件（需要 pyarrow）。
+    """
+
+    def __init__(self, columns, directory, fmt="csv", max_rows=50000):
+        super().__init__(columns)
+
+        if fmt not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported file sink format: {fmt}")
+
+        self.directory = directory
+        self.fmt = fmt
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._current = None
+        self._current_rows = 0
+        # 路径 -> (文件大小, 行数)；轮转后的文件不再变化，分页时不用重复计数
+        self._row_counts = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _files(self):
+        return sorted(glob.glob(os.path.join(self.directory, f"events-*.{self.fmt}")))
+
+    def _new_path(self):
+        return os.path.join(
+            self.directory,
+            f"events-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}.{self.fmt}"
+        )
+
+    def append(self, events):
+        if not events:
+            return
+
+        with self._lock:
+            if self.fmt == "parquet":
+                self._append_parquet(events)
+            else:
+                self._append_csv(events)
+
+    def _append_csv(self, events):
+        if self._current is None or self._current_rows >= self.max_rows:
+            self._current = self._new_path()
+            self._current_rows = 0
+
+        is_new = not os.path.exists(self._current)
+
+        with open(self._current, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(self.columns)
+            writer.writerows(self.to_rows(events))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._current_rows += len(events)
+
+    def _append_parquet(self, events):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            col: [str(event.get(col, "")) for event in events]
+            for col in self.columns
+        })
+        pq.write_table(table, self._new_path())
+
+    def read_events(self):
+        events = []
+
+        for path in self._files():
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                events.extend(pq.read_table(path).to_pylist())
+            else:
+                with open(path, newline="", encoding="utf-8") as f:
+                    events.extend(csv.DictReader(f))
+
+        return events
+
+    def _row_count(self, path):
+        size = os.path.getsize(path)
+        cached = self._row_counts.get(path)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            rows = pq.ParquetFile(path).metadata.num_rows
+        else:
+            with open(path, newline="", encoding="utf-8") as f:
+                # 与 DictReader 一致：跳过空行，不计表头
+                rows = max(sum(1 for row in csv.reader(f) if row) - 1, 0)
+
+        self._row_counts[path] = (size, rows)
+        return rows
+
+    def _read_file(self, path, skip, limit):
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.read_table(path).slice(skip, limit).to_pylist()
+
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(islice(csv.DictReader(f), skip, skip + limit))
+
+    def read_page(self, start, limit):
+        """
+        按文件的行数跳过 start 之前的文件，只读取这一页所在的文件。
+        """
+        events = []
+        offset = 0
+
+        for path in self._files():
+            if len(events) >= limit:
+                break
+
+            rows = self._row_count(path)
+            if offset + rows > start:
+                skip = max(start - offset, 0)
+                events.extend(self._read_file(path, skip, limit - len(events)))
+            offset += rows
+
+        return events
+
+
+class MemorySink(EventSink):
+    """
+    内存后端，用于离线运行和压测。
+    latency 秒可以模拟 Google Sheets 的网络往返。
+    """
+
+    def __init__(self, columns, latency=0.0):
+        super().__init__(columns)
+        self.latency = latency
+        self.events = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def append(self, events):
+        if not events:
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls += 1
+            self.events.extend(
+                dict(zip(self.columns, row))
+                for row in self.to_rows(events)
+            )
+
+    def read_events(self):
+        with self._lock:
+            return list(self.events)
+
+
+SINK_BACKENDS = ["gsheets", "sqlite", "csv", "parquet", "memory"]
+
+
+def make_sink(config, columns, get_worksheet):
+    """
+    根据配置创建事件后端。config 来自 st.secrets["event_sink"] 或环境变量：
+    backend = gsheets（默认）/ sqlite / csv / parquet / memory，path 为本地路径。
+    """
+    backend = config.get("backend", "gsheets")
+
+    if backend == "gsheets":
+        return GoogleSheetsSink(columns, get_worksheet)
+    if backend == "sqlite":
+        return SQLiteSink(columns, config.get("path", "events.sqlite3"))
+    if backend in ("csv", "parquet"):
+        return RotatingFileSink(
+            columns,
+            config.get("path", "event_log"),
+            fmt=backend,
+            max_rows=int(config.get("max_rows", 50000))
+        )
+    if backend == "memory":
+        return MemorySink(columns, latency=float(config.get("latency", 0.0)))
+
+    raise ValueError(
+        f"Unknown event sink backend: {backend} (expected one of {', '.join(SINK_BACKENDS)})"
+    )
@@ -0,0 +1,311 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from event_journal import replay_pending
+
+PENDING = "pending"
+RETRYING = "retrying"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+# 这些状态码说明是请求内容本身有问题（某条事件的值不合法、批次过大），重试同样的批次不会成功；
+# 401 / 403 / 404 是配置问题，与具体事件无关，照常退避重试，修好配置后继续写入
+PERMANENT_STATUS_CODES = {400, 413, 422}
+
+
+def is_permanent_error(error):
+    """
+    判断写入错误是否与批次内容有关：有 HTTP 状态码时按状态码判断，
+    否则把值和类型错误（例如整数超出 SQLite 范围）视为永久错误，其余（网络、数据库锁等）视为临时错误。
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status in PERMANENT_STATUS_CODES
+
+    return isinstance(
+        error,
+        (TypeError, ValueError, OverflowError, sqlite3.InterfaceError, sqlite3.DataError)
+    )
+
+
+class BackgroundEventWriter:
+    """
+    进程级后台写入线程。
+    所有会话的事件进入同一个队列，按时间窗口 / 批量大小合并成一次 write_batch 调用，
+    点击不再等待 Google Sheets 的网络往返。
+    写入失败的批次：临时错误退避后重试；永久错误把批次二分后分别写入，
+    最后单独写不进去的事件隔离到日志里（状态为 failed），不会堵住其他会话的事件。
+    送达状态按 event_id 提供给各会话查询。
+    传入 journal 时，事件先写本地日志再入队；启动时先重放上一个进程未送达的事件。
+    """
+
+    def __init__(
+        self,
+        write_batch,
+        max_batch_size=200,
+        max_wait=2.0,
+        retry_delay=2.0,
+        max_retry_delay=60.0,
+        status_ttl=3600.0,
+        journal=None,
+        logged_event_ids=None,
+        journal_retention=86400.0,
+        is_permanent=is_permanent_error
+    ):
+        self._write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.status_ttl = status_ttl
+        self.journal_retention = journal_retention
+        self._is_permanent = is_permanent
+
+        self._journal = journal
+        self._logged_event_ids = logged_event_ids or set
+        # 必须在接受新事件之前取快照，否则新事件会被重放一次、再正常写入一次
+        self._replay_events = journal.pending() if journal is not None else []
+
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._status = {}
+        self._settled_at = {}
+
+        self.last_error = ""
+        self.batches_written = 0
+        self.events_written = 0
+        self.failures = 0
+        self.replayed = 0
+        self.quarantined = 0
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name="event-writer",
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, events):
+        if self._journal is not None:
+            try:
+                self._journal.append(events)
+            except Exception as e:
+                self.last_error = f"journal: {e}"
+
+        with self._cond:
+            for event in events:
+                self._status[event["event_id"]] = PENDING
+
+        for event in events:
+            self._queue.put(event)
+
+    def hold(self, events):
+        """
+        只写本地日志、暂不入队：按会话缓冲的事件先落盘，之后再 submit。
+        进程重启时这些事件和其他未送达事件一样被重放。
+        """
+        if self._journal is None:
+            return
+
+        try:
+            self._journal.append(events)
+        except Exception as e:
+            self.last_error = f"journal: {e}"
+
+    def update_held(self, events):
+        """
+        缓冲中的事件内容变化（例如重新编号）后，同步到本地日志。
+        """
+        if self._journal is None:
+            return
+
+        try:
+            self._journal.update(events)
+        except Exception as e:
+            self.last_error = f"journal: {e}"
+
+    def discard(self, event_ids):
+        """
+        丢弃仍在缓冲中（hold 之后、submit 之前）的事件。
+        """
+        if self._journal is None:
+            return
+
+        try:
+            self._journal.discard(event_ids)
+        except Exception as e:
+            self.last_error = f"journal: {e}"
+
+    def status(self, event_ids):
+        """
+        各事件的状态：pending / retrying / delivered / failed，不认识的事件为 None。
+        内存中的状态超过 status_ttl 后会被清理，这时再查本地日志（保留 journal_retention），
+        隔了很久才回来的会话不会把已经送达的事件再提交一次。
+        """
+        with self._cond:
+            result = {
+                event_id: self._status.get(event_id)
+                for event_id in event_ids
+            }
+
+        unknown = [event_id for event_id, status in result.items() if status is None]
+
+        if unknown and self._journal is not None:
+            try:
+                result.update(self._journal.states(unknown))
+            except Exception as e:
+                self.last_error = f"journal: {e}"
+
+        return result
+
+    def wait(self, event_ids, timeout):
+        """
+        等待这些事件全部送达或被隔离，最多 timeout 秒。返回是否全部送达。
+        """
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                states = [self._status.get(i) for i in event_ids]
+                if all(s in (DELIVERED, FAILED) for s in states):
+                    return all(s == DELIVERED for s in states)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+
+                self._cond.wait(remaining)
+
+    def backlog(self):
+        with self._cond:
+            return sum(1 for s in self._status.values() if s not in (DELIVERED, FAILED))
+
+    def metrics(self):
+        return {
+            "backlog": self.backlog(),
+            "queue_size": self._queue.qsize(),
+            "batches_written": self.batches_written,
+            "events_written": self.events_written,
+            "failures": self.failures,
+            "replayed": self.replayed,
+            "quarantined": self.quarantined
+        }
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _set_status(self, batch, status):
+        now = time.monotonic()
+
+        with self._cond:
+            for event in batch:
+                self._status[event["event_id"]] = status
+                if status in (DELIVERED, FAILED):
+                    self._settled_at[event["event_id"]] = now
+            self._cond.notify_all()
+
+        if status == DELIVERED and self._journal is not None:
+            self._journal.mark_delivered([event["event_id"] for event in batch])
+
+    def _quarantine(self, event, error):
+        self.quarantined += 1
+
+        if self._journal is not None:
+            try:
+                self._journal.quarantine(event["event_id"], error)
+            except Exception as e:
+                self.last_error = f"journal: {e}"
+
+        self._set_status([event], FAILED)
+
+    def _deliver(self, batch):
+        """
+        写入一个批次。临时错误在原地退避重试（后端暂时不可用时，后面的批次同样写不进去）；
+        永久错误把批次二分，分别写入，只有单独一条也写不进去的事件才被隔离。
+        """
+        delay = self.retry_delay
+
+        while True:
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+
+                if self._is_permanent(e):
+                    break
+
+                self._set_status(batch, RETRYING)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+
+            self.batches_written += 1
+            self.events_written += len(batch)
+            self.last_error = ""
+            self._set_status(batch, DELIVERED)
+            return
+
+        if len(batch) == 1:
+            self._quarantine(batch[0], self.last_error)
+            return
+
+        middle = len(batch) // 2
+        self._deliver(batch[:middle])
+        self._deliver(batch[middle:])
+
+    def _prune(self):
+        # 内存中的状态只需要保留到会话下一次 rerun 读取为止，之后由本地日志回答
+        cutoff = time.monotonic() - self.status_ttl
+
+        with self._cond:
+            expired = [i for i, t in self._settled_at.items() if t < cutoff]
+            for event_id in expired:
+                del self._settled_at[event_id]
+                self._status.pop(event_id, None)
+
+        if self._journal is not None:
+            # 每个批次之后做一次 checkpoint，即按批次而不是按事件 fsync
+            self._journal.purge_delivered(self.journal_retention)
+
+    def _replay(self):
+        delay = self.retry_delay
+
+        while self._replay_events:
+            try:
+                # 重放也经过 _deliver：一条坏事件不会让整个进程的重放永远重试
+                self.replayed += replay_pending(
+                    self._journal,
+                    self._replay_events,
+                    self._deliver,
+                    self._logged_event_ids
+                )
+                self._replay_events = []
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _run(self):
+        self._replay()
+
+        while True:
+            batch = self._collect_batch()
+            self._deliver(batch)
+            self._prune()
@@ -0,0 +1,214 @@
+import os
+import json
+import argparse
+import tomllib
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from event_sinks import EVENT_COLUMNS, make_sink
+
+EVENT_WORKSHEET_NAME = "Events"
+STATE_FILE = "_export_state.json"
+
+CATEGORICAL_COLUMNS = [
+    "event_type",
+    "lang",
+    "gender",
+    "age_group",
+    "user_type",
+    "category",
+    "case_l",
+    "case_r",
+    "winner",
+    "removed_category",
+    "removed_case_l",
+    "removed_case_r",
+    "removed_winner"
+]
+INT_COLUMNS = {
+    "event_seq": pa.int32(),
+    "question_number": pa.int16(),
+    "response_index": pa.int16(),
+    "vote_count": pa.int16(),
+    "skip_count": pa.int16(),
+    "removed_response_index": pa.int16()
+}
+BOOL_COLUMNS = ["completed"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 分区目录：event_date=YYYY-MM-DD/event_category=<类别>；没有类别的事件（start、back）归入 none
+PARTITION_COLUMNS = ["event_date", "event_category"]
+
+
+def arrow_schema():
+    fields = []
+
+    for col in EVENT_COLUMNS:
+        if col in CATEGORICAL_COLUMNS:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        elif col in INT_COLUMNS:
+            fields.append(pa.field(col, INT_COLUMNS[col]))
+        elif col in BOOL_COLUMNS:
+            fields.append(pa.field(col, pa.bool_()))
+        elif col == "timestamp":
+            fields.append(pa.field(col, pa.timestamp("s")))
+        else:
+            fields.append(pa.field(col, pa.string()))
+
+    return pa.schema(fields)
+
+
+def typed_events(rows):
+    """
+    把后端读回的字符串行转成带类型的 DataFrame：
+    低基数字段为 categorical，序号和计数为可空整数，completed 为布尔值，timestamp 为 datetime。
+    """
+    df = pd.DataFrame(rows, columns=EVENT_COLUMNS).fillna("").astype(str)
+
+    for col in INT_COLUMNS:
+        df[col] = pd.to_numeric(df[col].replace("", None), errors="coerce").astype("Int64")
+
+    for col in BOOL_COLUMNS:
+        # Google Sheets 读回 TRUE，CSV 和 SQLite 为 True；较早的 SQLite 日志存为 1
+        df[col] = df[col].str.lower().isin(["true", "1"])
+
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype("category")
+
+    return df
+
+
+def read_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {"rows_exported": 0, "files": 0}
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def write_partitions(df, out_dir, start_row, schema):
+    """
+    按日期和类别写出一页数据。文件名用这一页在源表中的起始行号，
+    中途失败后重跑会覆盖同名文件而不是产生重复行。返回写出的文件数。
+    """
+    keys = pd.DataFrame({
+        "event_date": df["timestamp"].dt.strftime("%Y-%m-%d").fillna("unknown"),
+        "event_category": df["category"].astype(str).replace("", "none")
+    })
+
+    files = 0
+
+    for (date, category), index in keys.groupby(PARTITION_COLUMNS, sort=True).groups.items():
+        part_dir = os.path.join(out_dir, f"event_date={date}", f"event_category={category}")
+        os.makedirs(part_dir, exist_ok=True)
+
+        table = pa.Table.from_pandas(df.loc[index], schema=schema, preserve_index=False)
+        pq.write_table(table, os.path.join(part_dir, f"part-{start_row:09d}.parquet"))
+        files += 1
+
+    return files
+
+
+def export_events(sink, out_dir, page_size=5000):
+    """
+    从上次导出的行号开始分页读取后端，只追加新行。返回 (新行数, 新文件数)。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    state = read_state(out_dir)
+    schema = arrow_schema()
+    new_rows = 0
+    new_files = 0
+
+    while True:
+        start = state["rows_exported"]
+        rows = sink.read_page(start, page_size)
+        if not rows:
+            break
+
+        files = write_partitions(typed_events(rows), out_dir, start, schema)
+
+        state["rows_exported"] = start + len(rows)
+        state["files"] += files
+        write_state(out_dir, state)
+
+        new_rows += len(rows)
+        new_files += files
+
+        if len(rows) < page_size:
+            break
+
+    return new_rows, new_files
+
+
+def load_secrets(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def make_source(args):
+    secrets = load_secrets(args.secrets)
+    config = dict(secrets.get("event_sink", {}))
+
+    if args.backend:
+        config["backend"] = args.backend
+    if args.path:
+        config["path"] = args.path
+
+    @lru_cache(maxsize=1)
+    def get_worksheet():
+        from sheets_client import RateLimitedWorksheet, TokenBucket, open_events_worksheet
+
+        worksheet = open_events_worksheet(
+            dict(secrets["connections"]["gsheets"]),
+            args.worksheet,
+            EVENT_COLUMNS
+        )
+        # 导出和问卷共用同一个配额，读取也限速
+        return RateLimitedWorksheet(worksheet, TokenBucket(args.requests_per_minute / 60, 1))
+
+    return make_sink(config, EVENT_COLUMNS, get_worksheet)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Append new Events rows to a Parquet dataset partitioned by date and category."
+    )
+    parser.add_argument("--out", default="events_parquet")
+    parser.add_argument(
+        "--backend",
+        help="Event sink to read (gsheets / sqlite / csv / parquet). Defaults to [event_sink] in the secrets file."
+    )
+    parser.add_argument("--path", help="Local sink path (sqlite file or event_log directory).")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    parser.add_argument("--worksheet", default=EVENT_WORKSHEET_NAME)
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--requests-per-minute", type=float, default=30)
+    args = parser.parse_args()
+
+    sink = make_source(args)
+    new_rows, new_files = export_events(sink, args.out, args.page_size)
+    state = read_state(args.out)
+
+    print(f"New rows: {new_rows}, new files: {new_files}, total rows: {state['rows_exported']} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import shutil
+import threading
+import argparse
+
+# 派生图输出到 Streamlit 的静态目录，浏览器可以直接按 srcset 选择并缓存
+STATIC_DIR = "static"
+DERIVATIVE_SUBDIR = "derivatives"
+DERIVATIVE_DIR = os.path.join(STATIC_DIR, DERIVATIVE_SUBDIR)
+STATIC_URL_PREFIX = "app/static"
+
+DERIVATIVE_WIDTHS = [480, 768, 1024]
+DERIVATIVE_FORMATS = ["webp", "jpg"]
+FORMAT_QUALITY = {"webp": 78, "jpg": 80}
+
+# 手机上两张图纵向排列且被 CSS 限制在 28vh，桌面端两列并排
+PAIR_IMAGE_SIZES = "(max-width: 640px) 100vw, 360px"
+
+
+def derivative_name(filename, width, fmt):
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_{width}.{fmt}"
+
+
+def derivative_path(case, filename, width, fmt, out_dir=DERIVATIVE_DIR):
+    return os.path.join(out_dir, case, derivative_name(filename, width, fmt))
+
+
+def derivative_url(case, filename, width, fmt, version=""):
+    url = "/".join([
+        STATIC_URL_PREFIX,
+        DERIVATIVE_SUBDIR,
+        case,
+        derivative_name(filename, width, fmt)
+    ])
+    # 版本号取原图内容哈希，图片更新后 URL 改变，浏览器缓存自动失效
+    return f"{url}?v={version}" if version else url
+
+
+def is_stale(src, dst):
+    return (
+        not os.path.exists(dst)
+        or os.path.getmtime(dst) < os.path.getmtime(src)
+    )
+
+
+def build_derivative(src, dst, width, fmt):
+    """
+    生成单个派生图：按宽度等比缩小，WebP 或渐进式 JPEG。
+    原图本身已是不超过目标宽度的 JPEG 时直接复制，避免重新编码反而变大。
+    先写临时文件再替换，避免并发请求读到半张图。
+    """
+    from PIL import Image
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    # 同一进程里多个会话的线程可能同时生成同一张派生图，临时文件名按进程和线程区分
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    with Image.open(src) as img:
+        if fmt == "jpg" and img.format == "JPEG" and img.width <= width:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+            return
+
+        img = img.convert("RGB")
+
+        if img.width > width:
+            height = round(img.height * width / img.width)
+            img = img.resize((width, height), Image.LANCZOS)
+
+        if fmt == "webp":
+            img.save(tmp, "WEBP", quality=FORMAT_QUALITY[fmt], method=4)
+        else:
+            img.save(
+                tmp,
+                "JPEG",
+                quality=FORMAT_QUALITY[fmt],
+                optimize=True,
+                progressive=True
+            )
+
+    os.replace(tmp, dst)
+
+
+def ensure_derivatives(img_dir, case, filename, out_dir=DERIVATIVE_DIR, force=False):
+    """
+    确保某张图片的全部派生图存在且不旧于原图。
+    返回本次新生成的文件数。
+    """
+    src = os.path.join(img_dir, case, filename)
+    built = 0
+
+    for width in DERIVATIVE_WIDTHS:
+        for fmt in DERIVATIVE_FORMATS:
+            dst = derivative_path(case, filename, width, fmt, out_dir)
+            if force or is_stale(src, dst):
+                build_derivative(src, dst, width, fmt)
+                built += 1
+
+    return built
+
+
+def build_srcset(case, filename, fmt, version=""):
+    return ", ".join(
+        f"{derivative_url(case, filename, width, fmt, version)} {width}w"
+        for width in DERIVATIVE_WIDTHS
+    )
+
+
+def picture_html(case, filename, alt="", version=""):
+    """
+    生成 <picture>：浏览器根据视口宽度和像素密度选择最小的合适尺寸，
+    支持 WebP 的浏览器优先使用 WebP，否则使用渐进式 JPEG。
+    """
+    fallback = derivative_url(case, filename, DERIVATIVE_WIDTHS[1], "jpg", version)
+
+    return (
+        '<picture class="pair-image">'
+        f'<source type="image/webp" srcset="{build_srcset(case, filename, "webp", version)}" '
+        f'sizes="{PAIR_IMAGE_SIZES}">'
+        f'<img src="{fallback}" srcset="{build_srcset(case, filename, "jpg", version)}" '
+        f'sizes="{PAIR_IMAGE_SIZES}" alt="{alt}" decoding="async">'
+        '</picture>'
+    )
+
+
+def iter_catalogue(img_dir, cases):
+    for c in cases:
+        path = os.path.join(img_dir, c)
+        if not os.path.exists(path):
+            continue
+        for f in sorted(os.listdir(path)):
+            if f.lower().endswith((".jpg", ".jpeg", ".png")):
+                yield c, f
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build resized WebP / progressive JPEG derivatives for the survey images."
+    )
+    parser.add_argument("--img-dir", default="images")
+    parser.add_argument("--cases", nargs="+", default=["CaseA", "CaseB", "CaseC", "CaseD"])
+    parser.add_argument("--out-dir", default=DERIVATIVE_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if up to date.")
+    args = parser.parse_args()
+
+    images = 0
+    built = 0
+    src_bytes = 0
+    out_bytes = {}
+
+    for case, filename in iter_catalogue(args.img_dir, args.cases):
+        images += 1
+        built += ensure_derivatives(args.img_dir, case, filename, args.out_dir, args.force)
+        src_bytes += os.path.getsize(os.path.join(args.img_dir, case, filename))
+
+        for width in DERIVATIVE_WIDTHS:
+            for fmt in DERIVATIVE_FORMATS:
+                key = f"{width}.{fmt}"
+                out_bytes[key] = out_bytes.get(key, 0) + os.path.getsize(
+                    derivative_path(case, filename, width, fmt, args.out_dir)
+                )
+
+    print(f"Images: {images}, derivatives built: {built}")
+    print(f"Originals: {src_bytes / 1024:.0f} KB")
+    for key, size in sorted(out_bytes.items()):
+        print(f"{key:>10}: {size / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import os
+import csv
+import json
+import time
+import argparse
+from math import comb
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_features import PHASH_FILE, file_sha1, phash_file, read_index
+from image_manifest import DUPLICATES_FILE, load_catalogue
+
+HASH_BITS = 64
+
+# 段宽不超过这个位数时用直接寻址表（2^bits 个偏移量）查找，否则在排序后的取值上二分查找
+TABLE_BITS = 22
+
+# 每个字节值中 1 的个数
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def catalogue_phashes(img_dir, cases, workers=None):
+    """
+    返回 (keys, 感知哈希数组)。image_features.py 已算过且内容哈希未变的图片直接复用，
+    其余在进程池中计算。
+    """
+    catalogue = load_catalogue(img_dir, cases, os.path.join(img_dir, "manifest.jsonl"))
+    keys = [f"{case}/{filename}" for case, filename in catalogue]
+    paths = [os.path.join(img_dir, key) for key in keys]
+    hashes = [catalogue.content_hash(key) or file_sha1(path) for key, path in zip(keys, paths)]
+
+    cached = {}
+    index = read_index(img_dir)
+    if index is not None:
+        old = np.load(os.path.join(img_dir, PHASH_FILE), mmap_mode="r")
+        cached = dict(zip(index["sha1"], old.tolist()))
+
+    phashes = np.zeros(len(keys), dtype=np.uint64)
+    todo = []
+
+    for row, sha1 in enumerate(hashes):
+        if sha1 in cached:
+            phashes[row] = cached[sha1]
+        else:
+            todo.append(row)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for row, value in zip(todo, pool.map(phash_file, [paths[row] for row in todo], chunksize=64)):
+                phashes[row] = value
+
+    return keys, phashes, len(todo)
+
+
+def popcount(values):
+    """
+    uint64 数组逐元素的 1 的个数。np.bitwise_count 需要 NumPy 2.0，更早的版本按字节查表。
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _flip_masks(bits, radius):
+    """
+    bits 位宽内所有不超过 radius 个 1 的掩码（含 0）。
+    """
+    masks = [0]
+    for k in range(1, radius + 1):
+        masks.extend(sum(1 << b for b in flipped) for flipped in combinations(range(bits), k))
+    return np.array(masks, dtype=np.int64)
+
+
+def _search_cost(n, widths, radius):
+    """
+    估计某种切段方式的工作量：每段的探测次数 x（每次探测的查找 + 期望候选对数）。
+    """
+    cost = 0.0
+    for bits in widths:
+        probes = sum(comb(bits, k) for k in range(radius + 1))
+        lookup = n if bits <= TABLE_BITS else n * max(np.log2(n), 1)
+        cost += probes * (lookup + n * n / 2.0 ** bits)
+    return cost
+
+
+def choose_chunks(n, threshold):
+    """
+    在 1..threshold+1 段中选工作量最小的切法，返回 (各段边界, 段内搜索半径)。
+    m 段时距离不超过 threshold 的两张图至少有一段相差不超过 threshold // m 位（抽屉原理）。
+    段太窄时每段的桶随 n 线性变大（退化为平方）；段太宽时每段要探测的掩码太多。
+    按 n 选择，使每段的桶大小保持在常数附近。
+    """
+    best = None
+
+    for m in range(1, min(threshold + 1, HASH_BITS) + 1):
+        bounds = np.linspace(0, HASH_BITS, m + 1).astype(int)
+        widths = [int(hi - lo) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        radius = threshold // m
+        cost = _search_cost(n, widths, radius)
+        if best is None or cost < best[0]:
+            best = (cost, bounds, radius)
+
+    return best[1], best[2]
+
+
+def _chunk_lookup(chunk, bits):
+    """
+    为一段的取值建立查找结构，返回 find(probe) -> (起点, 个数)，以及按取值排序的下标。
+    """
+    order = np.argsort(chunk, kind="stable")
+
+    if bits <= TABLE_BITS:
+        offsets = np.zeros((1 << bits) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(chunk, minlength=1 << bits))
+
+        def find(probe):
+            start = offsets[probe]
+            return start, offsets[probe + 1] - start
+
+        return find, order
+
+    ordered = chunk[order]
+
+    def find(probe):
+        start = np.searchsorted(ordered, probe, side="left")
+        return start, np.searchsorted(ordered, probe, side="right") - start
+
+    return find, order
+
+
+def near_duplicate_pairs(hashes, threshold):
+    """
+    多索引哈希（Norouzi 等）：64 位哈希切成 m 段，距离不超过 threshold 的两张图
+    至少有一段相差不超过 threshold // m 位。每段为每张图探测所有这样的变体，
+    只比较命中的图（异或 + popcount，NumPy 向量化）。m 由 choose_chunks 按图片数选择，
+    使每次探测的期望命中数保持在常数附近，总工作量约与 n 成正比，而不是 n^2。
+    返回 (i, j, 距离) 三个数组，i < j，每对只出现一次。
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+
+    if threshold >= HASH_BITS:
+        raise ValueError(f"threshold must be below {HASH_BITS}")
+
+    empty = np.zeros(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty, empty
+
+    bounds, radius = choose_chunks(n, threshold)
+    ids = np.arange(n)
+    firsts, seconds, dists = [], [], []
+
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        bits = int(hi - lo)
+        chunk = ((hashes >> np.uint64(lo)) & np.uint64((1 << bits) - 1)).astype(np.int64)
+        find, order = _chunk_lookup(chunk, bits)
+
+        for mask in _flip_masks(bits, radius):
+            start, count = find(chunk ^ mask)
+
+            hit = np.flatnonzero(count)
+            if not len(hit):
+                continue
+            count = count[hit]
+
+            # 展开每张图命中的区间：第 k 个候选是 order[start + 区间内序号]
+            first = np.repeat(ids[hit], count)
+            within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            second = order[np.repeat(start[hit], count) + within]
+
+            # 每对会从两张图各命中一次，只保留 i < j
+            keep = first < second
+            first, second = first[keep], second[keep]
+
+            distances = popcount(hashes[first] ^ hashes[second])
+            keep = distances <= threshold
+            firsts.append(first[keep])
+            seconds.append(second[keep])
+            dists.append(distances[keep])
+
+    if not firsts:
+        return empty, empty, empty
+
+    first = np.concatenate(firsts).astype(np.int64)
+    second = np.concatenate(seconds).astype(np.int64)
+    distance = np.concatenate(dists).astype(np.int64)
+
+    # 同一对可能在多个段、多个掩码下命中，按 (i, j) 去重
+    _, unique = np.unique(first * n + second, return_index=True)
+    return first[unique], second[unique], distance[unique]
+
+
+def clusters(n, first, second):
+    """
+    并查集：把近似重复的对合并成簇，返回成员数不少于 2 的簇（按成员下标排序）。
+    """
+    parent = np.arange(n)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in zip(first.tolist(), second.tolist()):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    groups = {}
+    for i in sorted(set(first.tolist()) | set(second.tolist())):
+        groups.setdefault(find(i), []).append(i)
+
+    return [members for _, members in sorted(groups.items()) if len(members) > 1]
+
+
+def write_exclusions(img_dir, keys, groups, threshold):
+    """
+    每个簇保留图库顺序中的第一张，其余写入 duplicates.json 的 exclude 列表。
+    """
+    path = os.path.join(img_dir, DUPLICATES_FILE)
+    data = {
+        "threshold": threshold,
+        "clusters": [[keys[i] for i in members] for members in groups],
+        "exclude": [keys[i] for members in groups for i in members[1:]]
+    }
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+    return path, len(data["exclude"])
+
+
+def main():
+    from studies import DEFAULT_STUDY_ID, STUDIES_DIR, load_studies
+
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate images across cases by perceptual hash (multi-index hashing)."
+    )
+    parser.add_argument("--study", default=DEFAULT_STUDY_ID)
+    parser.add_argument("--studies-dir", default=STUDIES_DIR)
+    parser.add_argument("--threshold", type=int, default=8, help="Maximum Hamming distance between 64-bit hashes.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--out", help="Write one row per clustered image to this CSV.")
+    parser.add_argument(
+        "--write-exclusions",
+        action="store_true",
+        help=f"Write {DUPLICATES_FILE} next to the manifest; EXCLUDE_DUPLICATES=1 then keeps one image per cluster."
+    )
+    args = parser.parse_args()
+
+    study = load_studies(args.studies_dir)[args.study]
+
+    start = time.perf_counter()
+    keys, phashes, computed = catalogue_phashes(study.img_dir, study.cases, args.workers)
+    hashed = time.perf_counter()
+    first, second, distance = near_duplicate_pairs(phashes, args.threshold)
+    groups = clusters(len(keys), first, second)
+    done = time.perf_counter()
+
+    print(
+        f"Images: {len(keys)} ({computed} hashed in {hashed - start:.1f}s), "
+        f"pairs within {args.threshold} bits: {len(first)}, clusters: {len(groups)} "
+        f"(search {done - hashed:.1f}s)"
+    )
+
+    pair_distance = {(i, j): d for i, j, d in zip(first.tolist(), second.tolist(), distance.tolist())}
+
+    for members in groups[:20]:
+        head = members[0]
+        others = ", ".join(
+            f"{keys[i]} ({pair_distance.get((head, i), '-')})" for i in members[1:]
+        )
+        print(f"  {keys[head]}: {others}")
+    if len(groups) > 20:
+        print(f"  ... {len(groups) - 20} more clusters")
+
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["cluster", "image", "kept", "distance_to_kept"])
+            for n, members in enumerate(groups, start=1):
+                for i in members:
+                    writer.writerow([n, keys[i], i == members[0], pair_distance.get((members[0], i), "")])
+        print(f"Clusters -> {args.out}")
+
+    if args.write_exclusions:
+        path, excluded = write_exclusions(study.img_dir, keys, groups, args.threshold)
+        print(f"Excluded {excluded} images -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_manifest import load_catalogue
+
+# 输出放在图片目录里，与 manifest.jsonl 并列；每个研究的图库各有一份
+FEATURES_FILE = "image_features.npy"
+PHASH_FILE = "image_phash.npy"
+INDEX_FILE = "image_features.json"
+
+# 计算特征前先缩小到这个宽度，足够估计颜色和边缘比例
+ANALYSIS_WIDTH = 256
+
+HUE_BINS = 12
+SAT_BINS = 4
+VAL_BINS = 4
+
+FEATURE_NAMES = (
+    [f"hue_{i}" for i in range(HUE_BINS)]
+    + [f"sat_{i}" for i in range(SAT_BINS)]
+    + [f"val_{i}" for i in range(VAL_BINS)]
+    + [
+        "brightness",
+        "contrast",
+        "edge_density",
+        "vertical_edge_share",
+        "sky_ratio",
+        "green_ratio"
+    ]
+)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+DCT_32 = _dct_matrix(32)
+
+
+def phash(image):
+    """
+    64 位感知哈希：32x32 灰度图做二维 DCT，取左上角 8x8 低频系数（去掉直流分量比较），
+    高于中位数为 1。相似的图片汉明距离小。
+    """
+    from PIL import Image
+
+    gray = np.asarray(image.convert("L").resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (DCT_32 @ gray @ DCT_32.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return (int(a) ^ int(b)).bit_count()
+
+
+def describe(image):
+    """
+    一张图的紧凑描述：HSV 直方图（色相按饱和度加权）、亮度和对比度、边缘密度和竖向边缘占比、
+    天空比例（上半部分偏蓝或明亮低饱和的像素）、绿化比例（绿色明显占优的像素）。
+    """
+    from PIL import Image
+
+    if image.width > ANALYSIS_WIDTH:
+        height = max(1, round(image.height * ANALYSIS_WIDTH / image.width))
+        image = image.resize((ANALYSIS_WIDTH, height), Image.BILINEAR)
+
+    rgb = np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0
+    hsv = np.asarray(image.convert("HSV"), dtype=np.float32) / 255.0
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    pixels = h.size
+
+    hue_hist = np.histogram(h, bins=HUE_BINS, range=(0, 1), weights=s)[0]
+    hue_hist = hue_hist / max(hue_hist.sum(), 1e-9)
+    sat_hist = np.histogram(s, bins=SAT_BINS, range=(0, 1))[0] / pixels
+    val_hist = np.histogram(v, bins=VAL_BINS, range=(0, 1))[0] / pixels
+
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    gx = np.abs(np.diff(gray, axis=1))[:-1, :]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    edges = (gx + gy) > 0.12
+    edge_density = edges.mean()
+    # 竖向边缘（立面、柱子）在横向梯度上更强
+    vertical_edge_share = (edges & (gx > gy)).sum() / max(edges.sum(), 1)
+
+    top = np.zeros(h.shape, dtype=bool)
+    top[: h.shape[0] // 2] = True
+    sky = top & (((b > r) & (b > g) & (v > 0.45)) | ((v > 0.8) & (s < 0.15)))
+    green = (g > r * 1.08) & (g > b * 1.08) & (v > 0.15)
+
+    return np.concatenate([
+        hue_hist,
+        sat_hist,
+        val_hist,
+        [
+            gray.mean(),
+            gray.std(),
+            edge_density,
+            vertical_edge_share,
+            sky.sum() / pixels,
+            green.sum() / pixels
+        ]
+    ]).astype(np.float32)
+
+
+def analyse_file(path):
+    """
+    进程池里的工作函数：返回 (特征向量, 感知哈希)。
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("RGB", (ANALYSIS_WIDTH * 2, ANALYSIS_WIDTH * 2))
+        return describe(image), phash(image)
+
+
+def phash_file(path):
+    """
+    只计算感知哈希的工作函数（查重用）。解码方式与 analyse_file 相同，两者的哈希可以互相复用。
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("RGB", (ANALYSIS_WIDTH * 2, ANALYSIS_WIDTH * 2))
+        return phash(image)
+
+
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_index(img_dir):
+    path = os.path.join(img_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_features(img_dir, cases, workers=None):
+    """
+    为图库中的每张图计算特征和感知哈希，写成内存映射的 .npy 数组和 JSON 索引（行号 -> 图片、内容哈希）。
+    内容哈希与上次相同的图片直接复用旧结果，只计算新增或修改过的图片；计算在进程池中并行。
+    返回 (图片数, 新计算的图片数)。
+    """
+    catalogue = load_catalogue(img_dir, cases, os.path.join(img_dir, "manifest.jsonl"))
+    keys = [f"{case}/{filename}" for case, filename in catalogue]
+    paths = [os.path.join(img_dir, key) for key in keys]
+    hashes = [catalogue.content_hash(key) or file_sha1(path) for key, path in zip(keys, paths)]
+
+    features = np.zeros((len(keys), len(FEATURE_NAMES)), dtype=np.float32)
+    phashes = np.zeros(len(keys), dtype=np.uint64)
+
+    cached = {}
+    old = read_index(img_dir)
+    if old is not None and old.get("features") == FEATURE_NAMES:
+        old_features = np.load(os.path.join(img_dir, FEATURES_FILE), mmap_mode="r")
+        old_phashes = np.load(os.path.join(img_dir, PHASH_FILE), mmap_mode="r")
+        for row, sha1 in enumerate(old["sha1"]):
+            cached[sha1] = (old_features[row], old_phashes[row])
+
+    todo = []
+    for row, sha1 in enumerate(hashes):
+        if sha1 in cached:
+            features[row], phashes[row] = cached[sha1]
+        else:
+            todo.append(row)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(analyse_file, [paths[row] for row in todo], chunksize=16)
+            for row, (vector, value) in zip(todo, results):
+                features[row] = vector
+                phashes[row] = value
+
+    # 先写临时文件再替换，正在运行的问卷进程不会读到写了一半的数组
+    for name, array in ((FEATURES_FILE, features), (PHASH_FILE, phashes)):
+        path = os.path.join(img_dir, name)
+        np.save(f"{path}.tmp.npy", array)
+        os.replace(f"{path}.tmp.npy", path)
+
+    index_path = os.path.join(img_dir, INDEX_FILE)
+    with open(f"{index_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"features": FEATURE_NAMES, "keys": keys, "sha1": hashes}, f)
+    os.replace(f"{index_path}.tmp", index_path)
+
+    return len(keys), len(todo)
+
+
+class FeatureIndex:
+    """
+    只读的特征索引：数组以内存映射方式打开，多个进程共享页缓存。
+    特征按列标准化后做 PCA，前两个主成分各按分位数切成 bins 段，得到 bins x bins 个分层；
+    sample_pair() 从两个不同的分层各抽一张未看过的图，避免把几乎相同的街景放在一起比较。
+    keys 不为空时只从这些图片中抽取（例如排除了重复图片的图库），分层仍按全部图片划分。
+    """
+
+    def __init__(self, img_dir, bins=3, keys=None):
+        index = read_index(img_dir)
+        if index is None:
+            raise FileNotFoundError(os.path.join(img_dir, INDEX_FILE))
+
+        self.keys = index["keys"]
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.features = np.load(os.path.join(img_dir, FEATURES_FILE), mmap_mode="r")
+        self.phashes = np.load(os.path.join(img_dir, PHASH_FILE), mmap_mode="r")
+
+        x = np.asarray(self.features, dtype=np.float64)
+        x = (x - x.mean(axis=0)) / np.maximum(x.std(axis=0), 1e-9)
+        self.standardized = x
+
+        _, _, vt = np.linalg.svd(x, full_matrices=False)
+        components = x @ vt[:2].T
+
+        self.strata = np.zeros(len(self.keys), dtype=np.int64)
+        for c in range(components.shape[1]):
+            edges = np.quantile(components[:, c], np.linspace(0, 1, bins + 1)[1:-1])
+            self.strata = self.strata * bins + np.searchsorted(edges, components[:, c])
+
+        allowed = None if keys is None else set(keys)
+        self.members = {}
+        for i, stratum in enumerate(self.strata.tolist()):
+            if allowed is None or self.keys[i] in allowed:
+                self.members.setdefault(stratum, []).append(i)
+
+    def nearest(self, key, k=5):
+        """
+        标准化特征空间里与 key 最近的 k 张图，返回 [(key, 距离), ...]。
+        """
+        i = self.key_index[key]
+        distances = np.linalg.norm(self.standardized - self.standardized[i], axis=1)
+        distances[i] = np.inf
+        order = np.argpartition(distances, min(k, len(distances) - 1))[:k]
+        order = order[np.argsort(distances[order])]
+        return [(self.keys[j], float(distances[j])) for j in order]
+
+    def sample_pair(self, rng, used_keys=(), tries=20):
+        """
+        随机选两个不同的分层，各抽一张未看过的图，返回两张图的 key；抽不到时返回 None。
+        """
+        strata = list(self.members)
+        if len(strata) < 2:
+            return None
+
+        for _ in range(tries):
+            a, b = rng.sample(strata, 2)
+            first = self.keys[rng.choice(self.members[a])]
+            second = self.keys[rng.choice(self.members[b])]
+            if first not in used_keys and second not in used_keys:
+                return first, second
+
+        return None
+
+
+def main():
+    from studies import DEFAULT_STUDY_ID, STUDIES_DIR, load_studies
+
+    parser = argparse.ArgumentParser(
+        description="Compute colour, edge, sky/greenery descriptors and perceptual hashes for every catalogue image."
+    )
+    parser.add_argument("--study", default=DEFAULT_STUDY_ID)
+    parser.add_argument("--studies-dir", default=STUDIES_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--neighbours", metavar="KEY", help="Print the nearest images to CASE/FILENAME.")
+    args = parser.parse_args()
+
+    study = load_studies(args.studies_dir)[args.study]
+
+    if args.neighbours:
+        index = FeatureIndex(study.img_dir)
+        for key, distance in index.nearest(args.neighbours):
+            print(f"{distance:8.3f}  {key}")
+        return
+
+    start = time.perf_counter()
+    total, computed = build_features(study.img_dir, study.cases, args.workers)
+    elapsed = time.perf_counter() - start
+
+    index = FeatureIndex(study.img_dir)
+    sizes = sorted(len(m) for m in index.members.values())
+    print(
+        f"Images: {total}, computed: {computed}, reused: {total - computed} in {elapsed:.1f}s "
+        f"-> {os.path.join(study.img_dir, FEATURES_FILE)}"
+    )
+    print(f"Strata: {len(sizes)} (smallest {sizes[0]}, largest {sizes[-1]} images)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import os
+import json
+import hashlib
+import argparse
+from array import array
+
+from image_derivatives import (
+    DERIVATIVE_FORMATS,
+    DERIVATIVE_WIDTHS,
+    derivative_path,
+    iter_catalogue
+)
+
+MANIFEST_PATH = os.path.join("images", "manifest.jsonl")
+# image_duplicates.py 写出的近似重复图片列表，与 manifest.jsonl 并列
+DUPLICATES_FILE = "duplicates.json"
+
+
+class ImageCatalogue:
+    """
+    数组存储的图片目录：整数 image_id、case 编码（intern 后的下标）、文件名、尺寸、字节数和内容哈希。
+    行为上是 (case, filename) 元组组成的序列，可以直接替代原来的列表。
+    """
+
+    def __init__(self, records, version=""):
+        self.version = version
+        self.case_names = []
+        case_code = {}
+
+        self.ids = array("I")
+        self.case_codes = array("B")
+        self.filenames = []
+        self.widths = array("H")
+        self.heights = array("H")
+        self.sizes = array("I")
+        self.hashes = []
+
+        for r in records:
+            if r["case"] not in case_code:
+                case_code[r["case"]] = len(self.case_names)
+                self.case_names.append(r["case"])
+
+            self.ids.append(r["id"])
+            self.case_codes.append(case_code[r["case"]])
+            self.filenames.append(r["filename"])
+            self.widths.append(r.get("width", 0))
+            self.heights.append(r.get("height", 0))
+            self.sizes.append(r.get("bytes", 0))
+            self.hashes.append(r.get("sha1", ""))
+
+        self._by_key = {
+            f"{self.case_names[c]}/{f}": i
+            for i, (c, f) in enumerate(zip(self.case_codes, self.filenames))
+        }
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, i):
+        return self.case_names[self.case_codes[i]], self.filenames[i]
+
+    def __iter__(self):
+        for c, f in zip(self.case_codes, self.filenames):
+            yield self.case_names[c], f
+
+    def position(self, key):
+        return self._by_key.get(key)
+
+    def image_id(self, key):
+        i = self._by_key.get(key)
+        return None if i is None else self.ids[i]
+
+    def content_hash(self, key):
+        i = self._by_key.get(key)
+        return "" if i is None else self.hashes[i]
+
+
+def describe_image(img_dir, case, filename):
+    from PIL import Image
+
+    path = os.path.join(img_dir, case, filename)
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    with Image.open(path) as img:
+        width, height = img.size
+
+    return {
+        "case": case,
+        "filename": filename,
+        "path": path.replace(os.sep, "/"),
+        "width": width,
+        "height": height,
+        "bytes": len(data),
+        "sha1": hashlib.sha1(data).hexdigest(),
+        "derivatives": [
+            derivative_path(case, filename, w, fmt).replace(os.sep, "/")
+            for w in DERIVATIVE_WIDTHS
+            for fmt in DERIVATIVE_FORMATS
+        ]
+    }
+
+
+def read_manifest(path=MANIFEST_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_manifest(img_dir, cases, path=MANIFEST_PATH):
+    """
+    重新扫描图片并写出 manifest。已有图片沿用原来的 image_id，新图片分配新的编号，
+    保证分析时按 image_id 关联的结果跨版本稳定。
+    """
+    previous = {}
+    if os.path.exists(path):
+        previous = {
+            f"{r['case']}/{r['filename']}": r["id"]
+            for r in read_manifest(path)
+        }
+
+    next_id = max(previous.values(), default=0) + 1
+    records = []
+
+    for case, filename in iter_catalogue(img_dir, cases):
+        key = f"{case}/{filename}"
+
+        if key in previous:
+            image_id = previous[key]
+        else:
+            image_id = next_id
+            next_id += 1
+
+        records.append({"id": image_id, **describe_image(img_dir, case, filename)})
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    os.replace(tmp, path)
+
+    return records
+
+
+def manifest_version(path=MANIFEST_PATH):
+    """
+    manifest 的修改时间，作为缓存键：图片更新并重建 manifest 后缓存自动失效。
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def read_excluded(img_dir):
+    """
+    duplicates.json 中要排除的图片 key（case/filename）；没有运行过 image_duplicates.py 时为空。
+    """
+    path = os.path.join(img_dir, DUPLICATES_FILE)
+    if not os.path.exists(path):
+        return frozenset()
+
+    with open(path, encoding="utf-8") as f:
+        return frozenset(json.load(f).get("exclude", []))
+
+
+def load_catalogue(img_dir, cases, path=MANIFEST_PATH, exclude=()):
+    """
+    有 manifest 时直接读取（不扫描目录）；没有时回退到 os.listdir，尺寸等元数据为空。
+    exclude 中的图片（case/filename）不进入图库。
+    """
+    exclude = set(exclude)
+
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+
+        wanted = set(cases)
+        records = [
+            r for r in read_manifest(path)
+            if r["case"] in wanted and f"{r['case']}/{r['filename']}" not in exclude
+        ]
+        records.sort(key=lambda r: (cases.index(r["case"]), r["filename"]))
+        return ImageCatalogue(records, version)
+
+    records = [
+        {"id": i, "case": case, "filename": filename}
+        for i, (case, filename) in enumerate(iter_catalogue(img_dir, cases), start=1)
+        if f"{case}/{filename}" not in exclude
+    ]
+    return ImageCatalogue(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write images/manifest.jsonl with ids, dimensions, sizes, hashes and derivative paths."
+    )
+    parser.add_argument("--img-dir", default="images")
+    parser.add_argument("--cases", nargs="+", default=["CaseA", "CaseB", "CaseC", "CaseD"])
+    parser.add_argument("--out", default=MANIFEST_PATH)
+    args = parser.parse_args()
+
+    records = build_manifest(args.img_dir, args.cases, args.out)
+    print(f"Images: {len(records)} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
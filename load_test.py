@@ -0,0 +1,474 @@
+import os
+import sys
+import time
+import uuid
+import random
+import socket
+import asyncio
+import tempfile
+import argparse
+import threading
+import traceback
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from survey_text import LANG_DICT
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "urban_perception_survey.py")
+T = LANG_DICT["English"]
+
+# --in-process 模式：AppTest 每次运行都会创建并销毁进程级的 Runtime，不能在多个线程里同时运行，
+# 重跑用这把锁串行执行。这个模式只用于按 --seed 复现会话，不产生并发负载；压测用默认的服务器模式。
+RUN_LOCK = threading.Lock()
+
+
+class LoadStats:
+    """
+    所有虚拟参与者共享的统计：每次重跑的耗时、完成人数和错误。
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.service_times = []
+        self.completed = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add_latency(self, seconds, service):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.service_times.append(service)
+
+    def add_error(self, kind):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def add_completed(self):
+        with self._lock:
+            self.completed += 1
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class Participant:
+    """
+    --in-process 模式的虚拟参与者（AppTest）：完成引导页，投满所有题目，中途随机点击返回和跳过，最后到达结束页。
+    participant_id 由 --seed 决定，问卷里的题目顺序和图片也随之确定，同一个种子的两次运行可以直接比较。
+    """
+
+    def __init__(self, stats, rng, timeout, back_rate, skip_rate):
+        from streamlit.testing.v1 import AppTest
+
+        self.stats = stats
+        self.rng = rng
+        self.back_rate = back_rate
+        self.skip_rate = skip_rate
+        self.at = AppTest.from_file(SCRIPT, default_timeout=timeout)
+        self.at.session_state["participant_id"] = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def run(self):
+        start = time.perf_counter()
+        with RUN_LOCK:
+            started = time.perf_counter()
+            self.at.run()
+        end = time.perf_counter()
+        self.stats.add_latency(end - start, end - started)
+
+        if self.at.exception:
+            self.stats.add_error("exception")
+
+    def click(self, label=None, key=None):
+        if key is not None:
+            self.at.button(key=key).click()
+        else:
+            next(b for b in self.at.button if b.label == label).click()
+        self.run()
+
+    def onboarding(self):
+        self.run()
+        self.at.checkbox[0].check()
+        self.at.selectbox(key="gender_input").select(self.rng.choice(["Male", "Female", "Other"]))
+        self.at.selectbox(key="age_input").select(self.rng.choice(["18-29", "30-44", "45-59", "60+"]))
+        self.at.radio(key="role_input").set_value(
+            self.rng.choice(["City resident", "City user", "Current tourist", "Previous tourist", "Other"])
+        )
+        self.run()
+        self.click(label=T["start_btn"])
+
+    def vote(self, max_actions):
+        for _ in range(max_actions):
+            if self.at.session_state.step != "voting":
+                return
+
+            r = self.rng.random()
+
+            if r < self.back_rate and self.at.session_state.vote_count > 0:
+                self.click(label=T["btn_back"])
+            elif r < self.back_rate + self.skip_rate:
+                self.click(label=self.rng.choice([T["btn_skip_equal"], T["btn_skip_neither"]]))
+            else:
+                self.click(key=self.rng.choice(["L", "R"]))
+
+    def finish(self):
+        if self.at.session_state.step != "end":
+            self.stats.add_error("not_finished")
+            return
+
+        if self.at.session_state.pending_events:
+            self.stats.add_error("undelivered")
+            return
+
+        self.stats.add_completed()
+
+
+class ServerParticipant:
+    """
+    服务器模式的虚拟参与者：像浏览器一样通过 /_stcore/stream 连接 streamlit run 启动的服务器。
+    控件取值和按钮点击作为 rerun_script 的 widget_states 发送，从返回的 delta 里按 key 或标签找控件；
+    投票页片段里的点击按片段重跑。延迟为发送到收到 script_finished 的时间。
+    participant_id 由服务器端的会话生成，--seed 只决定点击顺序。
+    """
+
+    def __init__(self, stats, rng, url, timeout, back_rate, skip_rate, think_time):
+        self.stats = stats
+        self.rng = rng
+        self.url = url
+        self.timeout = timeout
+        self.back_rate = back_rate
+        self.skip_rate = skip_rate
+        self.think_time = think_time
+        self.ws = None
+        self.page_script_hash = ""
+        # delta_path -> (元素, 所属片段)
+        self.elements = {}
+        # 控件 id -> 当前取值（WidgetState），每次重跑都随请求发送，与浏览器一致
+        self.values = {}
+
+    def widgets(self, kind):
+        for element, fragment_id in self.elements.values():
+            if element.WhichOneof("type") == kind:
+                yield getattr(element, kind), fragment_id
+
+    def find(self, kind, label=None, key=None):
+        for widget, fragment_id in self.widgets(kind):
+            if key is not None and widget.id.endswith(f"-{key}"):
+                return widget, fragment_id
+            if label is not None and widget.label == label:
+                return widget, fragment_id
+        return None, ""
+
+    def step(self):
+        if self.find("button", key="L")[0] is not None:
+            return "voting"
+        if self.find("button", label=T["restart"])[0] is not None:
+            return "end"
+        return "onboarding"
+
+    async def run(self, trigger=None, fragment_id=""):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.page_script_hash = self.page_script_hash
+        if fragment_id:
+            state.fragment_id = fragment_id
+
+        present = {widget.id for kind in ("checkbox", "selectbox", "radio") for widget, _ in self.widgets(kind)}
+        for widget_id, value in self.values.items():
+            if widget_id in present:
+                state.widget_states.widgets.append(value)
+
+        if trigger is not None:
+            clicked = state.widget_states.widgets.add()
+            clicked.id = trigger
+            clicked.trigger_value = True
+
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        await self.read_run(fragment_id)
+        seconds = time.perf_counter() - start
+        self.stats.add_latency(seconds, seconds)
+
+    async def read_run(self, fragment_id):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        touched = set()
+
+        while True:
+            msg = ForwardMsg.FromString(await asyncio.wait_for(self.ws.recv(), self.timeout))
+            kind = msg.WhichOneof("type")
+
+            if kind == "new_session":
+                self.page_script_hash = msg.new_session.page_script_hash
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                path = tuple(msg.metadata.delta_path)
+                self.elements[path] = (msg.delta.new_element, msg.delta.fragment_id)
+                touched.add(path)
+                if msg.delta.new_element.WhichOneof("type") == "exception":
+                    self.stats.add_error("exception")
+            elif kind == "script_finished":
+                status = msg.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # 片段里调用了 st.rerun()：接着整页重跑
+                    fragment_id = ""
+                    touched = set()
+                    continue
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    self.stats.add_error("compile_error")
+                break
+
+        # 整页重跑后没有再出现的元素被前端删除；片段重跑只替换该片段的元素
+        self.elements = {
+            path: (element, owner)
+            for path, (element, owner) in self.elements.items()
+            if path in touched or (fragment_id and owner != fragment_id)
+        }
+
+    async def think(self):
+        if self.think_time > 0:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_time))
+
+    async def set_value(self, widget, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.values[widget.id] = WidgetState(id=widget.id, **value)
+        await self.think()
+        await self.run()
+
+    async def click(self, label=None, key=None):
+        button, fragment_id = self.find("button", label=label, key=key)
+        if button is None or button.disabled:
+            raise RuntimeError(f"button {label or key} not available")
+
+        await self.think()
+        await self.run(trigger=button.id, fragment_id=fragment_id)
+
+    async def onboarding(self):
+        await self.run()
+
+        checkbox, _ = next(self.widgets("checkbox"))
+        await self.set_value(checkbox, bool_value=True)
+
+        for key in ("gender_input", "age_input"):
+            selectbox, _ = self.find("selectbox", key=key)
+            # 第一项是占位的空选项
+            await self.set_value(selectbox, string_value=self.rng.choice(selectbox.options[1:]))
+
+        radio, _ = self.find("radio", key="role_input")
+        await self.set_value(radio, string_value=self.rng.choice(radio.options))
+
+        await self.click(label=T["start_btn"])
+
+    async def vote(self, max_actions):
+        for _ in range(max_actions):
+            if self.step() != "voting":
+                return
+
+            r = self.rng.random()
+            back, _ = self.find("button", label=T["btn_back"])
+
+            if r < self.back_rate and back is not None and not back.disabled:
+                await self.click(label=T["btn_back"])
+            elif r < self.back_rate + self.skip_rate:
+                await self.click(label=self.rng.choice([T["btn_skip_equal"], T["btn_skip_neither"]]))
+            else:
+                await self.click(key=self.rng.choice(["L", "R"]))
+
+    def finish(self):
+        if self.step() != "end":
+            self.stats.add_error("not_finished")
+            return
+
+        restart, _ = self.find("button", label=T["restart"])
+        if restart.disabled:
+            self.stats.add_error("undelivered")
+            return
+
+        self.stats.add_completed()
+
+    async def session(self, max_actions):
+        import websockets
+
+        async with websockets.connect(self.url, subprotocols=["streamlit"], max_size=None) as ws:
+            self.ws = ws
+            await self.onboarding()
+            await self.vote(max_actions)
+            self.finish()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workdir, timeout=60.0):
+    """
+    在子进程里运行 streamlit run，等到 /_stcore/health 可用。环境变量（假的事件后端等）由父进程继承。
+    """
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w")
+
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", SCRIPT,
+            "--server.headless", "true",
+            "--server.address", "127.0.0.1",
+            "--server.port", str(port),
+            "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false"
+        ],
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return server, log_path
+        except OSError:
+            time.sleep(0.2)
+
+    server.kill()
+    raise RuntimeError(f"streamlit server did not start; see {log_path}")
+
+
+async def run_server_participants(stats, url, args):
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one(seed):
+        async with limit:
+            p = ServerParticipant(
+                stats, random.Random(seed), url, args.timeout,
+                args.back_rate, args.skip_rate, args.think_time
+            )
+            try:
+                await p.session(args.max_actions)
+            except asyncio.TimeoutError:
+                stats.add_error("timeout")
+            except Exception:
+                stats.add_error("crash")
+                if args.verbose:
+                    traceback.print_exc()
+
+    await asyncio.gather(*(one(args.seed * 1_000_003 + i) for i in range(args.participants)))
+
+
+def run_participant(stats, seed, args):
+    rng = random.Random(seed)
+
+    try:
+        p = Participant(stats, rng, args.timeout, args.back_rate, args.skip_rate)
+        p.onboarding()
+        p.vote(args.max_actions)
+        p.finish()
+    except Exception:
+        stats.add_error("crash")
+        if args.verbose:
+            traceback.print_exc()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Start the survey with streamlit run, drive it with concurrent websocket participants and report rerun latency."
+    )
+    parser.add_argument("--participants", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="Participants active at the same time.")
+    parser.add_argument("--back-rate", type=float, default=0.05)
+    parser.add_argument("--skip-rate", type=float, default=0.1)
+    parser.add_argument("--max-actions", type=int, default=200, help="Give up on a participant after this many clicks.")
+    parser.add_argument("--sink-latency", type=float, default=0.3, help="Simulated seconds per event-sink write.")
+    parser.add_argument("--pair-selection", default=None, help="Override PAIR_SELECTION (random / active / balanced / schedule / stratified).")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds allowed per rerun.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a participant waits before each click (exponential).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run participants with AppTest in this process, one rerun at a time, with participant ids fixed by --seed."
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.in_process:
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print("websockets is not installed; run pip install -r requirements-analysis.txt (or use --in-process).")
+            return 1
+
+    # 假的事件后端：不写 Google Sheets，用内存 + 模拟网络延迟代替；日志写到临时目录
+    workdir = tempfile.mkdtemp(prefix="survey-load-")
+    os.environ["EVENT_SINK"] = "memory"
+    os.environ["EVENT_SINK_LATENCY"] = str(args.sink_latency)
+    os.environ["EVENT_JOURNAL_PATH"] = os.path.join(workdir, "event_journal.sqlite3")
+    os.environ["EXPOSURE_COUNTS_PATH"] = os.path.join(workdir, "exposure_counts.json")
+    if args.pair_selection:
+        os.environ["PAIR_SELECTION"] = args.pair_selection
+
+    # 相对路径（images/、static/）以仓库目录为准
+    os.chdir(os.path.dirname(SCRIPT))
+
+    stats = LoadStats()
+
+    mode = "in-process" if args.in_process else "server"
+    print(
+        f"Participants: {args.participants}, concurrency: {args.concurrency}, "
+        f"sink latency: {args.sink_latency}s, mode: {mode}"
+    )
+
+    if args.in_process:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for i in range(args.participants):
+                pool.submit(run_participant, stats, args.seed * 1_000_003 + i, args)
+        elapsed = time.perf_counter() - start
+    else:
+        port = free_port()
+        server, log_path = start_server(port, workdir)
+        try:
+            start = time.perf_counter()
+            asyncio.run(run_server_participants(stats, f"ws://127.0.0.1:{port}/_stcore/stream", args))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"Server log:  {log_path}")
+
+    latencies = stats.latencies
+    ms = [x * 1000 for x in latencies]
+    service_ms = [x * 1000 for x in stats.service_times]
+
+    print(f"Elapsed:     {elapsed:.1f}s")
+    print(f"Reruns:      {len(latencies)} ({len(latencies) / elapsed:.1f}/s)")
+    print(f"Completed:   {stats.completed}/{args.participants} ({stats.completed / elapsed * 60:.1f}/min)")
+    print(
+        f"Latency ms:  p50 {percentile(ms, 50):.1f}  p95 {percentile(ms, 95):.1f}  "
+        f"p99 {percentile(ms, 99):.1f}  max {max(ms, default=0):.1f}"
+    )
+    if args.in_process:
+        print(
+            f"Service ms:  p50 {percentile(service_ms, 50):.1f}  p95 {percentile(service_ms, 95):.1f}  "
+            f"p99 {percentile(service_ms, 99):.1f}  (excluding time queued behind other reruns)"
+        )
+
+    if stats.errors:
+        print("Errors:      " + ", ".join(f"{k}={v}" for k, v in sorted(stats.errors.items())))
+    else:
+        print("Errors:      0")
+
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
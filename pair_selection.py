@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import random
+import threading
+
+import numpy as np
+
+
+class ActivePairIndex:
+    """
+    进程级的主动学习选对索引，所有会话共享。
+    每个类别为每张图维护 Bradley–Terry 强度的高斯近似（均值 mu、信息量 info）：
+    先按不确定性（1 / info）抽一张锚点图，再在未看过的图里选
+    “结果最难预测 × 两张图不确定性之和” 最大的对手，即期望信息增益最大的一对。
+    新投票用在线拉普拉斯近似更新，不需要重新拟合。
+    """
+
+    def __init__(self, image_keys, categories, prior=1.0, jitter=0.1, seed=None):
+        self.keys = list(image_keys)
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.prior = prior
+        self.jitter = jitter
+
+        n = len(self.keys)
+        self.mu = {c: np.zeros(n) for c in categories}
+        self.info = {c: np.full(n, prior) for c in categories}
+        self.comparisons = {c: np.zeros(n, dtype=np.int64) for c in categories}
+
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def load_scores(self, scores):
+        """
+        用 perception_scores.py 的输出（image, category, bt_score, bt_se, comparisons）热启动。
+        """
+        with self._lock:
+            for row in scores.itertuples(index=False):
+                i = self.key_index.get(row.image)
+                if i is None or row.category not in self.mu:
+                    continue
+                self.mu[row.category][i] = row.bt_score
+                self.info[row.category][i] = 1 / row.bt_se ** 2
+                self.comparisons[row.category][i] = int(row.comparisons)
+
+    def record(self, category, winner_key, loser_key, tie=False):
+        """
+        用一次比较结果更新两张图的强度。返回这次更新的增量，传给 retract 可以撤销；
+        类别或图片不在索引中时返回 None。
+        """
+        if category not in self.mu:
+            return None
+
+        w = self.key_index.get(winner_key)
+        l = self.key_index.get(loser_key)
+        if w is None or l is None:
+            return None
+
+        with self._lock:
+            mu = self.mu[category]
+            info = self.info[category]
+
+            p = 1 / (1 + np.exp(mu[l] - mu[w]))
+            surprise = (0.5 if tie else 1.0) - p
+            curvature = p * (1 - p)
+
+            info[w] += curvature
+            info[l] += curvature
+            step_w = surprise / info[w]
+            step_l = surprise / info[l]
+            mu[w] += step_w
+            mu[l] -= step_l
+
+            self.comparisons[category][w] += 1
+            self.comparisons[category][l] += 1
+
+        return category, w, l, step_w, step_l, curvature
+
+    def retract(self, update):
+        """
+        撤销 record 返回的一次更新（受访者返回上一题、收回投票时）。
+        中间有其他会话的更新时，减去当时的增量是一阶近似。
+        """
+        category, w, l, step_w, step_l, curvature = update
+
+        with self._lock:
+            self.mu[category][w] -= step_w
+            self.mu[category][l] += step_l
+            self.info[category][w] -= curvature
+            self.info[category][l] -= curvature
+            self.comparisons[category][w] -= 1
+            self.comparisons[category][l] -= 1
+
+    def select(self, category, used_keys=()):
+        """
+        返回两张图的下标；未看过的图不足 2 张时在全部图片中选择。
+        """
+        n = len(self.keys)
+
+        available = np.ones(n, dtype=bool)
+        for key in used_keys:
+            i = self.key_index.get(key)
+            if i is not None:
+                available[i] = False
+        if available.sum() < 2:
+            available[:] = True
+
+        with self._lock:
+            mu = self.mu[category].copy()
+            var = 1 / self.info[category]
+
+        candidates = np.flatnonzero(available)
+
+        weights = var[candidates]
+        anchor = self._rng.choice(candidates, p=weights / weights.sum())
+
+        p = 1 / (1 + np.exp(mu[anchor] - mu[candidates]))
+        gain = p * (1 - p) * (var[anchor] + var[candidates])
+        gain *= 1 + self.jitter * self._rng.random(len(candidates))
+        gain[candidates == anchor] = -np.inf
+
+        partner = candidates[np.argmax(gain)]
+
+        # 左右位置随机，避免锚点总在左边
+        if self._rng.random() < 0.5:
+            return int(anchor), int(partner)
+        return int(partner), int(anchor)
+
+
+class FenwickTree:
+    """
+    树状数组：单点更新、前缀和、按累计权重查找，均为 O(log n)。
+    """
+
+    def __init__(self, weights):
+        self.n = len(weights)
+        self.tree = [0.0] * (self.n + 1)
+        self.values = [0.0] * self.n
+
+        for i, w in enumerate(weights):
+            self.add(i, w)
+
+    def add(self, i, delta):
+        self.values[i] += delta
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def set(self, i, value):
+        self.add(i, value - self.values[i])
+
+    def total(self):
+        total = 0.0
+        i = self.n
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, target):
+        """
+        返回前缀和首次超过 target 的下标。
+        """
+        pos = 0
+        step = 1 << self.n.bit_length()
+
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+
+        return min(pos, self.n - 1)
+
+
+def exposure_weight(count):
+    return 1.0 / (1.0 + count)
+
+
+class ExposureBalancer:
+    """
+    进程级的曝光计数：按 (图片, 类别) 统计被展示的次数，所有会话共享。
+    抽样时按 1 / (1 + 曝光次数) 加权，曝光少的图片更容易被抽中，
+    第二张图只从另一个 case 中抽取（case_l != case_r）。
+    每个 (类别, case) 一棵树状数组，抽样和更新都是 O(log n)。
+    计数定期写入本地 JSON 文件，进程重启后继续累计。
+    """
+
+    def __init__(self, items, categories, path=None, flush_interval=60.0, seed=None):
+        self.items = list(items)
+        self.keys = [f"{case}/{name}" for case, name in self.items]
+        self.key_index = {key: i for i, key in enumerate(self.keys)}
+        self.cases = sorted({case for case, _ in self.items})
+        self.path = path
+        self.flush_interval = flush_interval
+
+        # 每个 case 内部的局部下标
+        self.case_members = {case: [] for case in self.cases}
+        self.local_index = []
+        for i, (case, _) in enumerate(self.items):
+            self.local_index.append(len(self.case_members[case]))
+            self.case_members[case].append(i)
+
+        self.counts = {c: [0] * len(self.items) for c in categories}
+        self._load()
+
+        self.trees = {
+            (c, case): FenwickTree([
+                exposure_weight(self.counts[c][i])
+                for i in self.case_members[case]
+            ])
+            for c in categories
+            for case in self.cases
+        }
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            saved = json.load(f)
+
+        for category, counts in saved.items():
+            if category not in self.counts:
+                continue
+            for key, count in counts.items():
+                i = self.key_index.get(key)
+                if i is not None:
+                    self.counts[category][i] = count
+
+    def flush(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            snapshot = {
+                category: {
+                    key: count
+                    for key, count in zip(self.keys, counts)
+                    if count
+                }
+                for category, counts in self.counts.items()
+            }
+            self._flushed_at = time.monotonic()
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self.path)
+
+    def record(self, category, indices):
+        if category not in self.counts:
+            return
+
+        with self._lock:
+            counts = self.counts[category]
+            for i in indices:
+                counts[i] += 1
+                case = self.items[i][0]
+                self.trees[(category, case)].set(
+                    self.local_index[i],
+                    exposure_weight(counts[i])
+                )
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+
+        if due:
+            self.flush()
+
+    def _draw(self, category, cases):
+        totals = [self.trees[(category, case)].total() for case in cases]
+        target = self._rng.random() * sum(totals)
+
+        for case, total in zip(cases, totals):
+            if target < total or case == cases[-1]:
+                local = self.trees[(category, case)].find(min(target, total - 1e-12))
+                return self.case_members[case][local]
+            target -= total
+
+    def sample(self, category, used_keys=(), tries=20):
+        """
+        返回两张图的下标（来自不同的 case）；类别未知时返回 None。
+        已看过的图用拒绝抽样排除，多次失败后允许重复。
+        """
+        if category not in self.counts:
+            return None
+
+        used = {self.key_index[k] for k in used_keys if k in self.key_index}
+
+        with self._lock:
+            first = None
+            for _ in range(tries):
+                first = self._draw(category, self.cases)
+                if first not in used:
+                    break
+
+            first_case = self.items[first][0]
+            others = [case for case in self.cases if case != first_case] or self.cases
+
+            second = None
+            for _ in range(tries):
+                second = self._draw(category, others)
+                if second != first and second not in used:
+                    break
+
+        if second == first:
+            return None
+
+        return first, second
+
+
+class UnusedImageSampler:
+    """
+    每个会话一个的未使用图片抽样器：对图片下标做惰性 Fisher–Yates 洗牌。
+    只记录被交换过的位置，抽取和标记已用都是 O(1)，
+    也不需要预先分配与图库等长的数组；内存只随抽取次数增长。
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.remaining = n
+        self._value_at = {}
+        self._position_of = {}
+
+    def _get(self, pos):
+        return self._value_at.get(pos, pos)
+
+    def _find(self, value):
+        return self._position_of.get(value, value)
+
+    def _put(self, pos, value):
+        if pos == value:
+            self._value_at.pop(pos, None)
+            self._position_of.pop(value, None)
+        else:
+            self._value_at[pos] = value
+            self._position_of[value] = pos
+
+    def _remove_at(self, pos):
+        # 把末尾的元素换到 pos，被移除的元素放到未使用区之外
+        last = self.remaining - 1
+        value = self._get(pos)
+        last_value = self._get(last)
+        self._put(pos, last_value)
+        self._put(last, value)
+        self.remaining -= 1
+        return value
+
+    def is_used(self, value):
+        return self._find(value) >= self.remaining
+
+    def discard(self, value):
+        """
+        标记某张图已使用（例如由其他选对方式选中）。
+        """
+        pos = self._find(value)
+        if pos < self.remaining:
+            self._remove_at(pos)
+
+    def draw_pair(self, rng=random):
+        """
+        随机取出两张未使用的图片；不足 2 张时返回 None，由调用方回退到全图库。
+        """
+        if self.remaining < 2:
+            return None
+
+        first = self._remove_at(rng.randrange(self.remaining))
+        second = self._remove_at(rng.randrange(self.remaining))
+        return first, second
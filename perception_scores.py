@@ -0,0 +1,633 @@
+import os
+import sys
+import math
+import argparse
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+TIE_EVENT = "skip_equal"
+NUMERIC_COLUMNS = ["event_seq", "response_index", "removed_response_index"]
+
+
+def load_events(paths):
+    """
+    读取导出的事件日志（CSV、Parquet 文件或 export_events.py 写出的分区目录）。
+    序号列在解析时直接转成数值（空值为 NaN）；CSV 的其余列保持字符串，
+    分区目录里已经带类型的列（categorical、datetime 等）保留原类型。
+    """
+    frames = []
+
+    for path in paths:
+        if os.path.isdir(path) or path.endswith(".parquet"):
+            frames.append(pd.read_parquet(path))
+        else:
+            frames.append(pd.read_csv(
+                path,
+                dtype={col: "float64" for col in NUMERIC_COLUMNS},
+                keep_default_na=False,
+                na_values={col: [""] for col in NUMERIC_COLUMNS}
+            ))
+
+    events = pd.concat(frames, ignore_index=True)
+
+    for col in events.columns:
+        if col in NUMERIC_COLUMNS:
+            events[col] = _numeric(events[col]).astype("float64")
+        elif isinstance(events[col].dtype, np.dtype) and events[col].dtype.kind in "Obiuf":
+            events[col] = events[col].astype(str)
+
+    return events
+
+
+def _numeric(column):
+    if pd.api.types.is_numeric_dtype(column):
+        return column
+    return pd.to_numeric(column, errors="coerce")
+
+
+def final_votes(events):
+    """
+    从 append-only 日志得到最终有效投票：
+    同一 participant_id + response_index 只保留 event_seq 最大的 vote，
+    若之后还有 back 事件撤回了这个 response_index，则这次投票也无效。
+    重试产生的重复 event_id 先去重。
+    """
+    events = events.drop_duplicates("event_id")
+
+    votes = events[events["event_type"] == "vote"]
+    votes = votes.assign(
+        _seq=_numeric(votes["event_seq"]),
+        _ri=_numeric(votes["response_index"])
+    )
+    votes = (
+        votes.sort_values(["participant_id", "_seq"])
+        .drop_duplicates(["participant_id", "_ri"], keep="last")
+    )
+
+    backs = events[events["event_type"] == "back"]
+    backs = backs.assign(
+        _seq=_numeric(backs["event_seq"]),
+        _ri=_numeric(backs["removed_response_index"])
+    )
+    last_back = (
+        backs.groupby(["participant_id", "_ri"])["_seq"]
+        .max()
+        .rename("_back_seq")
+        .reset_index()
+    )
+
+    votes = votes.merge(last_back, on=["participant_id", "_ri"], how="left")
+    keep = votes["_back_seq"].isna() | (votes["_back_seq"] < votes["_seq"])
+
+    return votes[keep].drop(columns=["_seq", "_ri", "_back_seq"])
+
+
+def comparison_table(events):
+    """
+    把事件整理成比较表：winner / loser 图片、类别、是否平局。
+    skip_equal 视为平局，skip_neither 不含偏好信息，忽略。
+    """
+    votes = final_votes(events)
+    left_won = votes["winner"] == "left"
+
+    wins = pd.DataFrame({
+        "category": votes["category"].to_numpy(),
+        "winner": np.where(left_won, votes["left_img"], votes["right_img"]),
+        "loser": np.where(left_won, votes["right_img"], votes["left_img"]),
+        "tie": False,
+        "timestamp": votes["timestamp"].to_numpy(),
+        "order": _numeric(votes["event_seq"]).to_numpy()
+    })
+
+    ties = events[events["event_type"] == TIE_EVENT].drop_duplicates("event_id")
+    ties = pd.DataFrame({
+        "category": ties["category"].to_numpy(),
+        "winner": ties["left_img"].to_numpy(),
+        "loser": ties["right_img"].to_numpy(),
+        "tie": True,
+        "timestamp": ties["timestamp"].to_numpy(),
+        "order": _numeric(ties["event_seq"]).to_numpy()
+    })
+
+    table = pd.concat([wins, ties], ignore_index=True)
+    return table[(table["winner"] != "") & (table["loser"] != "")]
+
+
+def image_index(table, images=None):
+    names = pd.Index(sorted(
+        set(table["winner"]) | set(table["loser"]) | set(images or [])
+    ))
+    return names
+
+
+def win_matrix(table, names):
+    """
+    稀疏胜负矩阵 W：W[i, j] 为 i 胜 j 的次数，平局各记 0.5。
+    """
+    n = len(names)
+    w = names.get_indexer(table["winner"])
+    l = names.get_indexer(table["loser"])
+    tie = table["tie"].to_numpy()
+    weight = np.where(tie, 0.5, 1.0)
+
+    rows = np.concatenate([w, l[tie]])
+    cols = np.concatenate([l, w[tie]])
+    data = np.concatenate([weight, weight[tie]])
+
+    return sparse.coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+
+
+def fit_bradley_terry(W, prior=1.0, max_iter=1000, tol=1e-8, init=None):
+    """
+    Bradley–Terry 的 MM 算法（Hunter, 2004），全部为向量化的稀疏运算。
+    prior 为每张图与一个强度为 1 的虚拟对手各胜各负的次数，
+    保证没有胜场或比较图不连通时也有有限解。
+    init 为上一轮的 log 强度，用于热启动。
+    返回 (log 强度, 标准误)。
+    """
+    n = W.shape[0]
+    N = (W + W.T).tocoo()
+    rows, cols, counts = N.row, N.col, N.data
+    wins = np.asarray(W.sum(axis=1)).ravel() + prior
+
+    p = np.ones(n) if init is None else np.exp(init)
+
+    for _ in range(max_iter):
+        denom = np.bincount(
+            rows,
+            weights=counts / (p[rows] + p[cols]),
+            minlength=n
+        ) + 2 * prior / (p + 1)
+        new_p = wins / denom
+        new_p /= np.exp(np.mean(np.log(new_p)))
+
+        converged = np.max(np.abs(np.log(new_p) - np.log(p))) < tol
+        p = new_p
+        if converged:
+            break
+
+    # Fisher 信息矩阵对角线的近似，用于不确定性
+    pr = p[rows] * p[cols] / (p[rows] + p[cols]) ** 2
+    info = np.bincount(rows, weights=counts * pr, minlength=n) + 2 * prior * p / (p + 1) ** 2
+
+    return np.log(p), 1 / np.sqrt(info)
+
+
+class TrueSkill:
+    """
+    两人对局的 TrueSkill 更新（含平局）。
+    本质上是按时间顺序的在线更新，这里用纯 float 列表做内层循环，避免 numpy 标量开销。
+    """
+
+    def __init__(self, mu=25.0, sigma=25.0 / 3, beta=25.0 / 6, tau=25.0 / 300, draw_probability=0.1):
+        self.mu = mu
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+        self.draw_margin = NormalDist().inv_cdf((draw_probability + 1) / 2) * math.sqrt(2) * beta
+
+    def rate(self, n, winners, losers, ties, mu=None, sigma=None):
+        mus = [self.mu] * n if mu is None else list(mu)
+        var = [self.sigma ** 2] * n if sigma is None else [s * s for s in sigma]
+
+        beta2 = 2 * self.beta ** 2
+        tau2 = self.tau ** 2
+        pdf = _pdf
+        cdf = _cdf
+
+        for a, b, tie in zip(winners, losers, ties):
+            va = var[a] + tau2
+            vb = var[b] + tau2
+            c = math.sqrt(beta2 + va + vb)
+            t = (mus[a] - mus[b]) / c
+            e = self.draw_margin / c
+
+            if tie:
+                denom = cdf(e - t) - cdf(-e - t)
+                if denom < 1e-12:
+                    continue
+                v = (pdf(-e - t) - pdf(e - t)) / denom
+                w = v * v + ((e - t) * pdf(e - t) + (e + t) * pdf(e + t)) / denom
+            else:
+                denom = cdf(t - e)
+                if denom < 1e-12:
+                    v = e - t
+                    w = 1.0
+                else:
+                    v = pdf(t - e) / denom
+                    w = v * (v + t - e)
+
+            mus[a] += va / c * v
+            mus[b] -= vb / c * v
+            var[a] = va * max(1 - va / (c * c) * w, 1e-6)
+            var[b] = vb * max(1 - vb / (c * c) * w, 1e-6)
+
+        return np.array(mus), np.sqrt(np.array(var))
+
+
+_SQRT2 = math.sqrt(2)
+_INV_SQRT2PI = 1 / math.sqrt(2 * math.pi)
+
+
+def _pdf(x):
+    return _INV_SQRT2PI * math.exp(-0.5 * x * x)
+
+
+def _cdf(x):
+    return 0.5 * math.erfc(-x / _SQRT2)
+
+
+def score_events(events, images=None, prior=1.0, trueskill=True):
+    """
+    对每个类别分别拟合 Bradley–Terry（以及可选的 TrueSkill），返回长表：
+    image, category, bt_score, bt_se, wins, losses, ties, comparisons, ts_mu, ts_sigma
+    """
+    table = comparison_table(events)
+    names = image_index(table, images)
+    n = len(names)
+    results = []
+
+    for category, group in table.groupby("category", sort=True):
+        W = win_matrix(group, names)
+        score, se = fit_bradley_terry(W, prior=prior)
+
+        w = names.get_indexer(group["winner"])
+        l = names.get_indexer(group["loser"])
+        tie = group["tie"].to_numpy()
+
+        result = pd.DataFrame({
+            "image": names,
+            "category": category,
+            "bt_score": score,
+            "bt_se": se,
+            "wins": np.bincount(w[~tie], minlength=n),
+            "losses": np.bincount(l[~tie], minlength=n),
+            "ties": np.bincount(np.concatenate([w[tie], l[tie]]), minlength=n)
+        })
+        result["comparisons"] = result["wins"] + result["losses"] + result["ties"]
+
+        if trueskill:
+            ordered = group.sort_values(["timestamp", "order"], kind="stable")
+            mu, sigma = TrueSkill().rate(
+                n,
+                names.get_indexer(ordered["winner"]).tolist(),
+                names.get_indexer(ordered["loser"]).tolist(),
+                ordered["tie"].tolist()
+            )
+            result["ts_mu"] = mu
+            result["ts_sigma"] = sigma
+
+        results.append(result)
+
+    return pd.concat(results, ignore_index=True)
+
+
+class IncrementalScorer:
+    """
+    增量模式：检查点保存每个类别的稀疏胜负计数、每个参与者已处理到的 event_seq、
+    已读取的行数和上一轮的 Bradley–Terry 分数。
+    每次只读取新增的行：vote 加计数，back 减去它撤回的那一票，skip_equal 记平局；
+    之后以上一轮分数热启动重新拟合。
+    检查点还保存每个 (participant_id, response_index) 当前有效的一票：back 只撤回确实计入过的投票。
+    按会话缓冲提交时被压缩掉的投票从未写入日志，对应的 back 不减计数。
+    TrueSkill 无法撤回已应用的更新，增量模式只维护 Bradley–Terry。
+    """
+
+    def __init__(self, prior=1.0):
+        self.prior = prior
+        self.names = []
+        self.index = {}
+        self.counts = {}
+        self.scores = {}
+        self.last_seq = {}
+        # (participant_id, response_index) -> (类别, 胜者, 负者)
+        self.open_votes = {}
+        self.row_offset = 0
+
+    def _indices(self, images):
+        for name in images.unique():
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+        return images.map(self.index).to_numpy(dtype=np.int64)
+
+    def _fresh(self, events):
+        """
+        去掉检查点之前已经处理过的事件（包括重试导致的重复写入）。
+        """
+        events = events.assign(_seq=_numeric(events["event_seq"]))
+        events = events.drop_duplicates(["participant_id", "_seq"])
+
+        last = events["participant_id"].map(self.last_seq).astype(float).fillna(-np.inf)
+        events = events[events["_seq"] > last]
+
+        if len(events):
+            newest = events.groupby("participant_id")["_seq"].max()
+            self.last_seq.update(newest.to_dict())
+
+        return events
+
+    def _vote_changes(self, events):
+        """
+        按每个参与者的 event_seq 顺序处理 vote 和 back，返回计数的增减 (类别, 胜者, 负者, 权重)。
+        与 final_votes 一致：同一题的新投票替换旧投票，back 撤回该题当前有效的投票（没有则忽略）。
+        """
+        changes = events[events["event_type"].isin(["vote", "back"])]
+        changes = changes.assign(
+            _ri=np.where(
+                changes["event_type"] == "vote",
+                _numeric(changes["response_index"]),
+                _numeric(changes["removed_response_index"])
+            )
+        ).sort_values(["participant_id", "_seq"], kind="stable")
+
+        rows = []
+        for pid, event_type, ri, category, left, right, winner in zip(
+            changes["participant_id"], changes["event_type"], changes["_ri"],
+            changes["category"], changes["left_img"], changes["right_img"], changes["winner"]
+        ):
+            key = (pid, ri)
+            previous = self.open_votes.pop(key, None)
+            if previous is not None:
+                rows.append((*previous, -1.0))
+
+            if event_type == "vote":
+                vote = (category, left, right) if winner == "left" else (category, right, left)
+                self.open_votes[key] = vote
+                rows.append((*vote, 1.0))
+
+        return pd.DataFrame(rows, columns=["category", "winner", "loser", "weight"])
+
+    def update(self, events):
+        events = self._fresh(events)
+
+        parts = [self._vote_changes(events)]
+
+        ties = events[events["event_type"] == TIE_EVENT]
+        for a, b in (("left_img", "right_img"), ("right_img", "left_img")):
+            parts.append(pd.DataFrame({
+                "category": ties["category"].to_numpy(),
+                "winner": ties[a].to_numpy(),
+                "loser": ties[b].to_numpy(),
+                "weight": 0.5
+            }))
+
+        table = pd.concat(parts, ignore_index=True)
+        table = table[(table["winner"] != "") & (table["loser"] != "")]
+
+        w = self._indices(table["winner"])
+        l = self._indices(table["loser"])
+        n = len(self.names)
+
+        for W in self.counts.values():
+            W.resize((n, n))
+
+        categories = table["category"].to_numpy()
+        weights = table["weight"].to_numpy(dtype=float)
+
+        for category in pd.unique(categories):
+            mask = categories == category
+            delta = sparse.coo_matrix(
+                (weights[mask], (w[mask], l[mask])),
+                shape=(n, n)
+            ).tocsr()
+            W = self.counts.get(category, sparse.csr_matrix((n, n)))
+            self.counts[category] = W + delta
+
+        return len(events)
+
+    def refit(self):
+        n = len(self.names)
+        results = []
+
+        # 只出现在已撤回投票里的图片没有任何比较，和全量模式一样不输出
+        compared = np.zeros(n, dtype=bool)
+        for W in self.counts.values():
+            W.eliminate_zeros()
+            compared |= np.asarray((W + W.T).sum(axis=1)).ravel() > 0
+
+        for category in sorted(self.counts):
+            W = self.counts[category]
+
+            init = np.zeros(n)
+            previous = self.scores.get(category)
+            if previous is not None:
+                init[:len(previous)] = previous
+
+            score, se = fit_bradley_terry(W, prior=self.prior, init=init)
+            self.scores[category] = score
+
+            results.append(pd.DataFrame({
+                "image": self.names,
+                "category": category,
+                "bt_score": score,
+                "bt_se": se,
+                "comparisons": np.asarray((W + W.T).sum(axis=1)).ravel()
+            })[compared])
+
+        if not results:
+            return pd.DataFrame(columns=["image", "category", "bt_score", "bt_se", "comparisons"])
+
+        return pd.concat(results, ignore_index=True)
+
+    def save(self, path):
+        arrays = {
+            "names": np.array(self.names, dtype=str),
+            "prior": np.array(self.prior),
+            "row_offset": np.array(self.row_offset),
+            "pid": np.array(list(self.last_seq), dtype=str),
+            "pid_seq": np.array(list(self.last_seq.values()), dtype=float),
+            "categories": np.array(sorted(self.counts), dtype=str),
+            "open_pid": np.array([pid for pid, _ in self.open_votes], dtype=str),
+            "open_ri": np.array([ri for _, ri in self.open_votes], dtype=float),
+            "open_vote": np.array(list(self.open_votes.values()), dtype=str).reshape(-1, 3)
+        }
+
+        for k, category in enumerate(sorted(self.counts)):
+            W = self.counts[category].tocoo()
+            arrays[f"row_{k}"] = W.row
+            arrays[f"col_{k}"] = W.col
+            arrays[f"data_{k}"] = W.data
+            if category in self.scores:
+                arrays[f"score_{k}"] = self.scores[category]
+
+        # 传文件对象，避免 numpy 自动追加 .npz 后缀
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            scorer = cls(prior=float(data["prior"]))
+            scorer.names = data["names"].tolist()
+            scorer.index = {name: i for i, name in enumerate(scorer.names)}
+            scorer.row_offset = int(data["row_offset"])
+            scorer.last_seq = dict(zip(data["pid"].tolist(), data["pid_seq"].tolist()))
+
+            # 旧检查点没有保存有效投票
+            if "open_pid" in data:
+                scorer.open_votes = {
+                    (pid, ri): tuple(vote)
+                    for pid, ri, vote in zip(
+                        data["open_pid"].tolist(), data["open_ri"].tolist(), data["open_vote"].tolist()
+                    )
+                }
+
+            n = len(scorer.names)
+            for k, category in enumerate(data["categories"].tolist()):
+                scorer.counts[category] = sparse.coo_matrix(
+                    (data[f"data_{k}"], (data[f"row_{k}"], data[f"col_{k}"])),
+                    shape=(n, n)
+                ).tocsr()
+                if f"score_{k}" in data:
+                    scorer.scores[category] = data[f"score_{k}"]
+
+        return scorer
+
+
+def count_rows(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+
+    with open(path, "rb") as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def load_new_events(paths, row_offset):
+    """
+    把多个文件视为一条连续的行流，只读取 row_offset 之后的行。
+    返回 (新事件, 总行数)。
+    """
+    frames = []
+    seen = 0
+
+    for path in paths:
+        rows = count_rows(path)
+        skip = min(max(row_offset - seen, 0), rows)
+        seen += rows
+
+        if skip == rows:
+            continue
+
+        if path.endswith(".parquet"):
+            frames.append(load_events([path]).iloc[skip:])
+        else:
+            frames.append(pd.read_csv(
+                path,
+                skiprows=range(1, skip + 1),
+                dtype={col: "float64" for col in NUMERIC_COLUMNS},
+                keep_default_na=False,
+                na_values={col: [""] for col in NUMERIC_COLUMNS}
+            ))
+
+    if not frames:
+        return pd.DataFrame(), seen
+
+    events = pd.concat(frames, ignore_index=True)
+    for col in events.columns:
+        if col not in NUMERIC_COLUMNS:
+            events[col] = events[col].astype(str)
+
+    return events, seen
+
+
+# --check-incremental 允许的 bt_score 差值（MM 迭代在相对变化小于 1e-8 时停止，绝对误差可以大几个数量级）
+CHECK_TOLERANCE = 1e-4
+
+
+def check_incremental(events, batches, prior=1.0):
+    """
+    把日志按行分成 batches 批依次送入 IncrementalScorer（相当于每批之后运行一次 --checkpoint，
+    检查点经过保存和载入），与全量模式的 Bradley–Terry 结果比较。
+    返回 (增量行数, 全量行数, comparisons 最大差值, bt_score 最大差值)。
+    比较次数应当完全相同；分数只在 MM 迭代的收敛精度内一致（图片顺序不同，迭代路径也不同）。
+    """
+    import tempfile
+
+    full = score_events(events, prior=prior, trueskill=False)
+    scorer = IncrementalScorer(prior=prior)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "check.ckpt")
+        for chunk in np.array_split(np.arange(len(events)), batches):
+            scorer.update(events.iloc[chunk])
+            scorer.refit()
+            scorer.save(path)
+            scorer = IncrementalScorer.load(path)
+
+    incremental = scorer.refit()
+    merged = full.merge(incremental, on=["image", "category"], how="outer", suffixes=("_full", "_incremental"))
+    counts = (merged["comparisons_full"] - merged["comparisons_incremental"]).abs().max()
+    scores = (merged["bt_score_full"] - merged["bt_score_incremental"]).abs().max()
+
+    # 任一边缺行或出现 NaN 时差值为 NaN，按不一致处理
+    return (
+        len(incremental),
+        len(full),
+        np.inf if np.isnan(counts) else float(counts),
+        np.inf if np.isnan(scores) else float(scores)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit per-image Bradley-Terry and TrueSkill perception scores from the Events log."
+    )
+    parser.add_argument("events", nargs="+", help="Exported Events CSV or Parquet files.")
+    parser.add_argument("--out", default="perception_scores.csv")
+    parser.add_argument("--prior", type=float, default=1.0)
+    parser.add_argument("--no-trueskill", action="store_true")
+    parser.add_argument(
+        "--checkpoint",
+        help="Incremental mode: only read rows added since this checkpoint (Bradley-Terry only)."
+    )
+    parser.add_argument(
+        "--check-incremental",
+        type=int,
+        metavar="BATCHES",
+        help="Feed the log to the incremental scorer in this many batches and compare with full mode; exit 1 on mismatch."
+    )
+    args = parser.parse_args()
+
+    if args.check_incremental:
+        rows, full_rows, counts, scores = check_incremental(
+            load_events(args.events), args.check_incremental, prior=args.prior
+        )
+        ok = rows == full_rows and counts == 0 and scores <= CHECK_TOLERANCE
+        print(
+            f"Incremental rows: {rows}, full rows: {full_rows}, max comparisons difference: {counts:g}, "
+            f"max bt_score difference: {scores:.2e} -> {'ok' if ok else 'MISMATCH'}"
+        )
+        sys.exit(0 if ok else 1)
+
+    if args.checkpoint:
+        if os.path.exists(args.checkpoint):
+            scorer = IncrementalScorer.load(args.checkpoint)
+        else:
+            scorer = IncrementalScorer(prior=args.prior)
+
+        events, total_rows = load_new_events(args.events, scorer.row_offset)
+        applied = scorer.update(events) if len(events) else 0
+        scorer.row_offset = total_rows
+
+        scores = scorer.refit()
+        scorer.save(args.checkpoint)
+        scores.to_csv(args.out, index=False)
+
+        print(f"New rows: {len(events)}, applied events: {applied}, scored rows: {len(scores)} -> {args.out}")
+        return
+
+    events = load_events(args.events)
+    scores = score_events(events, prior=args.prior, trueskill=not args.no_trueskill)
+    scores.to_csv(args.out, index=False)
+
+    print(f"Events: {len(events)}, scored rows: {len(scores)} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
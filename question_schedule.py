@@ -0,0 +1,181 @@
+import uuid
+import random
+import argparse
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from image_manifest import load_catalogue, read_excluded
+from studies import DEFAULT_STUDY_ID, STUDIES_DIR, load_studies
+
+
+def case_pairs(cases, within_case=False):
+    """
+    所有 case 两两组合；within_case 为 True 时也包括同一 case 内部的比较。
+    只有一个 case 时只能做 case 内部的比较。
+    """
+    pairs = list(combinations(cases, 2))
+    if within_case or not pairs:
+        pairs += [(case, case) for case in cases]
+    return pairs
+
+
+def schedule_rng(participant_id):
+    """
+    计划只由 participant_id 决定，任何进程都能重新生成同一份计划。
+    """
+    return random.Random(f"schedule:{participant_id}")
+
+
+def build_schedule(catalogue, categories, questions_per_category, length, rng, within_case=False):
+    """
+    为一位受访者生成完整的题目计划（循环区组设计，线性时间）：
+    1. case 组合随机排列后循环铺满 类别数 x questions_per_category 个题位，按类别分成连续的区组，
+       每个类别拿到互不相同的组合，整份计划里各组合出现次数最多相差 1；
+    2. 每道题左右顺序随机；
+    3. 每个 case 的图片洗牌后依次取用，计划内不重复（该 case 的图片用完才会重复）；
+    4. 打乱题目顺序，取前 length 题。
+    排列由 rng 决定，因此在受访者之间每个 (类别, case 组合) 出现的机会相同。
+    返回 [(category, case_l, img_l, case_r, img_r), ...]。
+    """
+    by_case = defaultdict(list)
+    for case, filename in catalogue:
+        by_case[case].append(filename)
+
+    pairs = [
+        (a, b) for a, b in case_pairs(list(by_case), within_case)
+        if a != b or len(by_case[a]) >= 2
+    ]
+    if not pairs:
+        raise ValueError("Not enough images to build a question schedule")
+
+    rng.shuffle(pairs)
+    queues = {}
+
+    def take(case, exclude=None):
+        while True:
+            queue = queues.get(case)
+            if not queue:
+                queue = list(by_case[case])
+                rng.shuffle(queue)
+                queues[case] = queue
+            filename = queue.pop()
+            if filename != exclude:
+                return filename
+
+    plan = []
+    slot = 0
+
+    for category in categories:
+        for _ in range(questions_per_category):
+            case_l, case_r = pairs[slot % len(pairs)]
+            slot += 1
+
+            if rng.random() < 0.5:
+                case_l, case_r = case_r, case_l
+
+            img_l = take(case_l)
+            img_r = take(case_r, exclude=img_l if case_l == case_r else None)
+            plan.append((category, case_l, img_l, case_r, img_r))
+
+    rng.shuffle(plan)
+    return plan[:length]
+
+
+def planned_pair(catalogue, schedule, question_index, skipped=()):
+    """
+    计划中某道题的一对图片在图库中的下标；这道题跳过过、超出计划或者图库已变化时返回 None。
+    """
+    if not schedule or question_index is None or question_index >= len(schedule):
+        return None
+    if question_index in skipped:
+        return None
+
+    cl, il, cr, ir = schedule[question_index]
+    picked = (catalogue.position(f"{cl}/{il}"), catalogue.position(f"{cr}/{ir}"))
+
+    return None if None in picked else picked
+
+
+def planned_positions(catalogue, schedule):
+    """
+    计划中所有图片在图库中的下标，按计划顺序；图库中已没有的图片略过。
+    跳过后的随机回退先把这些图片标记为已用，就不会抽到后面的题要用的图片。
+    """
+    positions = []
+    for cl, il, cr, ir in schedule or ():
+        for key in (f"{cl}/{il}", f"{cr}/{ir}"):
+            pos = catalogue.position(key)
+            if pos is not None:
+                positions.append(pos)
+    return positions
+
+
+def study_schedule(study, catalogue, participant_id, within_case=False):
+    return build_schedule(
+        catalogue,
+        study.categories,
+        study.questions_per_category,
+        study.target_votes,
+        schedule_rng(participant_id),
+        within_case=within_case
+    )
+
+
+def balance_report(plans):
+    """
+    汇总多份计划：每个 (类别, 无序 case 组合) 的出现次数、左侧位置的 case 分布和计划内重复的图片数。
+    """
+    cells = Counter()
+    left = Counter()
+    repeats = 0
+
+    for plan in plans:
+        seen = set()
+        for category, case_l, img_l, case_r, img_r in plan:
+            cells[(category, tuple(sorted((case_l, case_r))))] += 1
+            left[case_l] += 1
+            for key in (f"{case_l}/{img_l}", f"{case_r}/{img_r}"):
+                repeats += key in seen
+                seen.add(key)
+
+    return cells, left, repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate balanced question schedules (category + image pair) and report their balance."
+    )
+    parser.add_argument("--study", default=DEFAULT_STUDY_ID)
+    parser.add_argument("--studies-dir", default=STUDIES_DIR)
+    parser.add_argument("--participants", type=int, default=1000, help="Number of simulated participants.")
+    parser.add_argument("--participant-id", help="Print the schedule of this participant instead.")
+    parser.add_argument("--within-case", action="store_true", help="Also compare images from the same case.")
+    parser.add_argument("--exclude-duplicates", action="store_true", help="Leave out images listed in duplicates.json.")
+    args = parser.parse_args()
+
+    study = load_studies(args.studies_dir)[args.study]
+    exclude = read_excluded(study.img_dir) if args.exclude_duplicates else ()
+    catalogue = load_catalogue(study.img_dir, study.cases, study.manifest_path, exclude=exclude)
+
+    if args.participant_id:
+        plan = study_schedule(study, catalogue, args.participant_id, args.within_case)
+        for i, (category, case_l, img_l, case_r, img_r) in enumerate(plan, start=1):
+            print(f"{i:>3}  {category:<12} {case_l}/{img_l}  vs  {case_r}/{img_r}")
+        return
+
+    plans = [
+        study_schedule(study, catalogue, str(uuid.uuid4()), args.within_case)
+        for _ in range(args.participants)
+    ]
+    cells, left, repeats = balance_report(plans)
+
+    print(f"Participants: {len(plans)}, questions per plan: {len(plans[0])}, images repeated within a plan: {repeats}")
+    print("Category x case pair counts (min / max):")
+    for category in study.categories:
+        counts = [n for (c, _), n in cells.items() if c == category]
+        print(f"  {category:<12} {min(counts)} / {max(counts)} over {len(counts)} case pairs")
+    print("Left position by case: " + ", ".join(f"{case} {n}" for case, n in sorted(left.items())))
+
+
+if __name__ == "__main__":
+    main()
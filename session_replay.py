@@ -0,0 +1,285 @@
+import random
+import hashlib
+import argparse
+from collections import defaultdict
+
+# pair_selection、图库和研究定义只在重放时用到；问卷启动时只需要 session_seed
+PAIR_SELECTIONS = ["random", "schedule", "stratified"]
+
+
+def session_seed(participant_id):
+    """
+    由 participant_id 得到 64 位整数种子，与进程和 PYTHONHASHSEED 无关。
+    """
+    digest = hashlib.sha256(f"session:{participant_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def stratified_pair(feature_index, catalogue, rng, used_keys=()):
+    """
+    stratified 选对：特征索引给出两张来自不同分层的图，换算成图库下标。
+    没有特征索引、抽不到或图库已变化时返回 None。
+    """
+    if feature_index is None:
+        return None
+
+    keys = feature_index.sample_pair(rng, used_keys)
+    if keys is None:
+        return None
+
+    picked = (catalogue.position(keys[0]), catalogue.position(keys[1]))
+    return None if None in picked else picked
+
+
+class SessionReplay:
+    """
+    按投票页的顺序重放一个会话的随机选择：会话开始时生成题目顺序（schedule 为整份计划），
+    每次渲染为当前题取一对（优先用为这道题预取的一对），再为下一题预取一对。
+    vote / skip / back 事件驱动状态变化，apply() 返回这一步实际应当显示的类别和图片。
+    适用于 random、schedule 和 stratified 选对方式（stratified 需要与会话当时相同的特征文件）；
+    active / balanced 依赖所有会话共享的状态，无法单独重放。
+    """
+
+    def __init__(self, study, catalogue, participant_id, seed, pair_selection="random", feature_index=None):
+        from pair_selection import UnusedImageSampler
+        from question_schedule import planned_positions, study_schedule
+
+        if pair_selection not in PAIR_SELECTIONS:
+            raise ValueError(f"Sessions using {pair_selection} pair selection cannot be replayed")
+
+        self.catalogue = catalogue
+        self.feature_index = feature_index if pair_selection == "stratified" else None
+        self.target = study.target_votes
+        self.rng = random.Random(seed)
+        self.sampler = UnusedImageSampler(len(catalogue))
+        self.schedule = None
+
+        if pair_selection == "schedule":
+            plan = study_schedule(study, catalogue, participant_id)
+            self.questions = [item[0] for item in plan]
+            self.schedule = [item[1:] for item in plan]
+            # 与投票页相同：在任何抽取之前按计划顺序把计划中的图片标记为已用
+            for i in planned_positions(catalogue, self.schedule):
+                self.sampler.discard(i)
+        else:
+            self.questions = study.new_question_pool(self.rng)
+
+        self.question_index = 0
+        self.pair = None
+        self.next_pair = None
+        self.skipped = set()
+        self.used = set()
+
+    def _draw(self, question_index):
+        from question_schedule import planned_pair
+
+        picked = planned_pair(self.catalogue, self.schedule, question_index, self.skipped)
+
+        if picked is None:
+            picked = stratified_pair(self.feature_index, self.catalogue, self.rng, self.used)
+        if picked is None:
+            picked = self.sampler.draw_pair(self.rng)
+        if picked is None:
+            picked = self.rng.sample(range(len(self.catalogue)), 2)
+
+        for i in picked:
+            self.sampler.discard(i)
+
+        (cl, il), (cr, ir) = self.catalogue[picked[0]], self.catalogue[picked[1]]
+        self.used.update((f"{cl}/{il}", f"{cr}/{ir}"))
+        return cl, il, cr, ir
+
+    def render(self):
+        q = self.question_index
+        if q >= self.target:
+            return
+
+        if self.pair is None:
+            if self.next_pair is not None and self.next_pair[0] == q:
+                self.pair = self.next_pair[1]
+                self.next_pair = None
+            else:
+                self.pair = self._draw(q)
+
+        if (self.next_pair is None or self.next_pair[0] != q + 1) and q + 1 < self.target:
+            self.next_pair = (q + 1, self._draw(q + 1))
+
+    def shown(self):
+        if self.pair is None:
+            return None
+        cl, il, cr, ir = self.pair
+        return self.questions[self.question_index], f"{cl}/{il}", f"{cr}/{ir}"
+
+    def catch_up(self, question_index):
+        """
+        checkpoint / session 策略下，缓冲中被撤回的投票不写入日志（只留下 back 事件）。
+        后续事件的题号比当前题号大时，补上这些投票对题号和随机状态的影响。
+        """
+        while self.question_index < min(question_index, self.target):
+            self.question_index += 1
+            self.pair = None
+            self.render()
+
+    def apply(self, event):
+        """
+        处理一条事件。vote / skip 返回 (重放得到的 (类别, 左图, 右图), 日志中的同样三项)，其他事件返回 None。
+        """
+        event_type = event.get("event_type")
+
+        if event_type == "start":
+            self.render()
+            return None
+
+        # 事件发生时所在的题号：back 之前停在被撤回投票的下一题，vote / skip 记录了 question_number
+        if event_type == "back":
+            at = _int(event.get("removed_response_index"))
+        else:
+            at = _int(event.get("question_number"))
+            at = None if at is None else at - 1
+        if at is not None:
+            self.catch_up(at)
+
+        if event_type == "back":
+            self.question_index -= 1
+            self.pair = (
+                event.get("removed_case_l", ""),
+                str(event.get("removed_left_img", "")).split("/")[-1],
+                event.get("removed_case_r", ""),
+                str(event.get("removed_right_img", "")).split("/")[-1]
+            )
+            self.render()
+            return None
+
+        if event_type not in ("vote", "skip_equal", "skip_neither"):
+            return None
+
+        expected = self.shown()
+        logged = (event.get("category", ""), event.get("left_img", ""), event.get("right_img", ""))
+
+        if event_type == "vote":
+            self.question_index += 1
+        else:
+            self.skipped.add(self.question_index)
+
+        self.pair = None
+        self.render()
+        return expected, logged
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _seq(event):
+    return _int(event.get("event_seq")) or 0
+
+
+def replay_participant(study, catalogue, participant_id, events, pair_selection="random", feature_index=None):
+    """
+    重放一位参与者，返回 (状态, 步骤列表)。状态为：
+    ok / mismatch / no_seed（start 事件没有记录种子，会话早于可重放版本）/
+    gap（event_seq 缺号：事件丢失，之后无法对齐）。
+    checkpoint / session 策略下被压缩掉的投票不留缺号，按 back 事件和题号补上。
+    """
+    events = sorted(events, key=_seq)
+    start = next((e for e in events if e.get("event_type") == "start"), None)
+
+    try:
+        # 种子是 64 位整数，按字符串解析，不能经过 float
+        seed = int(str(start.get("rng_seed", "")).strip()) if start is not None else None
+    except ValueError:
+        seed = None
+
+    if seed is None:
+        return "no_seed", []
+
+    replay = SessionReplay(study, catalogue, participant_id, seed, pair_selection, feature_index)
+    steps = []
+    status = "ok"
+    last_seq = None
+
+    for event in events:
+        seq = _seq(event)
+        if last_seq is not None and seq != last_seq + 1:
+            return "gap", steps
+        last_seq = seq
+
+        result = replay.apply(event)
+        if result is None:
+            continue
+
+        expected, logged = result
+        match = expected == logged
+        if not match:
+            status = "mismatch"
+
+        steps.append({
+            "event_seq": seq,
+            "event_type": event.get("event_type"),
+            "expected": expected,
+            "logged": logged,
+            "match": match
+        })
+
+    return status, steps
+
+
+def main():
+    from image_manifest import load_catalogue, read_excluded
+    from studies import DEFAULT_STUDY_ID, STUDIES_DIR, load_studies
+    from vote_reconstruction import iter_events
+
+    parser = argparse.ArgumentParser(
+        description="Replay the questions and image pairs of participants from their session seed and check them against the Events log."
+    )
+    parser.add_argument("events", nargs="+", help="Events CSV / Parquet files or a Parquet dataset directory.")
+    parser.add_argument("--participant-id", help="Print every step of this participant.")
+    parser.add_argument("--pair-selection", default="random", choices=PAIR_SELECTIONS)
+    parser.add_argument("--study", default=DEFAULT_STUDY_ID)
+    parser.add_argument("--studies-dir", default=STUDIES_DIR)
+    parser.add_argument("--exclude-duplicates", action="store_true", help="The app ran with EXCLUDE_DUPLICATES=1.")
+    args = parser.parse_args()
+
+    study = load_studies(args.studies_dir)[args.study]
+    exclude = read_excluded(study.img_dir) if args.exclude_duplicates else ()
+    catalogue = load_catalogue(study.img_dir, study.cases, study.manifest_path, exclude=exclude)
+
+    feature_index = None
+    if args.pair_selection == "stratified":
+        from image_features import FeatureIndex
+
+        feature_index = FeatureIndex(study.img_dir, keys=[f"{case}/{name}" for case, name in catalogue])
+
+    by_participant = defaultdict(list)
+    for event in iter_events(args.events):
+        if args.participant_id and event.get("participant_id") != args.participant_id:
+            continue
+        by_participant[event.get("participant_id", "")].append(event)
+
+    if args.participant_id:
+        status, steps = replay_participant(
+            study, catalogue, args.participant_id, by_participant[args.participant_id],
+            args.pair_selection, feature_index
+        )
+        for step in steps:
+            category, left, right = step["expected"] or ("", "", "")
+            mark = "ok" if step["match"] else "MISMATCH logged " + " / ".join(step["logged"])
+            print(f"{step['event_seq']:>4}  {step['event_type']:<12} {category:<12} {left}  vs  {right}  {mark}")
+        print(f"Status: {status}")
+        return
+
+    totals = defaultdict(int)
+    for participant_id, events in by_participant.items():
+        status, _ = replay_participant(
+            study, catalogue, participant_id, events, args.pair_selection, feature_index
+        )
+        totals[status] += 1
+
+    print(f"Participants: {len(by_participant)}, " + ", ".join(f"{k}: {v}" for k, v in sorted(totals.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import random
+import threading
+import time
+
+import gspread
+import requests
+
+# 429 为超出配额，5xx 为 Google 端临时错误，均可重试
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    进程级令牌桶：rate 为每秒补充的令牌数，capacity 为允许的突发量。
+    acquire() 在令牌不足时阻塞，返回等待的秒数。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+
+                delay = (tokens - self._tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+def error_status(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+class RateLimitedWorksheet:
+    """
+    包装 gspread 的 Worksheet：所有调用先从共享令牌桶取令牌，
+    遇到 429 / 5xx 时做带抖动的指数退避重试，并统计调用、行数、重试和限流等待。
+    """
+
+    def __init__(self, worksheet, bucket, max_retries=6, base_delay=1.0, max_delay=64.0):
+        self.worksheet = worksheet
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "call_seconds": 0.0,
+            "rows": 0,
+            "retries": 0,
+            "errors": 0,
+            "throttle_waits": 0,
+            "throttle_wait_seconds": 0.0,
+            "backoff_seconds": 0.0
+        }
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def _call(self, fn, *args, rows=0, **kwargs):
+        attempt = 0
+
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                self._count(throttle_waits=1, throttle_wait_seconds=waited)
+
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except (gspread.exceptions.APIError, requests.exceptions.RequestException) as e:
+                status = error_status(e)
+                retryable = status is None or status in RETRY_STATUS_CODES
+
+                if not retryable or attempt >= self.max_retries:
+                    self._count(errors=1)
+                    raise
+
+                # full jitter：避免所有会话在同一时刻一起重试
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                self._count(retries=1, backoff_seconds=delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._count(calls=1, rows=rows, call_seconds=time.monotonic() - start)
+            return result
+
+    def append_rows(self, values, **kwargs):
+        return self._call(self.worksheet.append_rows, values, rows=len(values), **kwargs)
+
+    def col_values(self, col, **kwargs):
+        return self._call(self.worksheet.col_values, col, **kwargs)
+
+    def get_all_values(self, **kwargs):
+        return self._call(self.worksheet.get_all_values, **kwargs)
+
+    def row_values(self, row, **kwargs):
+        return self._call(self.worksheet.row_values, row, **kwargs)
+
+    def get(self, range_name, **kwargs):
+        return self._call(self.worksheet.get, range_name, **kwargs)
+
+
+def open_events_worksheet(config, worksheet_name, columns):
+    """
+    用 [connections.gsheets] 里的服务账号配置打开事件表，不存在时创建并写入表头。
+    问卷和导出脚本共用。
+    """
+    from google.oauth2.service_account import Credentials
+
+    spreadsheet_value = (
+        config.get("spreadsheet")
+        or config.get("spreadsheet_url")
+        or config.get("url")
+    )
+
+    credential_keys = [
+        "type",
+        "project_id",
+        "private_key_id",
+        "private_key",
+        "client_email",
+        "client_id",
+        "auth_uri",
+        "token_uri",
+        "auth_provider_x509_cert_url",
+        "client_x509_cert_url",
+        "universe_domain"
+    ]
+
+    creds_info = {
+        k: config[k]
+        for k in credential_keys
+        if k in config
+    }
+
+    if "private_key" in creds_info:
+        creds_info["private_key"] = creds_info["private_key"].replace("\\n", "\n")
+
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive"
+    ]
+
+    credentials = Credentials.from_service_account_info(
+        creds_info,
+        scopes=scopes
+    )
+
+    client = gspread.authorize(credentials)
+
+    if spreadsheet_value.startswith("http"):
+        spreadsheet = client.open_by_url(spreadsheet_value)
+    else:
+        try:
+            spreadsheet = client.open_by_key(spreadsheet_value)
+        except Exception:
+            spreadsheet = client.open(spreadsheet_value)
+
+    try:
+        worksheet = spreadsheet.worksheet(worksheet_name)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(
+            title=worksheet_name,
+            rows=1000,
+            cols=len(columns)
+        )
+        worksheet.append_row(columns)
+
+    header = worksheet.row_values(1)
+    if not header:
+        worksheet.append_row(columns)
+    elif len(header) < len(columns) and header == columns[:len(header)]:
+        # 后来新增的列追加在末尾：补齐表头，旧行这些列为空
+        if worksheet.col_count < len(columns):
+            worksheet.add_cols(len(columns) - worksheet.col_count)
+        worksheet.update("A1", [columns])
+
+    return worksheet
@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import random
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from survey_text import CAT_TRANS, LANG_DICT, QUESTIONS
+
+STUDIES_DIR = "studies"
+DEFAULT_STUDY_ID = "default"
+
+# id 会出现在文件名、指标名和 URL 参数里，只允许小写字母、数字和下划线
+STUDY_ID_PATTERN = re.compile(r"^[a-z0-9_]+$")
+
+# 研究定义文件示例（JSON；装了 PyYAML 时也可以写成 .yaml）：
+# {
+#   "id": "default",
+#   "img_dir": "images",
+#   "cases": ["CaseA", "CaseB"],
+#   "categories": ["Safe", "Lively"],
+#   "questions_per_category": 5,
+#   "target_votes": 10,
+#   "worksheet": "Events",
+#   "languages": ["English", "中文"],
+#   "questions": {"English": {"Safe": "..."}},       可选，缺省用 survey_text.QUESTIONS
+#   "category_names": {"English": {"Safe": "..."}},  可选，缺省用 survey_text.CAT_TRANS
+#   "text": {"English": {"title": "..."}}            可选，覆盖 LANG_DICT 中的界面文字
+# }
+
+
+@dataclass(frozen=True)
+class Study:
+    """
+    一次调查活动的全部配置：图片目录、case、类别、题量、事件工作表和各语言文字。
+    加载时校验一次，之后只读，所有会话共享。
+    """
+    id: str
+    img_dir: str
+    cases: tuple
+    categories: tuple
+    questions_per_category: int
+    target_votes: int
+    worksheet: str
+    languages: tuple
+    question_html: MappingProxyType
+    category_names: MappingProxyType
+    text: MappingProxyType
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.img_dir, "manifest.jsonl")
+
+    def new_question_pool(self, rng=random):
+        """
+        每个类别出现 questions_per_category 次，打乱顺序。
+        """
+        pool = list(self.categories) * self.questions_per_category
+        rng.shuffle(pool)
+        return pool
+
+
+def _frozen(mapping):
+    return MappingProxyType({
+        key: MappingProxyType(dict(value))
+        for key, value in mapping.items()
+    })
+
+
+def _require(definition, key, kind, source):
+    if key not in definition:
+        raise ValueError(f"{source}: missing required field '{key}'")
+
+    value = definition[key]
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ValueError(f"{source}: field '{key}' must be {kind.__name__}")
+
+    return value
+
+
+def _string_list(definition, key, source):
+    values = _require(definition, key, list, source)
+
+    if not values or not all(isinstance(v, str) and v for v in values):
+        raise ValueError(f"{source}: field '{key}' must be a non-empty list of strings")
+    if len(set(values)) != len(values):
+        raise ValueError(f"{source}: field '{key}' contains duplicates")
+
+    return tuple(values)
+
+
+def _per_language(definition, key, defaults, languages, categories, source):
+    """
+    questions / category_names：每种语言每个类别都要有文字，缺省取 survey_text 中的默认值。
+    """
+    given = definition.get(key, {})
+    if not isinstance(given, dict):
+        raise ValueError(f"{source}: field '{key}' must map languages to categories")
+
+    result = {}
+
+    for lang in languages:
+        texts = dict(defaults.get(lang, {}))
+        texts.update(given.get(lang, {}))
+
+        missing = [cat for cat in categories if cat not in texts]
+        if missing:
+            raise ValueError(f"{source}: no {key} for {', '.join(missing)} in {lang}")
+
+        result[lang] = {cat: texts[cat] for cat in categories}
+
+    return result
+
+
+def parse_study(definition, source="<study>"):
+    """
+    校验研究定义（已解析的 dict），返回 Study。错误统一抛出 ValueError，指明文件和字段。
+    """
+    if not isinstance(definition, dict):
+        raise ValueError(f"{source}: a study definition must be an object")
+
+    study_id = _require(definition, "id", str, source)
+    if not STUDY_ID_PATTERN.match(study_id):
+        raise ValueError(f"{source}: id '{study_id}' may only contain a-z, 0-9 and _")
+
+    img_dir = _require(definition, "img_dir", str, source)
+    if not os.path.isdir(img_dir):
+        raise ValueError(f"{source}: image folder '{img_dir}' does not exist")
+
+    cases = _string_list(definition, "cases", source)
+    categories = _string_list(definition, "categories", source)
+
+    per_category = definition.get("questions_per_category", 5)
+    if not isinstance(per_category, int) or isinstance(per_category, bool) or per_category < 1:
+        raise ValueError(f"{source}: questions_per_category must be a positive integer")
+
+    pool_size = len(categories) * per_category
+    target_votes = definition.get("target_votes", pool_size)
+    if not isinstance(target_votes, int) or isinstance(target_votes, bool) or not 1 <= target_votes <= pool_size:
+        raise ValueError(
+            f"{source}: target_votes must be between 1 and {pool_size} "
+            f"(categories x questions_per_category)"
+        )
+
+    worksheet = definition.get("worksheet", "Events")
+    if not isinstance(worksheet, str) or not worksheet:
+        raise ValueError(f"{source}: worksheet must be a non-empty string")
+
+    languages = _string_list(definition, "languages", source) if "languages" in definition else tuple(LANG_DICT)
+    unknown = [lang for lang in languages if lang not in LANG_DICT]
+    if unknown:
+        raise ValueError(f"{source}: unsupported languages {', '.join(unknown)}")
+
+    questions = _per_language(definition, "questions", QUESTIONS, languages, categories, source)
+    category_names = _per_language(definition, "category_names", CAT_TRANS, languages, categories, source)
+
+    overrides = definition.get("text", {})
+    if not isinstance(overrides, dict):
+        raise ValueError(f"{source}: field 'text' must map languages to strings")
+
+    text = {}
+    for lang in languages:
+        texts = dict(LANG_DICT[lang])
+        texts.update(overrides.get(lang, {}))
+        text[lang] = texts
+
+    return Study(
+        id=study_id,
+        img_dir=img_dir,
+        cases=cases,
+        categories=categories,
+        questions_per_category=per_category,
+        target_votes=target_votes,
+        worksheet=worksheet,
+        languages=languages,
+        question_html=_frozen({
+            lang: {cat: f'<p class="question-text">{q}</p>' for cat, q in qs.items()}
+            for lang, qs in questions.items()
+        }),
+        category_names=_frozen(category_names),
+        text=_frozen(text)
+    )
+
+
+def read_definition(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path}: install PyYAML to use YAML study files") from None
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_studies(directory=STUDIES_DIR):
+    """
+    读取目录下所有 .json / .yaml 研究定义，返回 {id: Study}。必须包含 default 研究。
+    派生图按 case 名存放，不同图片目录的研究不能使用同名 case。
+    """
+    studies = {}
+    case_dirs = {}
+
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith((".json", ".yaml", ".yml")):
+            continue
+
+        path = os.path.join(directory, name)
+        study = parse_study(read_definition(path), path)
+
+        if study.id in studies:
+            raise ValueError(f"{path}: duplicate study id '{study.id}'")
+
+        for case in study.cases:
+            other = case_dirs.setdefault(case, study.img_dir)
+            if os.path.normpath(other) != os.path.normpath(study.img_dir):
+                raise ValueError(f"{path}: case '{case}' is also used by a study in '{other}'")
+
+        studies[study.id] = study
+
+    if DEFAULT_STUDY_ID not in studies:
+        raise ValueError(f"{directory}: no study with id '{DEFAULT_STUDY_ID}'")
+
+    return studies
+
+
+def study_path(path, study):
+    """
+    默认研究沿用原来的本地文件名；其他研究在扩展名前加上 -<id>，互不覆盖。
+    """
+    if study.id == DEFAULT_STUDY_ID:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return f"{root}-{study.id}{ext}"
@@ -0,0 +1,256 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+# 延迟直方图的桶上限（秒），覆盖一次点击里从几毫秒的计算到几秒的网络写入
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "survey"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    inner = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in sorted(labels)
+    )
+    return "{" + inner + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    进程级的指标：计数器、仪表和耗时直方图，所有会话和后台线程共享。
+    render() 输出 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = {}
+        self.started = time.time()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("step_seconds", time.perf_counter() - start, step=step)
+
+    def timed(self, step):
+        """
+        装饰器版本的 timer。
+        """
+        def decorator(fn):
+            def wrapper(*args, **kwargs):
+                with self.timer(step):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__wrapped__ = fn
+            return wrapper
+        return decorator
+
+    def add_collector(self, prefix, snapshot, gauges=()):
+        """
+        输出时调用 snapshot()，把其他对象已有的统计字典（例如 RateLimitedWorksheet.metrics()）
+        转成 {prefix}_{key}_total 计数器；gauges 中的键作为仪表输出。
+        """
+        with self._lock:
+            self._collectors[prefix] = (snapshot, set(gauges))
+
+    def _process_samples(self):
+        samples = [
+            ("process_uptime_seconds", "gauge", {}, time.time() - self.started),
+            ("process_threads", "gauge", {}, threading.active_count())
+        ]
+
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            samples.append(("process_cpu_seconds_total", "counter", {}, usage.ru_utime + usage.ru_stime))
+            # Linux 上 ru_maxrss 的单位是 KB
+            samples.append(("process_max_rss_bytes", "gauge", {}, usage.ru_maxrss * 1024))
+
+        return samples
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {
+                key: (h.buckets, list(h.counts), h.count, h.sum)
+                for key, h in self._histograms.items()
+            }
+            collectors = dict(self._collectors)
+
+        samples = {}
+
+        def add(name, kind, labels, value):
+            samples.setdefault((name, kind), []).append((labels, value))
+
+        for (name, labels), value in counters.items():
+            add(name, "counter", labels, value)
+        for (name, labels), value in gauges.items():
+            add(name, "gauge", labels, value)
+
+        for prefix, (snapshot, gauge_keys) in collectors.items():
+            try:
+                values = snapshot()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in gauge_keys:
+                    add(f"{prefix}_{key}", "gauge", (), value)
+                else:
+                    add(f"{prefix}_{key}_total", "counter", (), value)
+
+        for name, kind, labels, value in self._process_samples():
+            add(name, kind, tuple(sorted(labels.items())), value)
+
+        lines = []
+
+        for (name, kind), values in sorted(samples.items()):
+            full = f"{PREFIX}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in values:
+                lines.append(f"{full}{label_text(labels)} {format_value(value)}")
+
+        by_name = {}
+        for (name, labels), data in histograms.items():
+            by_name.setdefault(name, []).append((labels, data))
+
+        for name, series in sorted(by_name.items()):
+            full = f"{PREFIX}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for labels, (buckets, counts, count, total) in series:
+                for upper, n in zip(buckets, counts):
+                    lines.append(f"{full}_bucket{label_text(labels + (('le', upper),))} {n}")
+                lines.append(f"{full}_bucket{label_text(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{full}_sum{label_text(labels)} {format_value(total)}")
+                lines.append(f"{full}_count{label_text(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("step_seconds", "Time spent in instrumented steps of a rerun.")
+
+
+class MetricsFileFlusher:
+    """
+    定期把指标写到本地文件（原子替换），可以交给 node_exporter 的 textfile collector 读取。
+    """
+
+    def __init__(self, registry, path, interval=15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name="metrics-flusher",
+            daemon=True
+        )
+        self._thread.start()
+
+    def flush(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.registry.render())
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+def start_http_server(registry, port, host="0.0.0.0"):
+    """
+    在后台线程里提供 GET /metrics，与 Streamlit 自己的端口分开。
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(
+        target=server.serve_forever,
+        name="metrics-http",
+        daemon=True
+    ).start()
+    return server
@@ -0,0 +1,273 @@
+# 问卷中所有静态文本（样式、翻译、题目）。
+# 放在独立模块里：Streamlit 每次点击都会重新执行主脚本，但导入的模块每个进程只加载一次。
+from functools import lru_cache
+
+# --- 极致排版 CSS (完全保留你的原始样式) ---
+STYLE_HTML = """
+    <style>
+    header {visibility: hidden !important; height: 0px !important;}
+    footer {visibility: hidden !important;}
+    .main .block-container { padding-top: 0.5rem !important; margin-top: -3.5rem !important; max-width: 98% !important; }
+    .progress-container { width: 100%; background-color: #f0f2f6; border-radius: 10px; margin: 5px 0px; position: relative; height: 18px; }
+    .progress-bar { background-color: #4CAF50; height: 100%; border-radius: 10px; transition: width 0.3s; }
+    .progress-text { position: absolute; width: 100%; text-align: center; top: 0; font-size: 12px; line-height: 18px; font-weight: bold; }
+    .question-text { font-size: 1.4rem !important; font-weight: 400; text-align: left !important; margin: 10px 0px !important; color: #1E1E1E; }
+    .keyword { font-weight: 700; color: #000; }
+    .pair-image img { display: block; width: 100%; height: auto; }
+    .prefetch-pair { position: absolute; width: 1px; height: 1px; overflow: hidden; opacity: 0; pointer-events: none; }
+    /* 弹窗内容滚动美化 */
+    div[data-testid="stDialog"] .stMarkdown { max-height: 65vh; overflow-y: auto; font-size: 0.95rem; line-height: 1.5; padding: 10px; }
+    @media (max-width: 640px) {
+        .stImage img, .pair-image img { max-height: 28vh !important; object-fit: cover; border-radius: 10px; }
+        div[data-testid="stHorizontalBlock"]:has(div.bottom-btns) { display: flex !important; flex-direction: row !important; justify-content: flex-start !important; gap: 10px !important; }
+        div[data-testid="stHorizontalBlock"]:has(div.bottom-btns) > div { width: auto !important; min-width: 85px !important; flex: none !important; }
+        .bottom-btns button { height: 2.2rem !important; font-size: 0.85rem !important; background-color: #f8f9fa !important; color: #666 !important; border: 1px solid #ddd !important; padding: 0 10px !important; }
+        .select-btn button { height: 3.2em !important; font-weight: bold !important; border: 2px solid #000 !important; }
+    }
+    </style>
+    """
+
+
+# --- 翻译字典 ---
+LANG_DICT = {
+    "English": {
+        "title": "Perception of Historic Centre Street Images",
+        "intro": """Welcome! This survey is part of a PhD research project on walkability and street-level perception in Italian historic centres. It explores how residents and tourists perceive streets in the historic centres of Florence, Ravenna, Bologna, and Ferrara.
+
+You will see 30 pairs of street-view images with a perception statement and choose the one that better matches a given perception, such as safe, lively, wealthy, beautiful, boring, or depressing. If both images match the description equally, or if neither image clearly matches it, you may select the corresponding option.
+
+The survey is anonymous and takes about 5 minutes to complete. Your responses will help us better understand subjective perceptions in historic centres.""",
+        "consent_intro": "Before starting, please read the Information Sheet and confirm whether you agree to participate in this anonymous academic survey.",
+        "privacy_btn": "📄 View Information Sheet",
+        "privacy_content": """
+            **1. Project Lead**: Prof. Elisa Conticelli (University of Bologna).
+
+            **2. Objectives**: To understand how people evaluate the quality of streets in Italian historic centres.
+
+            **3. Participation**: A short online survey (~5 min) comparing image pairs from Florence, Ravenna, Bologna, and Ferrara.
+
+            **4. Benefits & Risks**: Voluntary and free. No known risks or discomforts.
+
+            **5. Withdrawal**: Right to withdraw at any time without providing a reason.
+
+            **6. Results**: Right to request information on research findings.
+
+            **7. Anonymity**: The survey is anonymous. Only basic demographic information, including gender, age group, and participant role, is collected. No IP address or identifying data is recorded.
+
+            **8. Contacts**: Prof. Elisa Conticelli (elisa.conticelli@unibo.it) and Fangyu Chen (fangyu.chen2@unibo.it).
+        """,
+        "privacy_agree": "I am 18+, I have read the information and I consent to participate.",
+        "gender_title": "Please select your gender:",
+        "gender_placeholder": "Please select",
+        "gender_options": {"Male": "Male", "Female": "Female", "Other": "Other"},
+        "age_title": "Please select your age group:",
+        "age_placeholder": "Please select",
+        "age_options": {"18-29": "18–29", "30-44": "30–44", "45-59": "45–59", "60+": "60 or above"},
+        "role_title": "Please identify your role:",
+        "role_options": {
+            "City resident": "City resident",
+            "City user": "City user",
+            "Current tourist": "Current tourist",
+            "Previous tourist": "Previous tourist",
+            "Other": "Other"
+        },
+        "role_descriptions": {
+            "City resident": "I live in Florence, Ravenna, Bologna, or Ferrara.",
+            "City user": "I regularly use one of these historic centres for study, work, or other daily activities.",
+            "Current tourist": "I am currently visiting one of these historic centres as a tourist.",
+            "Previous tourist": "I have visited one or more of these historic centres before.",
+            "Other": "I do not fall into any of the above options."
+        },
+        "start_btn": "Start survey",
+        "btn_back": "⬅️ Back",
+        "btn_skip_equal": "Both images match equally",
+        "btn_skip_neither": "Neither image matches",
+        "btn_select": "Select Above",
+        "success": "✅ Data synced!",
+        "end_title": "Completed",
+        "thank_you": "Thank you for your time!",
+        "restart": "Restart"
+    },
+
+    "中文": {
+        "title": "历史中心街景图像感知",
+        "intro": """欢迎！本问卷是关于意大利历史中心步行性与街道层面感知的博士研究项目的一部分。本研究旨在了解居民和游客如何感知佛罗伦萨、拉文纳、博洛尼亚和费拉拉历史中心的街道环境。
+
+您将看到30组街景图像对，每组图像都会对应一个感知描述。请根据该描述选择更符合的一张图片，例如安全、活跃、高档、美丽、乏味或压抑。如果两张图片同样符合描述，或者两张图片都不明显符合描述，您可以选择相应选项。
+
+本问卷为匿名问卷，完成约需5分钟。您的回答将帮助我们更好地理解历史中心中的主观感知。""",
+        "consent_intro": "开始前，请阅读知情告知书，并确认您是否同意参与本匿名学术问卷。",
+        "privacy_btn": "📄 查看知情告知书全文",
+        "privacy_content": """
+            **1. 项目负责人**：Elisa Conticelli 教授（博洛尼亚大学）。
+
+            **2. 研究目标**：了解公众如何评价意大利历史中心街道的空间质量。
+
+            **3. 参与过程**：完成一份约 5 分钟的在线问卷，对比随机抽取的佛罗伦萨、拉文纳、博洛尼亚和费拉拉的街景照片。
+
+            **4. 利益与风险**：自愿且免费参加。不存在已知风险或不便。
+
+            **5. 退出权利**：您有权随时中断参与，无需说明理由。
+
+            **6. 结果获取**：您有权了解研究的最终学术成果。
+
+            **7. 匿名保护**：本研究为匿名问卷，仅收集性别、年龄组和参与者身份类型等基础人口统计信息。系统不记录 IP 地址或身份识别信息。
+
+            **8. 联系方式**：Elisa Conticelli 教授 (elisa.conticelli@unibo.it) 或 陈方宇 (fangyu.chen2@unibo.it)。
+        """,
+        "privacy_agree": "我确认已年满18周岁，已阅读知情告知书，并同意参与本问卷。",
+        "gender_title": "请选择您的性别：",
+        "gender_placeholder": "请选择",
+        "gender_options": {"Male": "男性", "Female": "女性", "Other": "其他"},
+        "age_title": "请选择您的年龄组：",
+        "age_placeholder": "请选择",
+        "age_options": {"18-29": "18–29岁", "30-44": "30–44岁", "45-59": "45–59岁", "60+": "60岁及以上"},
+        "role_title": "请选择您的角色：",
+        "role_options": {
+            "City resident": "城市居民",
+            "City user": "城市使用者",
+            "Current tourist": "游客",
+            "Previous tourist": "曾经到访游客",
+            "Other": "其他"
+        },
+        "role_descriptions": {
+            "City resident": "我居住在佛罗伦萨、拉文纳、博洛尼亚或费拉拉。",
+            "City user": "我经常因学习、工作或其他日常活动使用其中一个历史中心。",
+            "Current tourist": "我目前正作为游客访问其中一个历史中心。",
+            "Previous tourist": "我曾经访问过一个或多个这些历史中心。",
+            "Other": "以上选项均不符合我的情况。"
+        },
+        "start_btn": "开始问卷",
+        "btn_back": "⬅️ 返回",
+        "btn_skip_equal": "两张图片同样符合",
+        "btn_skip_neither": "两张图片都不符合",
+        "btn_select": "选择上方图片",
+        "success": "✅ 数据已同步！",
+        "end_title": "问卷已完成",
+        "thank_you": "感谢您的参与！",
+        "restart": "重新开始"
+    },
+
+    "Italiano": {
+        "title": "Percezione dell’ambiente urbano in aree storiche",
+        "intro": """Benvenuti! Questo questionario fa parte di una ricerca di dottorato in Architettura e Culture del Progetto dell’Università di Bologna sulla pedonalità e sulla percezione da parte dei pedoni delle aree percorribili a piedi nei centri storici italiani. Lo studio esplora come residenti e turisti percepiscono le strade nei centri storici, prendendo a riferimento in particolare quelli di Firenze, Ravenna, Bologna e Ferrara.
+
+Vi verranno mostrate 30 coppie di immagini stradali e un’affermazione, inerente a una sensazione che le immagini vi dovrebbero provocare (come ad esempio sicura, vivace, curata, bella, noiosa o deprimente). Per ogni coppia, scegliete l’immagine che corrisponde meglio all’affermazione proposta. Se entrambe le immagini corrispondono allo stesso modo alla descrizione, oppure se nessuna delle due corrisponde chiaramente, potete selezionare l’opzione corrispondente.
+
+Il questionario è anonimo e richiede circa 5 minuti per essere completato. Le vostre risposte ci aiuteranno a comprendere meglio le percezioni soggettive nei centri storici.""",
+        "consent_intro": "Prima di iniziare, ti invitiamo a leggere l’informativa e a confermare se acconsenti a partecipare a questo questionario accademico anonimo.",
+        "privacy_btn": "📄 Leggi l’informativa",
+        "privacy_content": """
+            **1. Responsabile progetto**: Prof.ssa Elisa Conticelli (Università di Bologna).
+
+            **2. Obiettivi**: Capire come le persone valutano la qualità delle strade nei centri storici italiani.
+
+            **3. Partecipazione**: Questionario online (circa 5 min). Confronto di immagini di Firenze, Ravenna, Bologna e Ferrara.
+
+            **4. Benefici e rischi**: La partecipazione è volontaria e gratuita. Non comporta rischi o disagi.
+
+            **5. Ritiro**: Diritto di ritirare il consenso in qualsiasi momento senza motivazione.
+
+            **6. Restituzione**: Diritto a richiedere informazioni sui risultati della ricerca.
+
+            **7. Anonimato**: Il questionario è anonimo. Vengono raccolte solo informazioni demografiche di base, tra cui genere, fascia d'età e ruolo del partecipante. Non vengono registrati indirizzi IP o dati identificativi.
+
+            **8. Contatti**: Prof.ssa Elisa Conticelli (elisa.conticelli@unibo.it) e Fangyu Chen (fangyu.chen2@unibo.it).
+        """,
+        "privacy_agree": "Dichiaro di avere almeno 18 anni, di aver letto l’informativa e di acconsentire a partecipare.",
+        "gender_title": "Seleziona il tuo genere:",
+        "gender_placeholder": "Seleziona",
+        "gender_options": {"Male": "Maschio", "Female": "Femmina", "Other": "Altro"},
+        "age_title": "Seleziona la tua fascia d'età:",
+        "age_placeholder": "Seleziona",
+        "age_options": {"18-29": "18–29", "30-44": "30–44", "45-59": "45–59", "60+": "60 o più"},
+        "role_title": "Seleziona il tuo ruolo:",
+        "role_options": {
+            "City resident": "Residente",
+            "City user": "Utente abituale",
+            "Current tourist": "Turista",
+            "Previous tourist": "Turista in passato",
+            "Other": "Altro"
+        },
+        "role_descriptions": {
+            "City resident": "Vivo a Firenze, Ravenna, Bologna o Ferrara.",
+            "City user": "Frequento uno di questi centri storici per studio, lavoro o altre attività.",
+            "Current tourist": "Sto visitando attualmente uno di questi centri storici come turista.",
+            "Previous tourist": "Ho visitato in passato uno o più di questi centri storici.",
+            "Other": "Non mi ritrovo in nessuna delle opzioni proposte."
+        },
+        "start_btn": "Inizia il questionario",
+        "btn_back": "⬅️ Indietro",
+        "btn_skip_equal": "Entrambe corrispondono allo stesso modo",
+        "btn_skip_neither": "Nessuna corrisponde alla descrizione",
+        "btn_select": "Seleziona sopra",
+        "success": "✅ Dati sincronizzati!",
+        "end_title": "Completato",
+        "thank_you": "Grazie per il tuo tempo!",
+        "restart": "Ricomincia"
+    }
+}
+
+QUESTIONS = {
+    "English": {
+        "Safe": "From a pedestrian’s perspective, which street would feel <span class='keyword'>safer</span> while walking?",
+        "Lively": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more lively</span> while walking?",
+        "Wealthy": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more wealthy</span> while walking?",
+        "Beautiful": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more beautiful</span> while walking?",
+        "Boring": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more boring</span> while walking?",
+        "Depressing": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more depressing</span> while walking?"
+    },
+    "中文": {
+        "Safe": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更安全</span>？",
+        "Lively": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更活跃</span>？",
+        "Wealthy": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更高档</span>？",
+        "Beautiful": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更美丽</span>？",
+        "Boring": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更无聊</span>？",
+        "Depressing": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更压抑</span>？"
+    },
+    "Italiano": {
+        "Safe": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più sicura</span> da percorrere a piedi?",
+        "Lively": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più vivace (stimolante)</span> da percorrere a piedi?",
+        "Wealthy": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più curata</span> da percorrere a piedi?",
+        "Beautiful": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più bella</span> da percorrere a piedi?",
+        "Boring": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più noiosa</span> da percorrere a piedi?",
+        "Depressing": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più deprimente</span> da percorrere a piedi?"
+    }
+}
+
+CAT_TRANS = {
+    "English": {
+        "Safe": "safe",
+        "Lively": "lively",
+        "Wealthy": "wealthy",
+        "Beautiful": "beautiful",
+        "Boring": "boring",
+        "Depressing": "depressing"
+    },
+    "中文": {
+        "Safe": "安全",
+        "Lively": "活跃",
+        "Wealthy": "高档",
+        "Beautiful": "美丽",
+        "Boring": "无聊",
+        "Depressing": "压抑"
+    },
+    "Italiano": {
+        "Safe": "sicura",
+        "Lively": "vivace",
+        "Wealthy": "curata",
+        "Beautiful": "bella",
+        "Boring": "noiosa",
+        "Depressing": "deprimente"
+    }
+}
+
+@lru_cache(maxsize=None)
+def progress_html(vote_count, target):
+    percent = int((vote_count / target) * 100)
+    return f'''
+        <div class="progress-container">
+            <div class="progress-bar" style="width: {percent}%;"></div>
+            <div class="progress-text">{vote_count} / {target}</div>
+        </div>
+        '''
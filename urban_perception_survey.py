@@ -1,17 +1,59 @@
 import streamlit as st
-import pandas as pd
 import os
 import random
 import uuid
-import gspread
 from datetime import datetime
-from google.oauth2.service_account import Credentials
+from image_derivatives import (
+    DERIVATIVE_WIDTHS,
+    derivative_path,
+    ensure_derivatives,
+    picture_html
+)
+from image_manifest import DUPLICATES_FILE, load_catalogue, manifest_version, read_excluded
+from event_writer import BackgroundEventWriter, DELIVERED, FAILED
+from event_journal import EventJournal
+from event_sinks import EVENT_COLUMNS, make_sink
+from cold_start import COLD_START
+from survey_metrics import METRICS, MetricsFileFlusher, start_http_server
+from survey_text import STYLE_HTML, progress_html
+from studies import DEFAULT_STUDY_ID, load_studies, study_path
+from pair_selection import ActivePairIndex, ExposureBalancer, UnusedImageSampler
+from question_schedule import planned_pair, planned_positions, study_schedule
+from session_replay import session_seed, stratified_pair
+
+# pandas、gspread、google-auth 导入较慢，只在真正用到时再导入（见各函数内部），
+# 冷启动后的第一页不再为它们等待
+COLD_START.mark("imports")
 
 # --- 1. RESEARCH CONFIGURATION ---
-IMG_DIR = "images"
-TARGET_VOTES = 30
-CASES = ["CaseA", "CaseB", "CaseC", "CaseD"]
-EVENT_WORKSHEET_NAME = "Events"
+# 图片目录、case、类别、题量、事件工作表和各语言文字见 studies/*.json，
+# 每个研究一个文件，通过 URL 参数 ?study=<id> 选择，不带参数时为 default
+STUDIES_DIR = os.environ.get("STUDIES_DIR", "studies")
+# 选对方式：random（均匀随机）/ active（按不确定性选择信息量最大的一对）
+# / balanced（跨会话均衡曝光，优先曝光少的图片和跨 case 的组合）
+# / schedule（按 participant_id 预先生成整份计划：类别 x case 组合均衡，图片不重复）
+# / stratified（按图片特征分层，两张图来自不同的分层；特征由 image_features.py 预先计算）
+PAIR_SELECTION = os.environ.get("PAIR_SELECTION", "random")
+PAIR_SCORES_PATH = os.environ.get("PAIR_SCORES_PATH", "perception_scores.csv")
+# 为 1 时按 image_duplicates.py 写出的 duplicates.json 排除近似重复的图片（每簇保留一张）
+EXCLUDE_DUPLICATES = os.environ.get("EXCLUDE_DUPLICATES", "0") == "1"
+EXPOSURE_COUNTS_PATH = os.environ.get("EXPOSURE_COUNTS_PATH", "exposure_counts.json")
+EVENT_BATCH_MAX_ROWS = 200
+# 提交策略：stream（每个事件立即提交）/ checkpoint（每 COMMIT_CHECKPOINT_EVERY 个事件提交一次）
+# / session（整个会话缓冲在本地日志里，结束页一次提交）。缓冲期间撤回的投票可以直接删掉
+COMMIT_POLICY = os.environ.get("COMMIT_POLICY", "stream")
+COMMIT_CHECKPOINT_EVERY = int(os.environ.get("COMMIT_CHECKPOINT_EVERY", "10"))
+COMPACT_BACK_EVENTS = os.environ.get("COMPACT_BACK_EVENTS", "1") == "1"
+EVENT_BATCH_MAX_WAIT = 2.0
+END_SYNC_TIMEOUT = 15
+# Google Sheets 写入配额：每个服务账号每分钟 60 次请求
+SHEETS_REQUESTS_PER_MINUTE = 60
+SHEETS_BURST = 5
+EVENT_JOURNAL_PATH = os.environ.get("EVENT_JOURNAL_PATH", "event_journal.sqlite3")
+# 运行指标：METRICS_PATH 定期写出 Prometheus 文本文件，METRICS_PORT 在单独端口提供 /metrics
+METRICS_PATH = os.environ.get("METRICS_PATH", "")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_FLUSH_INTERVAL = 15.0
 
 st.set_page_config(
     page_title="Perception of Historic Centre Street Images",
@@ -19,339 +61,310 @@ st.set_page_config(
     layout="centered"
 )
 
-# --- 2. 极致排版 CSS (完全保留你的原始样式) ---
-st.markdown("""
-    <style>
-    header {visibility: hidden !important; height: 0px !important;}
-    footer {visibility: hidden !important;}
-    .main .block-container { padding-top: 0.5rem !important; margin-top: -3.5rem !important; max-width: 98% !important; }
-    .progress-container { width: 100%; background-color: #f0f2f6; border-radius: 10px; margin: 5px 0px; position: relative; height: 18px; }
-    .progress-bar { background-color: #4CAF50; height: 100%; border-radius: 10px; transition: width 0.3s; }
-    .progress-text { position: absolute; width: 100%; text-align: center; top: 0; font-size: 12px; line-height: 18px; font-weight: bold; }
-    .question-text { font-size: 1.4rem !important; font-weight: 400; text-align: left !important; margin: 10px 0px !important; color: #1E1E1E; }
-    .keyword { font-weight: 700; color: #000; }
-    /* 弹窗内容滚动美化 */
-    div[data-testid="stDialog"] .stMarkdown { max-height: 65vh; overflow-y: auto; font-size: 0.95rem; line-height: 1.5; padding: 10px; }
-    @media (max-width: 640px) {
-        .stImage img { max-height: 28vh !important; object-fit: cover; border-radius: 10px; }
-        div[data-testid="stHorizontalBlock"]:has(div.bottom-btns) { display: flex !important; flex-direction: row !important; justify-content: flex-start !important; gap: 10px !important; }
-        div[data-testid="stHorizontalBlock"]:has(div.bottom-btns) > div { width: auto !important; min-width: 85px !important; flex: none !important; }
-        .bottom-btns button { height: 2.2rem !important; font-size: 0.85rem !important; background-color: #f8f9fa !important; color: #666 !important; border: 1px solid #ddd !important; padding: 0 10px !important; }
-        .select-btn button { height: 3.2em !important; font-weight: bold !important; border: 2px solid #000 !important; }
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-# --- 3. 翻译字典 ---
-LANG_DICT = {
-    "English": {
-        "title": "Perception of Historic Centre Street Images",
-        "intro": """Welcome! This survey is part of a PhD research project on walkability and street-level perception in Italian historic centres. It explores how residents and tourists perceive streets in the historic centres of Florence, Ravenna, Bologna, and Ferrara.
-
-You will see 30 pairs of street-view images with a perception statement and choose the one that better matches a given perception, such as safe, lively, wealthy, beautiful, boring, or depressing. If both images match the description equally, or if neither image clearly matches it, you may select the corresponding option.
-
-The survey is anonymous and takes about 5 minutes to complete. Your responses will help us better understand subjective perceptions in historic centres.""",
-        "consent_intro": "Before starting, please read the Information Sheet and confirm whether you agree to participate in this anonymous academic survey.",
-        "privacy_btn": "📄 View Information Sheet",
-        "privacy_content": """
-            **1. Project Lead**: Prof. Elisa Conticelli (University of Bologna).
-
-            **2. Objectives**: To understand how people evaluate the quality of streets in Italian historic centres.
-
-            **3. Participation**: A short online survey (~5 min) comparing image pairs from Florence, Ravenna, Bologna, and Ferrara.
-
-            **4. Benefits & Risks**: Voluntary and free. No known risks or discomforts.
-
-            **5. Withdrawal**: Right to withdraw at any time without providing a reason.
-
-            **6. Results**: Right to request information on research findings.
-
-            **7. Anonymity**: The survey is anonymous. Only basic demographic information, including gender, age group, and participant role, is collected. No IP address or identifying data is recorded.
-
-            **8. Contacts**: Prof. Elisa Conticelli (elisa.conticelli@unibo.it) and Fangyu Chen (fangyu.chen2@unibo.it).
-        """,
-        "privacy_agree": "I am 18+, I have read the information and I consent to participate.",
-        "gender_title": "Please select your gender:",
-        "gender_placeholder": "Please select",
-        "gender_options": {"Male": "Male", "Female": "Female", "Other": "Other"},
-        "age_title": "Please select your age group:",
-        "age_placeholder": "Please select",
-        "age_options": {"18-29": "18–29", "30-44": "30–44", "45-59": "45–59", "60+": "60 or above"},
-        "role_title": "Please identify your role:",
-        "role_options": {
-            "City resident": "City resident",
-            "City user": "City user",
-            "Current tourist": "Current tourist",
-            "Previous tourist": "Previous tourist",
-            "Other": "Other"
-        },
-        "role_descriptions": {
-            "City resident": "I live in Florence, Ravenna, Bologna, or Ferrara.",
-            "City user": "I regularly use one of these historic centres for study, work, or other daily activities.",
-            "Current tourist": "I am currently visiting one of these historic centres as a tourist.",
-            "Previous tourist": "I have visited one or more of these historic centres before.",
-            "Other": "I do not fall into any of the above options."
-        },
-        "start_btn": "Start survey",
-        "btn_back": "⬅️ Back",
-        "btn_skip_equal": "Both images match equally",
-        "btn_skip_neither": "Neither image matches",
-        "btn_select": "Select Above",
-        "success": "✅ Data synced!",
-        "end_title": "Completed",
-        "thank_you": "Thank you for your time!",
-        "restart": "Restart"
-    },
-
-    "中文": {
-        "title": "历史中心街景图像感知",
-        "intro": """欢迎！本问卷是关于意大利历史中心步行性与街道层面感知的博士研究项目的一部分。本研究旨在了解居民和游客如何感知佛罗伦萨、拉文纳、博洛尼亚和费拉拉历史中心的街道环境。
-
-您将看到30组街景图像对，每组图像都会对应一个感知描述。请根据该描述选择更符合的一张图片，例如安全、活跃、高档、美丽、乏味或压抑。如果两张图片同样符合描述，或者两张图片都不明显符合描述，您可以选择相应选项。
-
-本问卷为匿名问卷，完成约需5分钟。您的回答将帮助我们更好地理解历史中心中的主观感知。""",
-        "consent_intro": "开始前，请阅读知情告知书，并确认您是否同意参与本匿名学术问卷。",
-        "privacy_btn": "📄 查看知情告知书全文",
-        "privacy_content": """
-            **1. 项目负责人**：Elisa Conticelli 教授（博洛尼亚大学）。
-
-            **2. 研究目标**：了解公众如何评价意大利历史中心街道的空间质量。
-
-            **3. 参与过程**：完成一份约 5 分钟的在线问卷，对比随机抽取的佛罗伦萨、拉文纳、博洛尼亚和费拉拉的街景照片。
-
-            **4. 利益与风险**：自愿且免费参加。不存在已知风险或不便。
-
-            **5. 退出权利**：您有权随时中断参与，无需说明理由。
-
-            **6. 结果获取**：您有权了解研究的最终学术成果。
-
-            **7. 匿名保护**：本研究为匿名问卷，仅收集性别、年龄组和参与者身份类型等基础人口统计信息。系统不记录 IP 地址或身份识别信息。
-
-            **8. 联系方式**：Elisa Conticelli 教授 (elisa.conticelli@unibo.it) 或 陈方宇 (fangyu.chen2@unibo.it)。
-        """,
-        "privacy_agree": "我确认已年满18周岁，已阅读知情告知书，并同意参与本问卷。",
-        "gender_title": "请选择您的性别：",
-        "gender_placeholder": "请选择",
-        "gender_options": {"Male": "男性", "Female": "女性", "Other": "其他"},
-        "age_title": "请选择您的年龄组：",
-        "age_placeholder": "请选择",
-        "age_options": {"18-29": "18–29岁", "30-44": "30–44岁", "45-59": "45–59岁", "60+": "60岁及以上"},
-        "role_title": "请选择您的角色：",
-        "role_options": {
-            "City resident": "城市居民",
-            "City user": "城市使用者",
-            "Current tourist": "游客",
-            "Previous tourist": "曾经到访游客",
-            "Other": "其他"
-        },
-        "role_descriptions": {
-            "City resident": "我居住在佛罗伦萨、拉文纳、博洛尼亚或费拉拉。",
-            "City user": "我经常因学习、工作或其他日常活动使用其中一个历史中心。",
-            "Current tourist": "我目前正作为游客访问其中一个历史中心。",
-            "Previous tourist": "我曾经访问过一个或多个这些历史中心。",
-            "Other": "以上选项均不符合我的情况。"
-        },
-        "start_btn": "开始问卷",
-        "btn_back": "⬅️ 返回",
-        "btn_skip_equal": "两张图片同样符合",
-        "btn_skip_neither": "两张图片都不符合",
-        "btn_select": "选择上方图片",
-        "success": "✅ 数据已同步！",
-        "end_title": "问卷已完成",
-        "thank_you": "感谢您的参与！",
-        "restart": "重新开始"
-    },
-
-    "Italiano": {
-        "title": "Percezione dell’ambiente urbano in aree storiche",
-        "intro": """Benvenuti! Questo questionario fa parte di una ricerca di dottorato in Architettura e Culture del Progetto dell’Università di Bologna sulla pedonalità e sulla percezione da parte dei pedoni delle aree percorribili a piedi nei centri storici italiani. Lo studio esplora come residenti e turisti percepiscono le strade nei centri storici, prendendo a riferimento in particolare quelli di Firenze, Ravenna, Bologna e Ferrara.
-
-Vi verranno mostrate 30 coppie di immagini stradali e un’affermazione, inerente a una sensazione che le immagini vi dovrebbero provocare (come ad esempio sicura, vivace, curata, bella, noiosa o deprimente). Per ogni coppia, scegliete l’immagine che corrisponde meglio all’affermazione proposta. Se entrambe le immagini corrispondono allo stesso modo alla descrizione, oppure se nessuna delle due corrisponde chiaramente, potete selezionare l’opzione corrispondente.
-
-Il questionario è anonimo e richiede circa 5 minuti per essere completato. Le vostre risposte ci aiuteranno a comprendere meglio le percezioni soggettive nei centri storici.""",
-        "consent_intro": "Prima di iniziare, ti invitiamo a leggere l’informativa e a confermare se acconsenti a partecipare a questo questionario accademico anonimo.",
-        "privacy_btn": "📄 Leggi l’informativa",
-        "privacy_content": """
-            **1. Responsabile progetto**: Prof.ssa Elisa Conticelli (Università di Bologna).
-
-            **2. Obiettivi**: Capire come le persone valutano la qualità delle strade nei centri storici italiani.
-
-            **3. Partecipazione**: Questionario online (circa 5 min). Confronto di immagini di Firenze, Ravenna, Bologna e Ferrara.
-
-            **4. Benefici e rischi**: La partecipazione è volontaria e gratuita. Non comporta rischi o disagi.
-
-            **5. Ritiro**: Diritto di ritirare il consenso in qualsiasi momento senza motivazione.
-
-            **6. Restituzione**: Diritto a richiedere informazioni sui risultati della ricerca.
-
-            **7. Anonimato**: Il questionario è anonimo. Vengono raccolte solo informazioni demografiche di base, tra cui genere, fascia d'età e ruolo del partecipante. Non vengono registrati indirizzi IP o dati identificativi.
-
-            **8. Contatti**: Prof.ssa Elisa Conticelli (elisa.conticelli@unibo.it) e Fangyu Chen (fangyu.chen2@unibo.it).
-        """,
-        "privacy_agree": "Dichiaro di avere almeno 18 anni, di aver letto l’informativa e di acconsentire a partecipare.",
-        "gender_title": "Seleziona il tuo genere:",
-        "gender_placeholder": "Seleziona",
-        "gender_options": {"Male": "Maschio", "Female": "Femmina", "Other": "Altro"},
-        "age_title": "Seleziona la tua fascia d'età:",
-        "age_placeholder": "Seleziona",
-        "age_options": {"18-29": "18–29", "30-44": "30–44", "45-59": "45–59", "60+": "60 o più"},
-        "role_title": "Seleziona il tuo ruolo:",
-        "role_options": {
-            "City resident": "Residente",
-            "City user": "Utente abituale",
-            "Current tourist": "Turista",
-            "Previous tourist": "Turista in passato",
-            "Other": "Altro"
-        },
-        "role_descriptions": {
-            "City resident": "Vivo a Firenze, Ravenna, Bologna o Ferrara.",
-            "City user": "Frequento uno di questi centri storici per studio, lavoro o altre attività.",
-            "Current tourist": "Sto visitando attualmente uno di questi centri storici come turista.",
-            "Previous tourist": "Ho visitato in passato uno o più di questi centri storici.",
-            "Other": "Non mi ritrovo in nessuna delle opzioni proposte."
-        },
-        "start_btn": "Inizia il questionario",
-        "btn_back": "⬅️ Indietro",
-        "btn_skip_equal": "Entrambe corrispondono allo stesso modo",
-        "btn_skip_neither": "Nessuna corrisponde alla descrizione",
-        "btn_select": "Seleziona sopra",
-        "success": "✅ Dati sincronizzati!",
-        "end_title": "Completato",
-        "thank_you": "Grazie per il tuo tempo!",
-        "restart": "Ricomincia"
-    }
-}
-
-QUESTIONS = {
-    "English": {
-        "Safe": "From a pedestrian’s perspective, which street would feel <span class='keyword'>safer</span> while walking?",
-        "Lively": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more lively</span> while walking?",
-        "Wealthy": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more wealthy</span> while walking?",
-        "Beautiful": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more beautiful</span> while walking?",
-        "Boring": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more boring</span> while walking?",
-        "Depressing": "From a pedestrian’s perspective, which street would feel <span class='keyword'>more depressing</span> while walking?"
-    },
-    "中文": {
-        "Safe": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更安全</span>？",
-        "Lively": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更活跃</span>？",
-        "Wealthy": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更高档</span>？",
-        "Beautiful": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更美丽</span>？",
-        "Boring": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更无聊</span>？",
-        "Depressing": "从行人的视角出发，在哪条街道行走时你会感觉<span class='keyword'>更压抑</span>？"
-    },
-    "Italiano": {
-        "Safe": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più sicura</span> da percorrere a piedi?",
-        "Lively": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più vivace (stimolante)</span> da percorrere a piedi?",
-        "Wealthy": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più curata</span> da percorrere a piedi?",
-        "Beautiful": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più bella</span> da percorrere a piedi?",
-        "Boring": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più noiosa</span> da percorrere a piedi?",
-        "Depressing": "Dal punto di vista di un pedone, quale strada sembra <span class='keyword'>più deprimente</span> da percorrere a piedi?"
-    }
-}
-
-CAT_TRANS = {
-    "English": {
-        "Safe": "safe",
-        "Lively": "lively",
-        "Wealthy": "wealthy",
-        "Beautiful": "beautiful",
-        "Boring": "boring",
-        "Depressing": "depressing"
-    },
-    "中文": {
-        "Safe": "安全",
-        "Lively": "活跃",
-        "Wealthy": "高档",
-        "Beautiful": "美丽",
-        "Boring": "无聊",
-        "Depressing": "压抑"
-    },
-    "Italiano": {
-        "Safe": "sicura",
-        "Lively": "vivace",
-        "Wealthy": "curata",
-        "Beautiful": "bella",
-        "Boring": "noiosa",
-        "Depressing": "deprimente"
-    }
-}
+# --- 2. 极致排版 CSS / 3. 翻译字典：见 survey_text.py，每个进程只加载一次 ---
+st.markdown(STYLE_HTML, unsafe_allow_html=True)
+METRICS.inc("reruns_total")
 
 # --- 4. Google Sheet event log columns ---
-EVENT_COLUMNS = [
-    "event_id",
-    "participant_id",
-    "event_seq",
-    "event_type",
-    "timestamp",
-    "lang",
-    "gender",
-    "age_group",
-    "user_type",
-    "question_number",
-    "response_index",
-    "vote_count",
-    "skip_count",
-    "completed",
-    "category",
-    "left_img",
-    "right_img",
-    "winner",
-    "case_l",
-    "case_r",
-    "removed_response_index",
-    "removed_category",
-    "removed_left_img",
-    "removed_right_img",
-    "removed_winner",
-    "removed_case_l",
-    "removed_case_r"
-]
+# 列定义见 event_sinks.EVENT_COLUMNS，导出和分析脚本共用
 
 # --- 5. 核心功能 ---
-@st.cache_data
-def load_all_image_data(img_dir, cases):
-    all_data = []
-    for c in cases:
-        path = os.path.join(img_dir, c)
-        if os.path.exists(path):
-            imgs = [
-                f for f in os.listdir(path)
-                if f.lower().endswith((".jpg", ".jpeg", ".png"))
-            ]
-            for img in imgs:
-                all_data.append((c, img))
-    return all_data
+@st.cache_resource
+def get_studies():
+    """
+    进程内只读取并校验一次研究定义，所有会话共享同一组只读对象。
+    """
+    return load_studies(STUDIES_DIR)
+
+
+def get_study(study_id=None):
+    """
+    当前会话的研究；缓存函数传入 study_id 作为缓存键。
+    """
+    return get_studies()[study_id or st.session_state.study_id]
+
+
+@st.cache_resource
+def load_all_image_data(img_dir, cases, version=None):
+    """
+    从 <img_dir>/manifest.jsonl 读取图片目录（整数 id、尺寸、内容哈希），没有 manifest 时扫描目录。
+    version 为 manifest 和 duplicates.json 的修改时间，任一文件重建后缓存自动失效。
+    EXCLUDE_DUPLICATES 开启时排除近似重复的图片。
+    """
+    exclude = read_excluded(img_dir) if EXCLUDE_DUPLICATES else ()
+    return load_catalogue(img_dir, cases, os.path.join(img_dir, "manifest.jsonl"), exclude=exclude)
+
+
+def catalogue_version(study):
+    """
+    manifest 和 duplicates.json 的修改时间；按图库位置保存状态的共享对象都用它作为缓存键。
+    """
+    return (
+        manifest_version(study.manifest_path),
+        manifest_version(os.path.join(study.img_dir, DUPLICATES_FILE))
+    )
+
+
+def get_catalogue(study):
+    return load_all_image_data(study.img_dir, study.cases, catalogue_version(study))
 
 
 def image_key(item):
     return f"{item[0]}/{item[1]}"
 
 
-def get_new_pair(all_img_data):
+@st.cache_resource
+def load_active_pair_index(study_id, version=None):
+    """
+    主动学习选对索引，同一研究的所有会话共享；有上一轮的评分结果时用它热启动。
+    索引按图库中的位置保存强度，version 与图库相同，图库重建后重新建立索引。
+    """
+    study = get_study(study_id)
+    index = ActivePairIndex(
+        [image_key(item) for item in get_catalogue(study)],
+        list(study.categories)
+    )
+
+    scores_path = study_path(PAIR_SCORES_PATH, study)
+    if os.path.exists(scores_path):
+        import pandas as pd
+        index.load_scores(pd.read_csv(scores_path))
+
+    return index
+
+
+def get_active_pair_index(study_id):
+    return load_active_pair_index(study_id, catalogue_version(get_study(study_id)))
+
+
+@st.cache_resource
+def load_exposure_balancer(study_id, version=None):
+    """
+    同一研究跨会话共享的曝光计数，定期写入本地文件。
+    抽样返回图库中的位置，version 与图库相同；图库重建后按图片 key 从文件重新载入计数。
+    """
+    study = get_study(study_id)
+    return ExposureBalancer(
+        get_catalogue(study),
+        list(study.categories),
+        path=study_path(EXPOSURE_COUNTS_PATH, study)
+    )
+
+
+def get_exposure_balancer(study_id):
+    return load_exposure_balancer(study_id, catalogue_version(get_study(study_id)))
+
+
+@st.cache_resource
+def load_feature_index(study_id, version=None):
+    """
+    研究图库的特征索引（内存映射）；还没有运行 image_features.py 时返回 None，回退到随机抽取。
+    version 为图库版本和特征索引文件的修改时间，运行 image_features.py 之后不用重启就会载入。
+    """
+    from image_features import FeatureIndex
+
+    study = get_study(study_id)
+
+    try:
+        return FeatureIndex(study.img_dir, keys=[image_key(item) for item in get_catalogue(study)])
+    except FileNotFoundError:
+        return None
+
+
+def get_feature_index(study_id):
+    from image_features import INDEX_FILE
+
+    study = get_study(study_id)
+    version = (catalogue_version(study), manifest_version(os.path.join(study.img_dir, INDEX_FILE)))
+    return load_feature_index(study_id, version)
+
+
+def check_feature_index(study_id):
+    """
+    预热步骤：载入特征索引。缺失时抛出异常，由冷启动日志和 warmup_errors_total 报告。
+    """
+    if get_feature_index(study_id) is None:
+        raise FileNotFoundError(
+            f"no image features for study {study_id}; run image_features.py (falling back to random pairs)"
+        )
+
+
+def get_image_sampler(all_img_data):
+    """
+    每个会话的未使用图片抽样器；图库大小变化时重建。
+    schedule 时计划中的图片先全部标记为已用（按计划顺序，与 session_replay 一致），
+    跳过后的随机回退不会抽到后面的题要用的图片。
+    """
+    sampler = st.session_state.get("image_sampler")
+
+    if sampler is None or sampler.n != len(all_img_data):
+        sampler = UnusedImageSampler(len(all_img_data))
+        for i in planned_positions(all_img_data, st.session_state.get("schedule")):
+            sampler.discard(i)
+        st.session_state.image_sampler = sampler
+
+    return sampler
+
+
+@METRICS.timed("get_new_pair")
+def get_new_pair(all_img_data, category=None, question_index=None):
     """
     尽量避免同一个受访者重复看到同一张图片。
     如果未使用图片不足 2 张，则自动回退到全图库随机抽取。
+    PAIR_SELECTION 为 active 时按当前类别选择信息量最大的一对，
+    为 balanced 时按跨会话曝光次数加权抽取跨 case 的一对，
+    为 schedule 时取计划中这道题的一对（跳过后改为随机抽取计划之外未使用的图片），
+    为 stratified 时从特征空间的两个不同分层各抽一张。
+    随机抽取都使用本会话的 st.session_state.rng，可以用 session_replay.py 离线重放。
     """
-    used = set(st.session_state.used_images)
+    used = st.session_state.used_images
+    sampler = get_image_sampler(all_img_data)
+    rng = st.session_state.rng
+    picked = None
+
+    if PAIR_SELECTION == "schedule":
+        picked = planned_pair(
+            all_img_data,
+            st.session_state.get("schedule"),
+            question_index,
+            st.session_state.skipped_questions
+        )
+    elif PAIR_SELECTION == "stratified":
+        picked = stratified_pair(get_feature_index(st.session_state.study_id), all_img_data, rng, used)
+    elif PAIR_SELECTION == "active" and category:
+        picked = get_active_pair_index(st.session_state.study_id).select(category, used)
+    elif PAIR_SELECTION == "balanced" and category:
+        picked = get_exposure_balancer(st.session_state.study_id).sample(category, used)
 
-    candidates = [
-        item for item in all_img_data
-        if image_key(item) not in used
-    ]
+    if picked is None:
+        picked = sampler.draw_pair(rng)
 
-    if len(candidates) >= 2:
-        pair = random.sample(candidates, 2)
-    else:
-        pair = random.sample(all_img_data, 2)
+    if picked is None:
+        picked = rng.sample(range(len(all_img_data)), 2)
 
-    st.session_state.used_images.extend([
-        image_key(pair[0]),
-        image_key(pair[1])
-    ])
+    for i in picked:
+        sampler.discard(i)
+
+    pair = [all_img_data[picked[0]], all_img_data[picked[1]]]
+    used.update(image_key(item) for item in pair)
 
     return pair
 
 
+def record_exposure(category, pair):
+    """
+    把实际显示的一对计入跨会话曝光次数。预取的一对在显示时才计入，
+    跳过或返回后作废的预取不会多算曝光。
+    """
+    if PAIR_SELECTION != "balanced":
+        return
+
+    balancer = get_exposure_balancer(st.session_state.study_id)
+    cl, il, cr, ir = pair
+    indices = [balancer.key_index.get(f"{cl}/{il}"), balancer.key_index.get(f"{cr}/{ir}")]
+
+    if None not in indices:
+        balancer.record(category, indices)
+
+
+def record_pair_outcome(category, left_img, right_img, winner):
+    """
+    把投票结果同步到共享的主动学习索引；winner 为空表示平局（两张同样符合）。
+    返回 (索引, 更新)，供返回上一题时撤销；没有更新时返回 None。
+    """
+    if PAIR_SELECTION != "active":
+        return None
+
+    index = get_active_pair_index(st.session_state.study_id)
+
+    if winner == "left":
+        update = index.record(category, left_img, right_img)
+    elif winner == "right":
+        update = index.record(category, right_img, left_img)
+    else:
+        update = index.record(category, left_img, right_img, tie=True)
+
+    return (index, update) if update is not None else None
+
+
+def retract_pair_outcome(outcome):
+    """
+    返回上一题时撤销那次投票对主动学习索引的更新。
+    """
+    if outcome is not None:
+        index, update = outcome
+        index.retract(update)
+
+
+@st.cache_data(show_spinner=False)
+def get_pair_image_html(img_dir, case, filename, version=""):
+    """
+    返回按视口选择尺寸的 <picture> HTML，派生图缺失时即时生成一次。
+    生成失败时返回 None，由调用方回退到原图。
+    """
+    try:
+        ensure_derivatives(img_dir, case, filename)
+    except Exception:
+        return None
+
+    return picture_html(case, filename, version=version)
+
+
+def pair_image_html(case, filename):
+    study = get_study()
+    version = get_catalogue(study).content_hash(f"{case}/{filename}")[:8]
+    return get_pair_image_html(study.img_dir, case, filename, version)
+
+
+@st.cache_data(show_spinner=False)
+def get_served_image_bytes(img_dir, case, filename):
+    """
+    估算一张图实际传输的字节数：浏览器通常选用 768 px 的 WebP 派生图。
+    """
+    for path in (
+        derivative_path(case, filename, DERIVATIVE_WIDTHS[1], "webp"),
+        os.path.join(img_dir, case, filename)
+    ):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            continue
+    return 0
+
+
+def show_pair_image(case, filename):
+    img_dir = get_study().img_dir
+    html = pair_image_html(case, filename)
+    METRICS.inc("images_shown_total")
+    METRICS.inc("image_bytes_served_total", get_served_image_bytes(img_dir, case, filename))
+
+    if html is None:
+        st.image(os.path.join(img_dir, case, filename), use_container_width=True)
+    else:
+        st.markdown(html, unsafe_allow_html=True)
+
+
+def prefetch_pair_images(pair):
+    """
+    把下一组图片以不可见的 <picture> 提前放进页面，浏览器按同样的 srcset 规则预先下载，
+    下一题渲染时直接命中浏览器缓存。
+    """
+    cl, il, cr, ir = pair
+    parts = [pair_image_html(cl, il), pair_image_html(cr, ir)]
+
+    if None in parts:
+        return
+
+    st.markdown(
+        f'<div class="prefetch-pair" aria-hidden="true">{"".join(parts)}</div>',
+        unsafe_allow_html=True
+    )
+
+
+def pair_tuple(pair):
+    return (pair[0][0], pair[0][1], pair[1][0], pair[1][1])
+
+
 # --- 6. 弹窗对话框函数 ---
 @st.dialog("Information Sheet / Informativa / 知情告知书")
 def show_privacy_modal(content):
@@ -361,80 +374,55 @@ def show_privacy_modal(content):
 
 
 # --- 7. Google Sheets append-only event log ---
+def collector_name(prefix, study_id):
+    """
+    默认研究沿用原来的指标名，其他研究加上 _<id> 后缀。
+    """
+    return prefix if study_id == DEFAULT_STUDY_ID else f"{prefix}_{study_id}"
+
+
 @st.cache_resource
-def get_events_worksheet():
+def get_events_worksheet(worksheet_name):
     """
     使用 Google Sheets API 的 append_rows。
     这比每次读取整个 Sheet 再 update 更适合多人同时填写。
+    每个研究写入自己的工作表。
     """
-    config = dict(st.secrets["connections"]["gsheets"])
+    from sheets_client import open_events_worksheet
 
-    spreadsheet_value = (
-        config.get("spreadsheet")
-        or config.get("spreadsheet_url")
-        or config.get("url")
+    return open_events_worksheet(
+        dict(st.secrets["connections"]["gsheets"]),
+        worksheet_name,
+        EVENT_COLUMNS
     )
 
-    credential_keys = [
-        "type",
-        "project_id",
-        "private_key_id",
-        "private_key",
-        "client_email",
-        "client_id",
-        "auth_uri",
-        "token_uri",
-        "auth_provider_x509_cert_url",
-        "client_x509_cert_url",
-        "universe_domain"
-    ]
-
-    creds_info = {
-        k: config[k]
-        for k in credential_keys
-        if k in config
-    }
-
-    if "private_key" in creds_info:
-        creds_info["private_key"] = creds_info["private_key"].replace("\\n", "\n")
-
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
 
-    credentials = Credentials.from_service_account_info(
-        creds_info,
-        scopes=scopes
-    )
+@st.cache_resource
+def get_sheets_bucket():
+    """
+    写入配额按服务账号计算，所有研究的工作表共用一个令牌桶。
+    """
+    from sheets_client import TokenBucket
 
-    client = gspread.authorize(credentials)
+    return TokenBucket(SHEETS_REQUESTS_PER_MINUTE / 60, SHEETS_BURST)
 
-    if spreadsheet_value.startswith("http"):
-        spreadsheet = client.open_by_url(spreadsheet_value)
-    else:
-        try:
-            spreadsheet = client.open_by_key(spreadsheet_value)
-        except Exception:
-            spreadsheet = client.open(spreadsheet_value)
 
-    try:
-        worksheet = spreadsheet.worksheet(EVENT_WORKSHEET_NAME)
-    except gspread.WorksheetNotFound:
-        worksheet = spreadsheet.add_worksheet(
-            title=EVENT_WORKSHEET_NAME,
-            rows=1000,
-            cols=len(EVENT_COLUMNS)
-        )
-        worksheet.append_row(EVENT_COLUMNS)
-
-    header = worksheet.row_values(1)
-    if not header:
-        worksheet.append_row(EVENT_COLUMNS)
+@st.cache_resource
+def get_sheets_client(study_id):
+    """
+    所有会话共享的限流 Sheets 客户端，配额耗尽时排队等待而不是触发 429。
+    """
+    from sheets_client import RateLimitedWorksheet
 
-    return worksheet
+    client = RateLimitedWorksheet(
+        get_events_worksheet(get_study(study_id).worksheet),
+        get_sheets_bucket()
+    )
+    METRICS.add_collector(collector_name("sheets", study_id), client.metrics)
+    return client
 
 
+@METRICS.timed("make_event")
 def make_event(
     event_type,
     category="",
@@ -446,12 +434,14 @@ def make_event(
     response_index="",
     question_number="",
     completed=False,
-    removed_vote=None
+    removed_vote=None,
+    rng_seed=""
 ):
     """
     生成一条事件记录。
     event_type 可以是：
     start / vote / skip_equal / skip_neither / back
+    start 事件记录本会话随机数生成器的种子（rng_seed）。
     """
     st.session_state.event_seq += 1
 
@@ -482,7 +472,8 @@ def make_event(
         "removed_right_img": "",
         "removed_winner": "",
         "removed_case_l": "",
-        "removed_case_r": ""
+        "removed_case_r": "",
+        "rng_seed": rng_seed
     }
 
     if removed_vote is not None:
@@ -497,42 +488,262 @@ def make_event(
     return event
 
 
-def append_events(events):
+def get_sink_config():
+    """
+    事件后端配置：st.secrets 的 [event_sink] 段，环境变量 EVENT_SINK / EVENT_SINK_PATH /
+    EVENT_SINK_LATENCY 优先。
+    没有任何配置时沿用 Google Sheets。
+    """
+    config = {}
+
+    try:
+        config.update(st.secrets.get("event_sink", {}))
+    except Exception:
+        pass
+
+    if os.environ.get("EVENT_SINK"):
+        config["backend"] = os.environ["EVENT_SINK"]
+    if os.environ.get("EVENT_SINK_PATH"):
+        config["path"] = os.environ["EVENT_SINK_PATH"]
+    if os.environ.get("EVENT_SINK_LATENCY"):
+        config["latency"] = os.environ["EVENT_SINK_LATENCY"]
+
+    return config
+
+
+@st.cache_resource
+def get_event_sink(study_id):
     """
-    append-only 写入 Google Sheet。
-    使用 RAW，避免 Google Sheet 自动转换时间或数字格式。
+    每个研究一个事件后端：Google Sheets 写入研究自己的工作表，
+    本地后端（sqlite / csv / parquet）的路径加上研究 id。
+    """
+    study = get_study(study_id)
+    config = get_sink_config()
+
+    if "path" in config:
+        config["path"] = study_path(config["path"], study)
+    elif config.get("backend") == "sqlite":
+        config["path"] = study_path("events.sqlite3", study)
+    elif config.get("backend") in ("csv", "parquet"):
+        config["path"] = study_path("event_log", study)
+
+    return make_sink(config, EVENT_COLUMNS, lambda: get_sheets_client(study_id))
+
+
+@METRICS.timed("append_events")
+def append_events(study_id, events):
+    """
+    append-only 写入研究配置的事件后端（默认 Google Sheet）。
     """
     if not events:
         return
 
-    worksheet = get_events_worksheet()
-    rows = [
-        [event.get(col, "") for col in EVENT_COLUMNS]
-        for event in events
+    get_event_sink(study_id).append(events)
+    METRICS.inc("events_appended_total", len(events))
+
+
+def get_logged_event_ids(study_id):
+    """
+    读取后端已有的 event_id，用于重放本地日志时去重。
+    """
+    return get_event_sink(study_id).logged_event_ids()
+
+
+@st.cache_resource
+def get_event_writer(study_id):
+    """
+    每个研究一个进程级后台写入线程，该研究的所有会话共享。
+    事件先写入本地 WAL 日志，启动时补写上一个进程未送达的事件。
+    """
+    study = get_study(study_id)
+    writer = BackgroundEventWriter(
+        lambda events: append_events(study_id, events),
+        max_batch_size=EVENT_BATCH_MAX_ROWS,
+        max_wait=EVENT_BATCH_MAX_WAIT,
+        journal=EventJournal(study_path(EVENT_JOURNAL_PATH, study)),
+        logged_event_ids=lambda: get_logged_event_ids(study_id)
+    )
+    METRICS.add_collector(
+        collector_name("event_writer", study_id),
+        writer.metrics,
+        gauges=("backlog", "queue_size")
+    )
+    return writer
+
+
+@st.cache_resource
+def start_warm_up():
+    """
+    启动后立即在后台读取图片目录、完成 Sheets 授权并启动事件写入线程（含日志重放），
+    不阻塞第一页的渲染。每个研究都要预热，各自日志里未送达的事件也在启动时补写。
+    """
+    use_sheets = get_sink_config().get("backend", "gsheets") == "gsheets"
+    steps = []
+
+    for study_id, study in get_studies().items():
+        steps.append((
+            collector_name("image_catalogue", study_id),
+            lambda study=study: get_catalogue(study)
+        ))
+
+        if use_sheets:
+            steps.append((
+                collector_name("sheets_auth", study_id),
+                lambda study_id=study_id: get_sheets_client(study_id)
+            ))
+
+        if PAIR_SELECTION == "stratified":
+            steps.append((
+                collector_name("image_features", study_id),
+                lambda study_id=study_id: check_feature_index(study_id)
+            ))
+
+        steps.append((
+            collector_name("event_writer", study_id),
+            lambda study_id=study_id: get_event_writer(study_id)
+        ))
+
+    COLD_START.warm_up(steps)
+    return COLD_START
+
+
+@st.cache_resource
+def start_metrics_export():
+    """
+    进程内只启动一次指标导出：定期写文件和 / 或单独端口上的 /metrics。
+    """
+    flusher = None
+    server = None
+
+    if METRICS_PATH:
+        flusher = MetricsFileFlusher(METRICS, METRICS_PATH, METRICS_FLUSH_INTERVAL)
+
+    if METRICS_PORT:
+        try:
+            server = start_http_server(METRICS, METRICS_PORT)
+        except OSError:
+            # 端口已被占用（例如缓存被清空后重新启动），不影响问卷本身
+            server = None
+
+    return flusher, server
+
+
+def sync_pending_events(timeout=0):
+    """
+    根据后台写入线程的送达状态更新 session_state.pending_events。
+    写入线程和本地日志都不认识的事件（例如进程内缓存和日志都已清空）会重新提交。
+    被隔离（目标表始终拒收）的事件不再提交，但仍算未送达，结束页提示下载备份。
+    """
+    pending = st.session_state.pending_events
+    if not pending:
+        st.session_state.sync_error = ""
+        return
+
+    writer = get_event_writer(st.session_state.study_id)
+    event_ids = [event["event_id"] for event in pending]
+
+    if timeout:
+        writer.wait(event_ids, timeout)
+
+    status = writer.status(event_ids)
+
+    lost = [event for event in pending if status[event["event_id"]] is None]
+    if lost:
+        writer.submit(lost)
+
+    st.session_state.pending_events = [
+        event for event in pending
+        if status[event["event_id"]] != DELIVERED
     ]
 
-    worksheet.append_rows(rows, value_input_option="RAW")
+    if st.session_state.pending_events:
+        failed = any(status[event["event_id"]] == FAILED for event in pending)
+        st.session_state.sync_error = writer.last_error or ("rejected by the event log" if failed else "")
+        if st.session_state.sync_error:
+            METRICS.inc("sync_errors_total")
+    else:
+        st.session_state.sync_error = ""
+
+
+def submit_events(events):
+    st.session_state.pending_events.extend(events)
+    get_event_writer(st.session_state.study_id).submit(events)
+    for event in events:
+        METRICS.inc("events_queued_total", event_type=event["event_type"])
+
+
+def commit_held_events():
+    """
+    把本会话缓冲的事件交给后台写入线程，合并成一次批量写入。
+    """
+    held = st.session_state.held_events
+    if not held:
+        return
+
+    st.session_state.held_events = []
+    submit_events(held)
+    METRICS.inc("session_commits_total")
+
+
+def compact_back_event(event):
+    """
+    撤回的投票还在缓冲里时直接删掉这条投票；back 事件照常记录，它带有被撤回投票的全部字段，
+    session_replay 据此补上这次投票。投票占用的序号还回去：之后缓冲的事件和这条 back 依次前移一位，
+    event_seq 保持连续，日志里的缺号只说明真的丢了事件。
+    返回是否已压缩。
+    """
+    held = st.session_state.held_events
+    removed_index = event["removed_response_index"]
+    writer = get_event_writer(st.session_state.study_id)
+
+    for i in range(len(held) - 1, -1, -1):
+        if held[i]["event_type"] == "vote" and held[i]["response_index"] == removed_index:
+            writer.discard([held[i]["event_id"]])
+            del held[i]
+
+            # 投票之后的事件都还在缓冲里，没有提交过
+            for later in held[i:] + [event]:
+                later["event_seq"] -= 1
+            writer.update_held(held[i:])
+            st.session_state.event_seq -= 1
+
+            METRICS.inc("events_compacted_total")
+            return True
+
+    return False
 
 
 def safe_log_event(event):
     """
-    如果网络或 Google Sheet 临时失败，先把事件留在 session_state.pending_events。
-    下一次操作时会再次尝试同步。
+    事件交给后台写入线程批量写入 Google Sheet，点击不再等待网络往返。
+    送达前事件保留在 session_state.pending_events，每次记录事件时更新送达状态。
+    checkpoint / session 策略下事件先缓冲在 held_events（同时写入本地日志），
+    到检查点或结束页再提交。
     """
-    st.session_state.pending_events.append(event)
+    if COMMIT_POLICY == "stream":
+        submit_events([event])
+    else:
+        if COMPACT_BACK_EVENTS and event["event_type"] == "back":
+            compact_back_event(event)
 
-    try:
-        append_events(st.session_state.pending_events)
-        st.session_state.pending_events = []
-        st.session_state.sync_error = ""
-    except Exception as e:
-        st.session_state.sync_error = str(e)
+        st.session_state.held_events.append(event)
+        get_event_writer(st.session_state.study_id).hold([event])
+
+        if (
+            COMMIT_POLICY == "checkpoint"
+            and len(st.session_state.held_events) >= COMMIT_CHECKPOINT_EVERY
+        ):
+            commit_held_events()
+
+    sync_pending_events()
 
 
 def build_backup_votes_df():
     """
     用于同步失败时让受访者下载当前答案备份。
     """
+    import pandas as pd
+
     df = pd.DataFrame(st.session_state.temp_votes)
 
     if df.empty:
@@ -566,7 +777,7 @@ def record_vote(winner, cl, il, cr, ir, cat_eng):
     st.session_state.temp_votes.append(vote)
     st.session_state.vote_count += 1
 
-    completed_now = st.session_state.vote_count >= TARGET_VOTES
+    completed_now = st.session_state.vote_count >= get_study().target_votes
 
     event = make_event(
         event_type="vote",
@@ -582,17 +793,188 @@ def record_vote(winner, cl, il, cr, ir, cat_eng):
     )
 
     safe_log_event(event)
+    outcome = record_pair_outcome(cat_eng, f"{cl}/{il}", f"{cr}/{ir}", winner)
+    if outcome is not None:
+        st.session_state.pair_outcomes[response_index] = outcome
 
     if "pair" in st.session_state:
         del st.session_state.pair
 
     if completed_now:
         st.session_state.step = "end"
+        METRICS.inc("sessions_completed_total")
+
+
+def go_back():
+    removed_vote = st.session_state.temp_votes.pop()
+    retract_pair_outcome(st.session_state.pair_outcomes.pop(removed_vote["response_index"], None))
+
+    st.session_state.pair = (
+        removed_vote["case_l"],
+        removed_vote["left_img"].split("/")[-1],
+        removed_vote["case_r"],
+        removed_vote["right_img"].split("/")[-1]
+    )
+
+    st.session_state.vote_count -= 1
+
+    back_event = make_event(
+        event_type="back",
+        question_number=st.session_state.vote_count + 1,
+        completed=False,
+        removed_vote=removed_vote
+    )
+    safe_log_event(back_event)
+
+
+def skip_pair(event_type, cl, il, cr, ir, cat_eng):
+    st.session_state.skip_count += 1
+    st.session_state.skipped_questions.add(st.session_state.vote_count)
+
+    skip_event = make_event(
+        event_type=event_type,
+        category=cat_eng,
+        left_img=f"{cl}/{il}",
+        right_img=f"{cr}/{ir}",
+        winner="",
+        case_l=cl,
+        case_r=cr,
+        question_number=st.session_state.vote_count + 1,
+        completed=False
+    )
+    safe_log_event(skip_event)
+
+    if event_type == "skip_equal":
+        record_pair_outcome(cat_eng, f"{cl}/{il}", f"{cr}/{ir}", "")
+
+    if "pair" in st.session_state:
+        del st.session_state.pair
+
+
+@st.fragment
+@METRICS.timed("voting_screen")
+def voting_screen():
+    """
+    投票页作为片段运行：按钮回调先更新状态，点击后只重跑这一段，
+    不再重新执行整页脚本（样式、引导页等）。答完最后一题时整页重跑进入结束页。
+    """
+    if st.session_state.step != "voting":
+        st.rerun()
+
+    study = get_study()
+    T = study.text[st.session_state.lang]
+
+    with METRICS.timer("load_images"):
+        all_img_data = get_catalogue(study)
+
+    if len(all_img_data) < 2:
+        st.error("Not enough images found. Please check the images folder.")
+        st.stop()
+
+    st.markdown(
+        progress_html(st.session_state.vote_count, study.target_votes),
+        unsafe_allow_html=True
+    )
+
+    question_index = st.session_state.vote_count
+    cat_eng = st.session_state.question_pool[question_index]
+
+    # next_pair 为 (题号, 一对图片)，只用于它预取时对应的那道题（跳过或返回后不会错位）
+    if "pair" not in st.session_state:
+        if st.session_state.get("next_pair", (None,))[0] == question_index:
+            st.session_state.pair = st.session_state.pop("next_pair")[1]
+        else:
+            st.session_state.pair = pair_tuple(get_new_pair(all_img_data, cat_eng, question_index))
+        record_exposure(cat_eng, st.session_state.pair)
+
+    # 提前一步选好下一组（按下一题的类别），最后一题之后不再预取
+    next_index = question_index + 1
+    if (
+        st.session_state.get("next_pair", (None,))[0] != next_index
+        and next_index < study.target_votes
+    ):
+        st.session_state.next_pair = (next_index, pair_tuple(get_new_pair(
+            all_img_data,
+            st.session_state.question_pool[next_index],
+            next_index
+        )))
+
+    cl, il, cr, ir = st.session_state.pair
+    pair_args = dict(cl=cl, il=il, cr=cr, ir=ir, cat_eng=cat_eng)
+
+    st.markdown(
+        study.question_html[st.session_state.lang][cat_eng],
+        unsafe_allow_html=True
+    )
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        show_pair_image(cl, il)
+        st.button(
+            T["btn_select"],
+            key="L",
+            on_click=record_vote,
+            kwargs=dict(winner="left", **pair_args)
+        )
+
+    with col2:
+        show_pair_image(cr, ir)
+        st.button(
+            T["btn_select"],
+            key="R",
+            on_click=record_vote,
+            kwargs=dict(winner="right", **pair_args)
+        )
+
+    st.write("")
+
+    b1, b2, b3 = st.columns(3)
+
+    with b1:
+        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
+        st.button(
+            T["btn_back"],
+            disabled=(st.session_state.vote_count == 0),
+            on_click=go_back
+        )
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with b2:
+        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
+        st.button(
+            T["btn_skip_equal"],
+            on_click=skip_pair,
+            kwargs=dict(event_type="skip_equal", **pair_args)
+        )
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with b3:
+        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
+        st.button(
+            T["btn_skip_neither"],
+            on_click=skip_pair,
+            kwargs=dict(event_type="skip_neither", **pair_args)
+        )
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    if "next_pair" in st.session_state:
+        prefetch_pair_images(st.session_state.next_pair[1])
 
 
 # --- 8. 状态管理 ---
+if "study_id" not in st.session_state:
+    # 研究在会话开始时确定，之后即使 URL 参数变化也不切换
+    study_id = st.query_params.get("study", DEFAULT_STUDY_ID)
+
+    if study_id not in get_studies():
+        st.error(f"Unknown study: {study_id}")
+        st.stop()
+
+    st.session_state.study_id = study_id
+
 if "lang" not in st.session_state:
-    st.session_state.lang = "English"
+    st.session_state.lang = get_study().languages[0]
 
 if "step" not in st.session_state:
     st.session_state.step = "onboarding"
@@ -606,9 +988,16 @@ if "skip_count" not in st.session_state:
 if "temp_votes" not in st.session_state:
     st.session_state.temp_votes = []
 
+# 每个回答序号对主动学习索引的更新，返回上一题时撤销
+if "pair_outcomes" not in st.session_state:
+    st.session_state.pair_outcomes = {}
+
 if "pending_events" not in st.session_state:
     st.session_state.pending_events = []
 
+if "held_events" not in st.session_state:
+    st.session_state.held_events = []
+
 if "sync_error" not in st.session_state:
     st.session_state.sync_error = ""
 
@@ -618,25 +1007,40 @@ if "participant_id" not in st.session_state:
 if "event_seq" not in st.session_state:
     st.session_state.event_seq = 0
 
+if "rng" not in st.session_state:
+    # 本会话的所有随机选择（题目顺序、抽图）都来自这个生成器；
+    # 种子由 participant_id 决定并写入 start 事件，可以离线重放
+    st.session_state.rng_seed = session_seed(st.session_state.participant_id)
+    st.session_state.rng = random.Random(st.session_state.rng_seed)
+
 if "used_images" not in st.session_state:
-    st.session_state.used_images = []
+    st.session_state.used_images = set()
+
+if "skipped_questions" not in st.session_state:
+    st.session_state.skipped_questions = set()
 
 if "question_pool" not in st.session_state:
-    cats = list(CAT_TRANS["English"].keys())
-    pool = cats * 5
-    random.shuffle(pool)
-    st.session_state.question_pool = pool
+    if PAIR_SELECTION == "schedule":
+        # 整份计划（题目类别和每题的一对图片）由 participant_id 决定，可以离线重新生成
+        plan = study_schedule(get_study(), get_catalogue(get_study()), st.session_state.participant_id)
+        st.session_state.question_pool = [item[0] for item in plan]
+        st.session_state.schedule = [item[1:] for item in plan]
+    else:
+        st.session_state.question_pool = get_study().new_question_pool(st.session_state.rng)
+
 
+start_metrics_export()
+start_warm_up()
 
 # --- 9. 逻辑流 ---
 if st.session_state.step == "onboarding":
     st.session_state.lang = st.radio(
         "Language",
-        ["English", "中文", "Italiano"],
+        get_study().languages,
         horizontal=True
     )
 
-    T = LANG_DICT[st.session_state.lang]
+    T = get_study().text[st.session_state.lang]
 
     st.title(f"🏙️ {T['title']}")
 
@@ -699,181 +1103,30 @@ if st.session_state.step == "onboarding":
         st.session_state.user_type = role
         st.session_state.step = "voting"
 
-        start_event = make_event(event_type="start")
+        # 种子是 64 位无符号整数：按字符串记录，Google Sheets 存成双精度、SQLite 超出 INTEGER 范围都会丢失或报错
+        start_event = make_event(event_type="start", rng_seed=str(st.session_state.rng_seed))
         safe_log_event(start_event)
 
         st.rerun()
 
 
 elif st.session_state.step == "voting":
-    T = LANG_DICT[st.session_state.lang]
-
-    all_img_data = load_all_image_data(IMG_DIR, CASES)
-
-    if len(all_img_data) < 2:
-        st.error("Not enough images found. Please check the images folder.")
-        st.stop()
-
-    percent = int((st.session_state.vote_count / TARGET_VOTES) * 100)
-    st.markdown(
-        f'''
-        <div class="progress-container">
-            <div class="progress-bar" style="width: {percent}%;"></div>
-            <div class="progress-text">{st.session_state.vote_count} / {TARGET_VOTES}</div>
-        </div>
-        ''',
-        unsafe_allow_html=True
-    )
-
-    if "pair" not in st.session_state:
-        pair = get_new_pair(all_img_data)
-        st.session_state.pair = (
-            pair[0][0],
-            pair[0][1],
-            pair[1][0],
-            pair[1][1]
-        )
-
-    cl, il, cr, ir = st.session_state.pair
-
-    cat_eng = st.session_state.question_pool[st.session_state.vote_count]
-    question_text = QUESTIONS[st.session_state.lang][cat_eng]
-
-    st.markdown(
-        f'<p class="question-text">{question_text}</p>',
-        unsafe_allow_html=True
-    )
-
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.image(os.path.join(IMG_DIR, cl, il), use_container_width=True)
-
-        if st.button(T["btn_select"], key="L"):
-            record_vote(
-                winner="left",
-                cl=cl,
-                il=il,
-                cr=cr,
-                ir=ir,
-                cat_eng=cat_eng
-            )
-            st.rerun()
-
-    with col2:
-        st.image(os.path.join(IMG_DIR, cr, ir), use_container_width=True)
-
-        if st.button(T["btn_select"], key="R"):
-            record_vote(
-                winner="right",
-                cl=cl,
-                il=il,
-                cr=cr,
-                ir=ir,
-                cat_eng=cat_eng
-            )
-            st.rerun()
-
-    st.write("")
-
-    b1, b2, b3 = st.columns(3)
-
-    with b1:
-        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
-
-        if st.button(T["btn_back"], disabled=(st.session_state.vote_count == 0)):
-            removed_vote = st.session_state.temp_votes.pop()
-
-            st.session_state.pair = (
-                removed_vote["case_l"],
-                removed_vote["left_img"].split("/")[-1],
-                removed_vote["case_r"],
-                removed_vote["right_img"].split("/")[-1]
-            )
-
-            st.session_state.vote_count -= 1
-
-            back_event = make_event(
-                event_type="back",
-                question_number=st.session_state.vote_count + 1,
-                completed=False,
-                removed_vote=removed_vote
-            )
-            safe_log_event(back_event)
-
-            st.rerun()
-
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with b2:
-        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
-
-        if st.button(T["btn_skip_equal"]):
-            st.session_state.skip_count += 1
-
-            skip_event = make_event(
-                event_type="skip_equal",
-                category=cat_eng,
-                left_img=f"{cl}/{il}",
-                right_img=f"{cr}/{ir}",
-                winner="",
-                case_l=cl,
-                case_r=cr,
-                question_number=st.session_state.vote_count + 1,
-                completed=False
-            )
-            safe_log_event(skip_event)
-
-            if "pair" in st.session_state:
-                del st.session_state.pair
-
-            st.rerun()
-
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with b3:
-        st.markdown('<div class="bottom-btns">', unsafe_allow_html=True)
-
-        if st.button(T["btn_skip_neither"]):
-            st.session_state.skip_count += 1
-
-            skip_event = make_event(
-                event_type="skip_neither",
-                category=cat_eng,
-                left_img=f"{cl}/{il}",
-                right_img=f"{cr}/{ir}",
-                winner="",
-                case_l=cl,
-                case_r=cr,
-                question_number=st.session_state.vote_count + 1,
-                completed=False
-            )
-            safe_log_event(skip_event)
-
-            if "pair" in st.session_state:
-                del st.session_state.pair
-
-            st.rerun()
-
-        st.markdown("</div>", unsafe_allow_html=True)
+    voting_screen()
 
 
 elif st.session_state.step == "end":
-    T = LANG_DICT[st.session_state.lang]
+    T = get_study().text[st.session_state.lang]
 
     st.balloons()
     st.title(f"🎉 {T['end_title']}")
     st.subheader(T["thank_you"])
     st.divider()
 
-    # 尝试把之前未同步的 pending events 再同步一次
-    if st.session_state.pending_events:
-        try:
-            append_events(st.session_state.pending_events)
-            st.session_state.pending_events = []
-            st.session_state.sync_error = ""
-        except Exception as e:
-            st.session_state.sync_error = str(e)
+    # 等待后台写入线程把本会话剩余的事件写完
+    commit_held_events()
+
+    with METRICS.timer("end_sync"):
+        sync_pending_events(timeout=END_SYNC_TIMEOUT)
 
     if not st.session_state.pending_events:
         st.success(T["success"])
@@ -906,4 +1159,4 @@ elif st.session_state.step == "end":
         st.session_state.clear()
         st.rerun()
 
-
+COLD_START.mark("first_page")
@@ -0,0 +1,277 @@
+import os
+import csv
+import math
+import argparse
+from collections import OrderedDict
+
+VOTE_COLUMNS = [
+    "participant_id",
+    "response_index",
+    "event_id",
+    "event_seq",
+    "timestamp",
+    "category",
+    "left_img",
+    "right_img",
+    "winner",
+    "case_l",
+    "case_r",
+    "lang",
+    "gender",
+    "age_group",
+    "user_type"
+]
+
+PARTICIPANT_COLUMNS = [
+    "participant_id",
+    "first_timestamp",
+    "last_timestamp",
+    "events",
+    "final_votes",
+    "votes_cast",
+    "backs",
+    "skips_equal",
+    "skips_neither",
+    "duplicate_events",
+    "missing_seq",
+    "completed",
+    "lang",
+    "gender",
+    "age_group",
+    "user_type"
+]
+
+
+def _int(value):
+    """
+    CSV 里是字符串，Parquet 里可能是整数、浮点数或空值；空值返回 None。
+    """
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(number):
+        return None
+    return int(number)
+
+
+def _flag(value):
+    # Google Sheets 读回 TRUE，CSV 为 True，SQLite 存为 1
+    return str(value).strip().lower() in ("true", "1")
+
+
+def reduce_participant(participant_id, events, duplicates=0):
+    """
+    按 event_seq 重放一个参与者的事件：vote 写入对应 response_index，
+    back 撤回 removed_response_index，得到最终投票和这位参与者的汇总。
+    """
+    events.sort(key=lambda e: (_int(e.get("event_seq")) is None, _int(e.get("event_seq")) or 0))
+
+    final = {}
+    counts = {"vote": 0, "back": 0, "skip_equal": 0, "skip_neither": 0}
+    completed = False
+    seqs = set()
+
+    for event in events:
+        event_type = event.get("event_type")
+        counts[event_type] = counts.get(event_type, 0) + 1
+
+        seq = _int(event.get("event_seq"))
+        if seq is not None:
+            seqs.add(seq)
+
+        if event_type == "vote":
+            response_index = _int(event.get("response_index"))
+            if response_index is not None:
+                final[response_index] = event
+            completed = completed or _flag(event.get("completed"))
+        elif event_type == "back":
+            final.pop(_int(event.get("removed_response_index")), None)
+
+    # event_seq 从 1 开始连续递增，缺号说明有事件没有写进日志
+    missing_seq = (max(seqs) - len(seqs)) if seqs else 0
+    last = events[-1] if events else {}
+
+    votes = [
+        {
+            "participant_id": participant_id,
+            "response_index": response_index,
+            **{col: event.get(col, "") for col in VOTE_COLUMNS[2:]}
+        }
+        for response_index, event in sorted(final.items())
+    ]
+
+    summary = {
+        "participant_id": participant_id,
+        "first_timestamp": events[0].get("timestamp", "") if events else "",
+        "last_timestamp": last.get("timestamp", ""),
+        "events": len(events),
+        "final_votes": len(votes),
+        "votes_cast": counts["vote"],
+        "backs": counts["back"],
+        "skips_equal": counts["skip_equal"],
+        "skips_neither": counts["skip_neither"],
+        "duplicate_events": duplicates,
+        "missing_seq": missing_seq,
+        "completed": completed,
+        "lang": last.get("lang", ""),
+        "gender": last.get("gender", ""),
+        "age_group": last.get("age_group", ""),
+        "user_type": last.get("user_type", "")
+    }
+
+    return votes, summary
+
+
+class VoteReducer:
+    """
+    单遍流式归约：事件按写入顺序输入，按 participant_id 分组缓存，
+    一位参与者超过 idle_rows 行没有新事件时视为会话结束，归约后立即输出并释放内存。
+    内存只和“同时进行中的会话”有关，与日志总行数无关。
+    重试造成的重复 event_id 在参与者内部去重；会话关闭后才到达的事件计为 late。
+    idle_rows=0 表示不提前关闭（输入不是按写入顺序时使用，例如分区目录）。
+    """
+
+    def __init__(self, emit_votes, emit_participant, idle_rows=200_000):
+        self.emit_votes = emit_votes
+        self.emit_participant = emit_participant
+        self.idle_rows = idle_rows
+
+        self._open = OrderedDict()
+        self._closed = set()
+
+        self.stats = {
+            "rows": 0,
+            "duplicates": 0,
+            "late": 0,
+            "participants": 0,
+            "completed": 0,
+            "final_votes": 0,
+            "max_open": 0
+        }
+
+    def feed(self, event):
+        self.stats["rows"] += 1
+        participant_id = event.get("participant_id", "")
+
+        if participant_id in self._closed:
+            self.stats["late"] += 1
+            return
+
+        state = self._open.get(participant_id)
+        if state is None:
+            state = {"events": [], "ids": set(), "duplicates": 0, "last_row": 0}
+            self._open[participant_id] = state
+            self.stats["max_open"] = max(self.stats["max_open"], len(self._open))
+        else:
+            self._open.move_to_end(participant_id)
+
+        state["last_row"] = self.stats["rows"]
+
+        event_id = event.get("event_id", "")
+        if event_id in state["ids"]:
+            state["duplicates"] += 1
+            self.stats["duplicates"] += 1
+        else:
+            state["ids"].add(event_id)
+            state["events"].append(event)
+
+        if self.idle_rows:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        cutoff = self.stats["rows"] - self.idle_rows
+
+        while self._open:
+            participant_id, state = next(iter(self._open.items()))
+            if state["last_row"] > cutoff:
+                break
+            self._close(participant_id)
+
+    def _close(self, participant_id):
+        state = self._open.pop(participant_id)
+        self._closed.add(participant_id)
+
+        votes, summary = reduce_participant(participant_id, state["events"], state["duplicates"])
+
+        self.stats["participants"] += 1
+        self.stats["final_votes"] += len(votes)
+        self.stats["completed"] += summary["completed"]
+
+        self.emit_votes(votes)
+        self.emit_participant(summary)
+
+    def finish(self):
+        for participant_id in list(self._open):
+            self._close(participant_id)
+
+
+def iter_events(paths, chunksize=50_000):
+    """
+    逐行产出 dict。CSV 用 csv.DictReader 流式读取（全部为字符串）；
+    Parquet 文件或目录按 record batch 读取。
+    """
+    for path in paths:
+        if os.path.isdir(path) or path.endswith(".parquet"):
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(path, format="parquet", partitioning="hive")
+            for batch in dataset.to_batches(batch_size=chunksize):
+                yield from batch.to_pylist()
+        else:
+            with open(path, newline="", encoding="utf-8") as f:
+                yield from csv.DictReader(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reconstruct the final vote of every participant from the append-only Events log in one pass."
+    )
+    parser.add_argument("events", nargs="+", help="Events CSV / Parquet files in write order, or a Parquet dataset directory.")
+    parser.add_argument("--votes", default="final_votes.csv")
+    parser.add_argument("--participants", default="participants.csv")
+    parser.add_argument(
+        "--idle-rows",
+        type=int,
+        default=200_000,
+        help="Close a participant after this many rows without new events (0 keeps every session open until the end)."
+    )
+    parser.add_argument("--chunksize", type=int, default=50_000, help="Rows per Parquet record batch.")
+    args = parser.parse_args()
+
+    if any(os.path.isdir(p) for p in args.events) and args.idle_rows:
+        print("Note: partitioned datasets are not in write order; using --idle-rows 0.")
+        args.idle_rows = 0
+
+    with open(args.votes, "w", newline="", encoding="utf-8") as vf, \
+            open(args.participants, "w", newline="", encoding="utf-8") as pf:
+        vote_writer = csv.DictWriter(vf, fieldnames=VOTE_COLUMNS, extrasaction="ignore")
+        participant_writer = csv.DictWriter(pf, fieldnames=PARTICIPANT_COLUMNS)
+        vote_writer.writeheader()
+        participant_writer.writeheader()
+
+        reducer = VoteReducer(
+            vote_writer.writerows,
+            participant_writer.writerow,
+            idle_rows=args.idle_rows
+        )
+
+        for event in iter_events(args.events, args.chunksize):
+            reducer.feed(event)
+        reducer.finish()
+
+    stats = reducer.stats
+    print(
+        f"Rows: {stats['rows']}, participants: {stats['participants']} "
+        f"({stats['completed']} completed), final votes: {stats['final_votes']} -> {args.votes}"
+    )
+    print(
+        f"Duplicate event_ids: {stats['duplicates']}, late events: {stats['late']}, "
+        f"max open sessions: {stats['max_open']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
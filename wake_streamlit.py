@@ -1,10 +1,20 @@
+import os
+import sys
+import json
 import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
+import argparse
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
 
 APP_URL = "https://subjective-perception-for-historic-centres.streamlit.app/"
 
+# Community Cloud 把应用放在 /~/+/ 下面代理；自建部署直接是 /_stcore/health
+HEALTH_PATHS = [
+    "~/+/_stcore/health",
+    "_stcore/health",
+]
+
 WAKE_KEYWORDS = [
     "wake",
     "activate",
@@ -14,8 +24,49 @@ WAKE_KEYWORDS = [
     "start",
 ]
 
+HISTORY_PATH = "wake_history.jsonl"
+
+
+def probe_health(app_url, timeout=10):
+    """
+    用普通 HTTP 请求检查健康端点，返回 (是否在线, 耗时秒数)。
+    应用休眠时这些路径返回休眠页或非 200，不会是 "ok"。
+    """
+    start = time.monotonic()
+
+    for path in HEALTH_PATHS:
+        url = app_url.rstrip("/") + "/" + path
+
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                body = response.read(64).decode("utf-8", "replace").strip().lower()
+                if response.status == 200 and body == "ok":
+                    return True, time.monotonic() - start
+        except (urllib.error.URLError, OSError):
+            continue
+
+    return False, time.monotonic() - start
+
+
+def wait_until_healthy(app_url, timeout, interval=3):
+    """
+    轮询健康端点直到应用上线，返回等待的秒数；超时返回 None。
+    """
+    start = time.monotonic()
+
+    while time.monotonic() - start < timeout:
+        healthy, _ = probe_health(app_url)
+        if healthy:
+            return time.monotonic() - start
+        time.sleep(interval)
+
+    return None
+
 
 def make_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     options = Options()
     options.add_argument("--headless=new")
     options.add_argument("--no-sandbox")
@@ -24,57 +75,162 @@ def make_driver():
     return webdriver.Chrome(options=options)
 
 
-def click_wake_button_if_present(driver):
-    buttons = driver.find_elements(By.TAG_NAME, "button")
+def find_wake_button(driver):
+    from selenium.webdriver.common.by import By
 
-    for button in buttons:
+    for button in driver.find_elements(By.TAG_NAME, "button"):
         text = (button.text or "").strip().lower()
         aria = (button.get_attribute("aria-label") or "").strip().lower()
         combined = f"{text} {aria}"
 
         if any(keyword in combined for keyword in WAKE_KEYWORDS):
-            print(f"Found possible wake button: {combined}")
-            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", button)
-            time.sleep(1)
-            driver.execute_script("arguments[0].click();", button)
-            return True
+            return button
 
-    return False
+    return None
 
 
-def main():
+def wake_with_browser(app_url, page_timeout):
+    """
+    只有健康检查失败时才启动浏览器：等待休眠页上的唤醒按钮出现并点击。
+    返回是否点击了按钮。
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+
     driver = make_driver()
 
     try:
-        print(f"Opening: {APP_URL}")
-        driver.get(APP_URL)
+        print(f"Opening: {app_url}")
+        driver.get(app_url)
 
-        time.sleep(10)
+        try:
+            button = WebDriverWait(driver, page_timeout, poll_frequency=1).until(find_wake_button)
+        except TimeoutException:
+            print("No wake button found. The app may be starting on its own.")
+            return False
 
-        clicked = click_wake_button_if_present(driver)
+        print(f"Found wake button: {(button.text or '').strip()}")
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", button)
+        driver.execute_script("arguments[0].click();", button)
+        return True
 
-        if clicked:
-            print("Wake/activate button clicked. Waiting for app to load...")
-            time.sleep(60)
-        else:
-            print("No wake button found. The app may already be active.")
+    finally:
+        driver.quit()
 
-        driver.get(APP_URL)
-        time.sleep(25)
 
-        page_text = driver.find_element(By.TAG_NAME, "body").text
+def append_history(path, record):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
 
-        print("Page text preview:")
-        print(page_text[:800])
 
-        if "Subjective Perception" in page_text or "Subjective Perceptions" in page_text:
-            print("Success: survey page appears to be loaded.")
-        else:
-            print("Warning: survey title not detected, but page was visited.")
+def print_history_summary(path, last=20):
+    if not os.path.exists(path):
+        return
 
-    finally:
-        driver.quit()
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    cold_starts = [
+        r["cold_start_seconds"] for r in records[-last:]
+        if r.get("cold_start_seconds") is not None
+    ]
+    asleep = sum(1 for r in records[-last:] if r["state"] != "awake")
+
+    print(f"History: {len(records)} runs, {asleep} of the last {min(last, len(records))} found the app asleep")
+    if cold_starts:
+        cold_starts.sort()
+        print(
+            f"Cold start (last {len(cold_starts)}): "
+            f"median {cold_starts[len(cold_starts) // 2]:.0f}s, max {cold_starts[-1]:.0f}s"
+        )
+
+
+def record_failure(path, record):
+    record["state"] = "failed"
+    append_history(path, record)
+    write_github_output(state="failed")
+    print_history_summary(path)
+
+
+def write_github_output(**values):
+    path = os.environ.get("GITHUB_OUTPUT")
+    if not path:
+        return
+
+    with open(path, "a", encoding="utf-8") as f:
+        for key, value in values.items():
+            f.write(f"{key}={value}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the Streamlit app awake: probe over HTTP, wake with a browser only when asleep."
+    )
+    parser.add_argument("--url", default=APP_URL)
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSON-lines file with one record per run.")
+    parser.add_argument("--probe-only", action="store_true", help="Only report whether the app is asleep; never start a browser.")
+    parser.add_argument("--page-timeout", type=float, default=60, help="Seconds to wait for the wake button.")
+    parser.add_argument("--start-timeout", type=float, default=300, help="Seconds to wait for the app to come back up.")
+    args = parser.parse_args()
+
+    record = {
+        "checked_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "url": args.url
+    }
+
+    healthy, probe_seconds = probe_health(args.url)
+    record["probe_seconds"] = round(probe_seconds, 3)
+
+    if healthy:
+        print(f"App is awake (health probe {probe_seconds:.2f}s).")
+        record["state"] = "awake"
+        append_history(args.history, record)
+        write_github_output(state="awake")
+        print_history_summary(args.history)
+        return 0
+
+    print("Health probe failed: the app appears to be asleep.")
+
+    if args.probe_only:
+        write_github_output(state="asleep")
+        return 0
+
+    wake_started = time.monotonic()
+
+    try:
+        clicked = wake_with_browser(args.url, args.page_timeout)
+    except ImportError:
+        print("Selenium is not installed; cannot open the sleep page.")
+        record["error"] = "selenium not installed"
+        record_failure(args.history, record)
+        return 1
+    except Exception as e:
+        # WebDriverException 等：Chrome 启动失败、休眠页加载失败或超时。失败的唤醒同样是要记录的冷启动数据
+        print(f"Browser wake failed: {type(e).__name__}: {e}")
+        record["wake_clicked"] = False
+        record["error"] = f"{type(e).__name__}: {e}"[:500]
+        record_failure(args.history, record)
+        return 1
+
+    record["wake_clicked"] = clicked
+
+    waited = wait_until_healthy(args.url, args.start_timeout)
+
+    if waited is None:
+        print(f"App did not come back within {args.start_timeout:.0f}s.")
+        record_failure(args.history, record)
+        return 1
+
+    cold_start = time.monotonic() - wake_started
+    print(f"Success: app is back up after {cold_start:.0f}s.")
+
+    record["state"] = "woken"
+    record["cold_start_seconds"] = round(cold_start, 1)
+    append_history(args.history, record)
+    write_github_output(state="woken")
+    print_history_summary(args.history)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())